@@ -2,79 +2,184 @@
 Advanced expense tracking features
 """
 from datetime import datetime, timedelta
-from database import ExpenseDatabase
-from config import CURRENCY
+import numpy as np
+from database import to_epoch
+from forecasting import ForecastEngine
+from recurring import FREQUENCIES, RecurringScheduler
+from storage import create_store
+from config import CURRENCY, EXPENSE_CATEGORIES
+
+class SpendingColumns:
+    """A user's recent spending as NumPy columns: day (epoch), category code, amount
+
+    Loaded from daily_rollups with one indexed range scan, one entry per
+    (day, category). Every metric is then a mask and a reduction over the
+    arrays, so asking for more metrics costs no more queries.
+    """
+    
+    def __init__(self, rows, days, today=None):
+        """rows are (day 'YYYY-MM-DD', category, total) as get_daily_totals returns them"""
+        self.days = days
+        day, category, amount = zip(*rows) if rows else ((), (), ())
+        self.ts = np.array(day, dtype='datetime64[D]').astype('datetime64[s]').astype(np.int64)
+        self.categories, self.codes = np.unique(np.array(category, dtype=str), return_inverse=True)
+        self.amounts = np.array(amount, dtype=np.float64)
+        today_ts = to_epoch(today or datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0))
+        # Calendar days before today: 0 is today, 6 the oldest day of a 7-day window.
+        # Days after today (a statement dated in a timezone ahead of UTC) count as
+        # today, the way the SQL summaries include them
+        self.age = np.maximum((today_ts - self.ts) // 86400, 0)
+    
+    @classmethod
+    def load(cls, db, user_id, days=30):
+        """Read the last `days` calendar days of a user's spending"""
+        return cls(db.get_daily_totals(user_id, days), days)
+    
+    def _window(self, days):
+        if days > self.days:
+            raise ValueError(f"Only the last {self.days} days are loaded, not {days}")
+        return self.age < days
+    
+    def total(self, days):
+        """Total spent over the last `days` calendar days"""
+        return float(self.amounts[self._window(days)].sum())
+    
+    def category_totals(self, days):
+        """Spending per category code over the last `days` calendar days"""
+        mask = self._window(days)
+        return np.bincount(self.codes[mask], weights=self.amounts[mask], minlength=len(self.categories))
+    
+    def daily_totals(self, days):
+        """Spending per calendar day, oldest first, zero for days without any"""
+        mask = self._window(days)
+        return np.bincount(self.age[mask], weights=self.amounts[mask], minlength=days)[::-1].astype(np.float64)
+    
+    def rolling_totals(self, window, days):
+        """Sum of each `window`-day run ending on each of the last days - window + 1 days"""
+        running = np.concatenate(([0.0], np.cumsum(self.daily_totals(days))))
+        return running[window:] - running[:-window]
+    
+    def trending_category(self, days):
+        """Category with the highest spending, None if nothing was spent"""
+        totals = self.category_totals(days)
+        if not totals.any():
+            return None
+        return str(self.categories[np.argmax(totals)])
+
+
+def budget_warning(total, budget):
+    """Warning text once monthly spending passes 80% of budget, else None"""
+    percentage = (total / budget) * 100
+    
+    if percentage > 100:
+        return f"⚠️ Warning: You've exceeded your monthly budget! Spent {percentage:.0f}%"
+    elif percentage > 80:
+        return f"💡 Caution: You've spent {percentage:.0f}% of your monthly budget"
+    return None
+
 
 class ExpenseAnalytics:
-    def __init__(self):
-        self.db = ExpenseDatabase()
+    def __init__(self, db=None, forecasts=None):
+        """forecasts is the ForecastEngine fed with new expenses (the bot's own), if any"""
+        self.db = db or create_store()
+        self.forecasts = forecasts or ForecastEngine(self.db)
+    
+    def load(self, user_id, days=30):
+        """A user's last `days` of spending as SpendingColumns"""
+        return SpendingColumns.load(self.db, user_id, days)
     
     def get_trending_category(self, user_id, days=30):
         """Get most spending category"""
-        expenses = self.db.get_summary(user_id, days)
-        if not expenses:
-            return None
-        return expenses[0][0]  # Category with highest amount
+        return self.load(user_id, days).trending_category(days)
     
     def get_daily_average(self, user_id, days=30):
         """Calculate daily average spending"""
-        expenses = self.db.get_summary(user_id, days)
-        if not expenses:
-            return 0
-        total = sum(amount for _, amount, _ in expenses)
-        return total / days
+        return self.load(user_id, days).total(days) / days
+    
+    def get_rolling_totals(self, user_id, window=7, days=30):
+        """Spending over each trailing `window`-day run in the last `days` days"""
+        return self.load(user_id, days).rolling_totals(window, days)
     
     def predict_monthly_spending(self, user_id):
-        """Predict monthly spending based on last 7 days"""
-        expenses = self.db.get_summary(user_id, 7)
-        if not expenses:
-            return 0
-        total_7 = sum(amount for _, amount, _ in expenses)
-        return total_7 * (30 / 7)
+        """Predict the next 30 days of spending from the user's incremental forecast model"""
+        return self.forecasts.forecast_total(user_id)
     
     def get_budget_warning(self, user_id, budget=5000):
         """Check if spending exceeds budget"""
-        expenses = self.db.get_summary(user_id, 30)
-        if not expenses:
-            return None
-        
-        total = sum(amount for _, amount, _ in expenses)
-        percentage = (total / budget) * 100
-        
-        if percentage > 100:
-            return f"⚠️ Warning: You've exceeded your monthly budget! Spent {percentage:.0f}%"
-        elif percentage > 80:
-            return f"💡 Caution: You've spent {percentage:.0f}% of your monthly budget"
-        return None
+        return budget_warning(self.load(user_id, 30).total(30), budget)
+    
+    def get_report(self, user_id, budget=5000, days=30):
+        """Every metric above from a single load of the user's data
+
+        The prediction comes from the forecast model, which only reads the
+        store the first time it sees the user.
+        """
+        columns = self.load(user_id, days)
+        month = columns.total(days)
+        return {
+            "trending_category": columns.trending_category(days),
+            "daily_average": month / days,
+            "rolling_7_days": columns.rolling_totals(7, days),
+            "predicted_monthly": self.predict_monthly_spending(user_id),
+            "budget_warning": budget_warning(month, budget),
+        }
 
 
 class BudgetManager:
     """Manage spending budgets by category"""
     
-    def __init__(self):
-        self.db = ExpenseDatabase()
+    def __init__(self, db=None):
+        self.db = db or create_store()
     
     def set_category_budget(self, user_id, category, amount):
-        """Set budget for specific category"""
-        # This would require a new table in the database
-        pass
+        """Set monthly budget for specific category (None removes it)"""
+        if category not in EXPENSE_CATEGORIES:
+            raise ValueError(f"Unknown category {category!r}")
+        if amount is not None and amount <= 0:
+            raise ValueError("Budget amount must be positive")
+        self.db.set_category_budget(user_id, category, amount)
     
     def check_category_budget(self, user_id, category):
-        """Check if category spending exceeds budget"""
-        pass
+        """(spent in the last 30 days, monthly limit) for a category, None if it has no budget"""
+        for name, limit, spent in self.db.get_category_budgets(user_id):
+            if name == category:
+                return spent, limit
+        return None
 
 
 class ExpenseRecurring:
     """Track recurring expenses"""
     
-    def __init__(self):
-        self.db = ExpenseDatabase()
+    def __init__(self, db=None):
+        self.db = db or create_store()
+        self.scheduler = RecurringScheduler(self.db)
     
-    def add_recurring_expense(self, user_id, amount, category, description, frequency="monthly"):
-        """Add recurring expense (monthly, weekly, daily)"""
+    def add_recurring_expense(self, user_id, amount, category, description, frequency="monthly", start=None):
+        """Add recurring expense first due at start (default now), return its id"""
         # Frequency: daily, weekly, monthly, yearly
-        pass
+        if frequency not in FREQUENCIES:
+            raise ValueError(f"Unknown frequency {frequency!r}, use one of: {', '.join(FREQUENCIES)}")
+        if category not in EXPENSE_CATEGORIES:
+            raise ValueError(f"Unknown category {category!r}")
+        if amount <= 0:
+            raise ValueError("Recurring amount must be positive")
+        start_ts = to_epoch(start or datetime.utcnow())
+        recurring_id = self.db.add_recurring_expense(user_id, amount, category, description, frequency, start_ts)
+        self.scheduler.schedule(user_id, recurring_id, frequency, start_ts)
+        return recurring_id
+    
+    def cancel_recurring_expense(self, user_id, recurring_id):
+        """Stop a recurring expense, return False if the user has no such id"""
+        deleted = self.db.delete_recurring_expense(recurring_id, user_id)
+        if deleted:
+            self.scheduler.cancel(user_id, recurring_id)
+        return deleted
+    
+    def auto_add_recurring(self, now=None, shard=None):
+        """Automatically add recurring expenses on schedule (on one shard, default all),
+        return {user_id: [(amount, category, ts)]} added"""
+        return self.scheduler.tick(now, shard)
     
-    def auto_add_recurring(self):
-        """Automatically add recurring expenses on schedule"""
-        pass
+    def add_due(self, user_id, recurring_id, now=None):
+        """Store the occurrences of one recurring expense already due, return them like auto_add_recurring"""
+        return self.scheduler.catch_up(user_id, recurring_id, now)
@@ -0,0 +1,93 @@
+"""
+Cold storage for old expenses
+Rows older than ARCHIVE_AFTER_DAYS move out of the hot expenses table into
+one SQLite file per year (expenses.archive-2023.db), attached on demand.
+Windowed queries only ever read the hot table; full-history reads UNION in
+the archives.
+"""
+import glob
+import os
+import re
+
+# Columns copied to the archive, ids included so a row keeps its identity
+ARCHIVE_COLUMNS = ("id, user_id, amount, category, description, date, source, "
+                   "transaction_id, account_name, payment_method, ts")
+
+
+def archive_path(db_path, year):
+    """Archive file holding one year of a database file's expenses"""
+    root, ext = os.path.splitext(db_path)
+    return f"{root}.archive-{year}{ext}"
+
+
+def archive_years(db_path):
+    """Years that already have an archive file next to db_path, oldest first"""
+    root, ext = os.path.splitext(db_path)
+    pattern = re.compile(re.escape(root) + r'\.archive-(\d{4})' + re.escape(ext) + '$')
+    years = []
+    for path in glob.glob(f"{glob.escape(root)}.archive-*{ext}"):
+        match = pattern.match(path)
+        if match:
+            years.append(int(match.group(1)))
+    return sorted(years)
+
+
+def attach_archive(conn, db_path, year):
+    """Attach (creating if needed) the archive for year, return its schema name
+
+    ATTACH cannot run inside a transaction, so call this before BEGIN.
+    """
+    schema = f"archive_{int(year)}"
+    attached = {row[1] for row in conn.execute('PRAGMA database_list')}
+    if schema not in attached:
+        conn.execute('ATTACH DATABASE ? AS ' + schema, (archive_path(db_path, year),))
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {schema}.expenses (
+                id INTEGER PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                amount REAL NOT NULL,
+                category TEXT NOT NULL,
+                description TEXT,
+                date TIMESTAMP,
+                source TEXT,
+                transaction_id TEXT,
+                account_name TEXT,
+                payment_method TEXT,
+                ts INTEGER
+            )
+        ''')
+        conn.execute(f'''
+            CREATE INDEX IF NOT EXISTS {schema}.idx_archive_user_ts
+            ON expenses (user_id, ts)
+        ''')
+        unique = conn.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE name = 'idx_archive_user_transaction'")
+        if unique.fetchone() is None:
+            # Archives written before the index existed may hold re-imported copies; the earliest wins
+            conn.execute(f'''
+                DELETE FROM {schema}.expenses
+                WHERE transaction_id IS NOT NULL
+                  AND id NOT IN (
+                      SELECT MIN(id) FROM {schema}.expenses
+                      WHERE transaction_id IS NOT NULL
+                      GROUP BY user_id, transaction_id
+                  )
+            ''')
+            conn.execute(f'''
+                CREATE UNIQUE INDEX {schema}.idx_archive_user_transaction
+                ON expenses (user_id, transaction_id) WHERE transaction_id IS NOT NULL
+            ''')
+        conn.commit()
+    return schema
+
+
+def attach_archives(conn, db_path):
+    """Attach every existing archive for db_path, return their schema names newest first
+
+    Inside a transaction (e.g. a read snapshot) ATTACH isn't possible, so
+    only the archives already attached are returned.
+    """
+    years = reversed(archive_years(db_path))
+    if conn.in_transaction:
+        attached = {row[1] for row in conn.execute('PRAGMA database_list')}
+        return [f"archive_{year}" for year in years if f"archive_{year}" in attached]
+    return [attach_archive(conn, db_path, year) for year in years]
@@ -0,0 +1,104 @@
+"""
+Non-blocking database access for the async bot handlers
+Every ExpenseDatabase call runs on a worker thread so a slow query or
+export never stalls the python-telegram-bot event loop.
+"""
+import asyncio
+import functools
+import inspect
+from concurrent.futures import ThreadPoolExecutor
+from config import DB_READER_THREADS
+from storage import create_store
+
+
+class AsyncExpenseDatabase:
+    """Awaitable facade over an ExpenseStore (ExpenseDatabase by default)
+
+    Reads run on a bounded pool of reader threads, writes on one writer
+    thread per shard, so users on different shards never queue behind each
+    other. Each worker keeps its own dedicated connections.
+    """
+
+    READ_METHODS = {
+        'get_expenses',
+        'search_expenses',
+        'get_summary',
+        'get_multi_window_summary',
+        'get_total_today',
+        'get_total_week',
+        'get_total_month',
+        'get_budget_limits',
+        'get_budget_snapshot',
+        'get_daily_totals',
+        'get_category_budgets',
+        'get_recurring_expenses',
+        'get_shard_stats',
+        'get_cache_stats',
+    }
+
+    WRITE_METHODS = {
+        'add_expense',
+        'delete_expense',
+        'set_budget_limit',
+        'set_category_budget',
+        'flush',
+        'maintain',
+    }
+
+    def __init__(self, db=None, reader_threads=DB_READER_THREADS):
+        self.sync = db or create_store()
+        self._readers = ThreadPoolExecutor(
+            max_workers=reader_threads,
+            thread_name_prefix="db-reader",
+            initializer=self.sync.open_connections,
+        )
+        self._writers = [
+            ThreadPoolExecutor(
+                max_workers=1,
+                thread_name_prefix=f"db-writer-{shard}",
+                initializer=self.sync.open_connections,
+            )
+            for shard in range(self.sync.shards)
+        ]
+
+    async def run(self, func, *args, **kwargs):
+        """Run a blocking read-side callable (e.g. an export) on a reader thread"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, functools.partial(func, *args, **kwargs))
+
+    async def run_write(self, func, *args, shard=0, **kwargs):
+        """Run a blocking callable that writes on the given shard's writer thread"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._writers[shard], functools.partial(func, *args, **kwargs))
+
+    async def add_user(self, user_id, username, first_name):
+        """Register a user, without leaving the event loop if already known"""
+        if self.sync.is_known_user(user_id, username, first_name):
+            return
+        await self.run_write(self.sync.add_user, user_id, username, first_name,
+                             shard=self.sync.shard_for(user_id))
+
+    def __getattr__(self, name):
+        if name not in self.READ_METHODS and name not in self.WRITE_METHODS:
+            raise AttributeError(f"{type(self).__name__} has no attribute {name!r}")
+
+        method = getattr(self.sync, name)
+        signature = inspect.signature(method)
+
+        @functools.wraps(method)
+        async def call(*args, **kwargs):
+            if name in self.READ_METHODS:
+                return await self.run(method, *args, **kwargs)
+            # Writes queue on the writer of the shard that owns user_id
+            user_id = signature.bind(*args, **kwargs).arguments.get('user_id')
+            shard = self.sync.shard_for(user_id) if user_id is not None else 0
+            return await self.run_write(method, *args, shard=shard, **kwargs)
+
+        return call
+
+    def close(self):
+        """Wait for queued work, then close the worker connections"""
+        for writer in self._writers:
+            writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+        self.sync.close()
@@ -0,0 +1,331 @@
+"""
+Database benchmark for the Expense Tracker
+Builds a large synthetic database and measures how many text messages
+per second the storage layer can handle.
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+from analytics import ExpenseAnalytics
+from config import EXPENSE_CATEGORIES
+from database import ExpenseDatabase, to_epoch
+from storage import InMemoryExpenseDatabase
+
+
+# Words the synthetic descriptions are built from
+DESCRIPTION_WORDS = [
+    "biryani", "coffee", "uber", "ola", "petrol", "groceries", "netflix", "rent", "electricity",
+    "pharmacy", "movie", "pizza", "metro", "chai", "shoes", "internet", "gym", "books",
+    "dinner", "lunch", "breakfast", "taxi", "flight", "hotel", "recharge", "salon", "snacks",
+    "vegetables", "fruits", "milk", "bakery", "parking", "toll", "insurance", "doctor",
+]
+
+
+class PerCallConnectionDatabase(ExpenseDatabase):
+    """Reproduces the old behaviour: a fresh connection for every call"""
+
+    def _get_connection(self, shard=0):
+        return sqlite3.connect(self.shard_paths[shard])
+
+
+def build_database(path, rows, users):
+    """Create a database at path filled with synthetic expenses"""
+    db = ExpenseDatabase(path)
+    db.close()
+
+    rng = random.Random(42)
+    now = datetime.utcnow()
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.executemany(
+            'INSERT INTO users (user_id, username, first_name) VALUES (?, ?, ?)',
+            ((user_id, f"user{user_id}", "Bench") for user_id in range(1, users + 1))
+        )
+
+    def generate():
+        for _ in range(rows):
+            date = now - timedelta(seconds=rng.randint(0, 365 * 24 * 3600))
+            yield (
+                rng.randint(1, users),
+                round(rng.uniform(10, 2000), 2),
+                rng.choice(EXPENSE_CATEGORIES),
+                " ".join(rng.sample(DESCRIPTION_WORDS, 3)),
+                date.strftime("%Y-%m-%d %H:%M:%S"),
+                to_epoch(date),
+                "text",
+            )
+
+    with conn:
+        conn.executemany('''
+            INSERT INTO expenses (user_id, amount, category, description, date, ts, source)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', generate())
+    conn.close()
+
+
+def simulate_message(db, user_id):
+    """Storage calls made by main.handle_message for one text expense"""
+    db.add_user(user_id, f"user{user_id}", "Bench")
+    db.add_expense(user_id, 150.0, "Food", "Spent 150 for biriyani", source="text")
+    db.get_budget_snapshot(user_id)
+
+
+def run_messages(db, messages, users):
+    """Replay messages from random users, return messages per second"""
+    rng = random.Random(7)
+    start = time.perf_counter()
+    for _ in range(messages):
+        simulate_message(db, rng.randint(1, users))
+    elapsed = time.perf_counter() - start
+    return messages / elapsed
+
+
+def benchmark_connections(path, messages, users):
+    """Compare connect-per-call against pooled connections"""
+    print("Connection handling (messages/second):")
+
+    legacy = PerCallConnectionDatabase(path)
+    legacy_rate = run_messages(legacy, messages, users)
+    print(f"  connect per call : {legacy_rate:10.1f}")
+
+    pooled = ExpenseDatabase(path)
+    pooled_rate = run_messages(pooled, messages, users)
+    pooled.close()
+    print(f"  pooled (WAL)     : {pooled_rate:10.1f}")
+    print(f"  speedup          : {pooled_rate / legacy_rate:10.2f}x")
+
+
+def benchmark_queries(path, users, samples=500):
+    """Average latency of the per-user read queries"""
+    print("Per-user query latency (ms):")
+    db = ExpenseDatabase(path, result_cache=False)
+    rng = random.Random(11)
+    queries = [
+        ("get_summary(30)", lambda user_id: db.get_summary(user_id, 30)),
+        ("get_expenses(7)", lambda user_id: db.get_expenses(user_id, 7)),
+        ("get_total_month", db.get_total_month),
+        ("3x get_summary", lambda user_id: [db.get_summary(user_id, days) for days in (1, 7, 30)]),
+        ("multi-window", lambda user_id: db.get_multi_window_summary(user_id, (1, 7, 30))),
+    ]
+    for name, query in queries:
+        start = time.perf_counter()
+        for _ in range(samples):
+            query(rng.randint(1, users))
+        elapsed = (time.perf_counter() - start) * 1000 / samples
+        print(f"  {name:<17}: {elapsed:10.3f}")
+    db.close()
+
+
+def benchmark_search(path, users, samples=200):
+    """Compare FTS description search against a LIKE scan of the user's rows
+
+    A LIKE on a common word can stop after the newest ten hits, so it is
+    timed for a word that never matches too: that is the full scan a user
+    with a long history pays for every rare term.
+    """
+    print("Description search latency (ms):")
+    db = ExpenseDatabase(path)
+    conn = db._get_connection()
+    rng = random.Random(17)
+    user_ids = [rng.randint(1, users) for _ in range(samples)]
+    words = [rng.choice(DESCRIPTION_WORDS) for _ in range(samples)]
+
+    def like(user_id, word):
+        return conn.execute(
+            "SELECT id FROM expenses WHERE user_id = ? AND description LIKE ? ORDER BY ts DESC LIMIT 10",
+            (user_id, f"%{word}%")).fetchall()
+
+    for label, terms in (("common word", words), ("missing word", ["zzyzx"] * samples)):
+        for name, search in ((f"LIKE, {label}", like), (f"FTS5, {label}", db.search_expenses)):
+            start = time.perf_counter()
+            for user_id, word in zip(user_ids, terms):
+                search(user_id, word)
+            elapsed = (time.perf_counter() - start) * 1000 / samples
+            print(f"  {name:<19}: {elapsed:10.3f}")
+    db.close()
+
+
+def run_inserts(db, inserts, users):
+    """Insert expenses for random users, return inserts per second"""
+    rng = random.Random(13)
+    start = time.perf_counter()
+    for _ in range(inserts):
+        db.add_expense(rng.randint(1, users), 99.0, "Food", "Coffee", source="text")
+    db.flush()
+    elapsed = time.perf_counter() - start
+    return inserts / elapsed
+
+
+def per_metric_report(db, user_id, budget=5000):
+    """The analytics report the way ExpenseAnalytics used to build it: a
+    get_summary query per metric, summed in Python"""
+    month = db.get_summary(user_id, 30)
+    trending = month[0][0] if month else None
+    average = sum(amount for _, amount, _ in db.get_summary(user_id, 30)) / 30
+    predicted = sum(amount for _, amount, _ in db.get_summary(user_id, 7)) * (30 / 7)
+    percentage = sum(amount for _, amount, _ in db.get_summary(user_id, 30)) / budget * 100
+    rolling = [sum(amount for _, amount, _ in db.get_summary(user_id, 7))]
+    return trending, average, predicted, percentage, rolling
+
+
+def benchmark_analytics(path, users, samples=500):
+    """Compare one columnar load per report against a query per metric
+
+    The per-metric report only gets the latest 7-day total; the columnar
+    one computes all 24 rolling 7-day windows in the same time. The bot's
+    forecast models are warmed once per user and then updated as expenses
+    arrive, so they are warmed before timing here too.
+    """
+    print("Analytics report latency (ms):")
+    db = ExpenseDatabase(path, result_cache=False)
+    analytics = ExpenseAnalytics(db)
+    rng = random.Random(23)
+    user_ids = [rng.randint(1, users) for _ in range(samples)]
+    for user_id in set(user_ids):
+        analytics.predict_monthly_spending(user_id)
+    for name, report in (("query per metric", lambda user_id: per_metric_report(db, user_id)),
+                         ("numpy columns", analytics.get_report)):
+        start = time.perf_counter()
+        for user_id in user_ids:
+            report(user_id)
+        elapsed = (time.perf_counter() - start) * 1000 / samples
+        print(f"  {name:<17}: {elapsed:10.3f}")
+    db.close()
+
+
+def benchmark_result_cache(path, users, requests=5000, active_users=100, write_ratio=0.1):
+    """Replay /stats and /limits reads mixed with some new expenses, with and
+    without the per-user result cache"""
+    print(f"Read-heavy command mix, {write_ratio:.0%} writes (requests/second):")
+    rates = {}
+    for name, enabled in (("no cache", False), ("result cache", True)):
+        db = ExpenseDatabase(path, result_cache=enabled)
+        rng = random.Random(29)
+        start = time.perf_counter()
+        for _ in range(requests):
+            user_id = rng.randint(1, min(users, active_users))
+            if rng.random() < write_ratio:
+                db.add_expense(user_id, 25.0, "Food", "Tea", source="text")
+            else:
+                db.get_multi_window_summary(user_id, (7, 30))
+                db.get_budget_snapshot(user_id)
+        rates[name] = requests / (time.perf_counter() - start)
+        if enabled:
+            stats = db.get_cache_stats()
+        db.close()
+        print(f"  {name:<17}: {rates[name]:10.1f}")
+    print(f"  speedup          : {rates['result cache'] / rates['no cache']:10.2f}x"
+          f" ({stats['hit_rate']:.0%} hit rate)")
+
+
+def benchmark_inserts(path, inserts, users):
+    """Compare one commit per insert against write-behind group commits"""
+    print("Insert throughput (inserts/second):")
+
+    direct = ExpenseDatabase(path, write_behind=False)
+    direct_rate = run_inserts(direct, inserts, users)
+    direct.close()
+    print(f"  commit per insert: {direct_rate:10.1f}")
+
+    queued = ExpenseDatabase(path, write_behind=True)
+    queued_rate = run_inserts(queued, inserts, users)
+    queued.close()
+    print(f"  write-behind     : {queued_rate:10.1f}")
+    print(f"  speedup          : {queued_rate / direct_rate:10.2f}x")
+
+
+def run_concurrent_inserts(db, inserts, users, threads):
+    """Insert from several threads at once, return inserts per second"""
+    per_thread = inserts // threads
+
+    def worker(seed):
+        rng = random.Random(seed)
+        for _ in range(per_thread):
+            db.add_expense(rng.randint(1, users), 99.0, "Food", "Coffee", source="text")
+
+    workers = [threading.Thread(target=worker, args=(seed,)) for seed in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return per_thread * threads / elapsed
+
+
+def benchmark_shards(tmp_dir, inserts, users, threads=4):
+    """Compare concurrent writers on one file against user-sharded files"""
+    print(f"Concurrent inserts, {threads} writer threads (inserts/second):")
+    rates = {}
+    for shards in (1, threads):
+        db = ExpenseDatabase(os.path.join(tmp_dir, f"sharded-{shards}.db"), write_behind=False, shards=shards)
+        rates[shards] = run_concurrent_inserts(db, inserts, users, threads)
+        db.close()
+        label = f"{shards} shard(s)"
+        print(f"  {label:<17}: {rates[shards]:10.1f}")
+    print(f"  speedup          : {rates[threads] / rates[1]:10.2f}x")
+
+
+def benchmark_engines(tmp_dir, inserts, users, samples=500):
+    """Run the same insert and read workload against each storage engine"""
+    print("Storage engines, same workload:")
+    engines = [
+        ("sqlite", lambda: ExpenseDatabase(os.path.join(tmp_dir, "engines.db"), write_behind=True)),
+        ("memory", InMemoryExpenseDatabase),
+    ]
+    for name, make in engines:
+        db = make()
+        rate = run_inserts(db, inserts, users)
+        rng = random.Random(19)
+        start = time.perf_counter()
+        for _ in range(samples):
+            user_id = rng.randint(1, users)
+            db.get_summary(user_id, 30)
+            db.get_expenses(user_id, limit=10)
+        latency = (time.perf_counter() - start) * 1000 / samples
+        db.close()
+        print(f"  {name:<17}: {rate:10.1f} inserts/s, {latency:.3f} ms per summary + page")
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--rows", type=int, default=1_000_000, help="expenses to generate")
+    arg_parser.add_argument("--users", type=int, default=1000, help="distinct users")
+    arg_parser.add_argument("--messages", type=int, default=2000, help="messages to replay")
+    arg_parser.add_argument("--inserts", type=int, default=20000, help="expenses to insert")
+    args = arg_parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "benchmark.db")
+        print(f"Building database with {args.rows:,} rows for {args.users:,} users...")
+        start = time.perf_counter()
+        build_database(path, args.rows, args.users)
+        print(f"  built in {time.perf_counter() - start:.1f}s\n")
+
+        benchmark_connections(path, args.messages, args.users)
+        print()
+        benchmark_queries(path, args.users)
+        print()
+        benchmark_search(path, args.users)
+        print()
+        benchmark_analytics(path, args.users)
+        print()
+        benchmark_result_cache(path, args.users)
+        print()
+        benchmark_inserts(path, args.inserts, args.users)
+        print()
+        benchmark_shards(tmp_dir, args.inserts, args.users)
+        print()
+        benchmark_engines(tmp_dir, args.inserts, args.users)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,21 +1,63 @@
 """
 Telegram bot command handlers
 """
+import asyncio
+import functools
+import logging
 import os
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import TelegramError
 from telegram.ext import ContextTypes
-from database import ExpenseDatabase
-from config import CURRENCY, EXPENSE_CATEGORIES
-from datetime import datetime
+from async_database import AsyncExpenseDatabase
+from analytics import ExpenseRecurring
+from budget_alerts import BudgetAlertEngine, format_alert
+from database import from_epoch
+from config import ADMIN_USER_IDS, CURRENCY, EXPENSE_CATEGORIES, FORECAST_MIN_DAYS
+from datetime import datetime, timedelta
 from excel_exporter import ExcelExporter
-
-db = ExpenseDatabase()
-exporter = ExcelExporter()
+from forecasting import HORIZON_DAYS, ForecastEngine, format_forecast_warning
+from importer import ExpenseImporter
+from recurring import FREQUENCIES
+
+# The shared store and the engines on top of it; open_store() sets them up when
+# the bot starts, so importing this module doesn't open or migrate expenses.db
+db = exporter = importer = budget_alerts = forecasts = recurring = None
+logger = logging.getLogger(__name__)
+
+def open_store(store=None):
+    """Build the async database over `store` (default create_store()) and the engines the commands use"""
+    global db, exporter, importer, budget_alerts, forecasts, recurring
+    db = AsyncExpenseDatabase(store)
+    exporter = ExcelExporter(db.sync)
+    importer = ExpenseImporter(db.sync)
+    budget_alerts = BudgetAlertEngine(db.sync)
+    forecasts = ForecastEngine(db.sync)
+    recurring = ExpenseRecurring(db.sync)
+    return db
+
+async def budget_alert_lines(user_id, amount, category, ts=None):
+    """Feed a stored expense to the budget and forecast engines, return the alert lines it triggers"""
+    alerts = await db.run(budget_alerts.record_expense, user_id, amount, category, ts)
+    overruns = await db.run(forecasts.record_expense, user_id, amount, category, ts)
+    return [format_alert(*alert) for alert in alerts] + [format_forecast_warning(*overrun) for overrun in overruns]
+
+async def send_recurring_alerts(bot, added) -> None:
+    """Alert on materialized recurring expenses ({user_id: [(amount, category, ts)]}) like any other"""
+    for user_id, rows in added.items():
+        lines = []
+        for amount, category, ts in rows:
+            lines += await budget_alert_lines(user_id, amount, category, ts)
+        if not lines:
+            continue
+        try:
+            await bot.send_message(user_id, "*Budget Alert:*\n" + "\n".join(lines), parse_mode='Markdown')
+        except TelegramError as e:
+            logger.warning("Couldn't send recurring expense alerts to %s: %s", user_id, e)
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Start command handler"""
     user = update.effective_user
-    db.add_user(user.id, user.username, user.first_name)
+    await db.add_user(user.id, user.username, user.first_name)
     
     welcome_text = f"""
 👋 Welcome to Expense Tracker AI Agent, {user.first_name}!
@@ -53,7 +95,8 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 /weekly - Last 7 days summary
 /month - Last 30 days summary
 /today - Today's total
-/list - Show last 10 expenses
+/list - Show last 10 expenses (page with Older/Newer)
+/search <words> - Find expenses by description (from:/to:/page:)
 /stats - Detailed statistics
 
 *BUDGET MANAGEMENT:*
@@ -61,6 +104,10 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 /setweekly <amount> - Set weekly budget limit  
 /setmonthly <amount> - Set monthly budget limit
 /limits - View current budget status
+/setbudget <category> <amount> - Set a monthly budget for one category
+/budgets - View category budgets
+/forecast - Forecast the next 30 days of spending
+/recurring - List, add or cancel recurring expenses
 
 *REPORTS:*
 /week - Weekly report with breakdown
@@ -79,6 +126,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 /categories - Show all categories
 /delete - Delete last expense
 /list - Show last 10 expenses
+/import - Import a CSV/XLSX bank statement
 
 *HOW TO ADD EXPENSES:*
 Send natural language messages:
@@ -108,7 +156,7 @@ Use /limits to monitor your budget usage!
 async def summary(update: Update, context: ContextTypes.DEFAULT_TYPE, days: int = 30) -> None:
     """Show expense summary"""
     user_id = update.effective_user.id
-    expenses = db.get_summary(user_id, days)
+    expenses = await db.get_summary(user_id, days)
     
     if not expenses:
         await update.message.reply_text("No expenses found for this period.")
@@ -136,7 +184,7 @@ async def monthly_summary(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 async def today_total(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Show today's total"""
     user_id = update.effective_user.id
-    total = db.get_total_today(user_id)
+    total = await db.get_total_today(user_id)
     
     message = f"💸 **Today's Spending: {CURRENCY}{total:.2f}**"
     await update.message.reply_text(message, parse_mode='Markdown')
@@ -149,42 +197,142 @@ async def show_categories(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     
     await update.message.reply_text(categories_text, parse_mode='Markdown')
 
+LIST_PAGE_SIZE = 10
+
+async def _expense_page(user_id, before=None, after=None):
+    """Build the text and older/newer keyboard for one page of expenses"""
+    if after:
+        expenses = await db.get_expenses(user_id, limit=LIST_PAGE_SIZE + 1, after_ts=after[0], after_id=after[1])
+        has_newer = len(expenses) > LIST_PAGE_SIZE
+        expenses = expenses[-LIST_PAGE_SIZE:]
+        has_older = True
+    else:
+        kwargs = {'before_ts': before[0], 'before_id': before[1]} if before else {}
+        expenses = await db.get_expenses(user_id, limit=LIST_PAGE_SIZE + 1, **kwargs)
+        has_older = len(expenses) > LIST_PAGE_SIZE
+        expenses = expenses[:LIST_PAGE_SIZE]
+        has_newer = before is not None
+
+    if not expenses:
+        return None, None
+
+    list_text = "📝 **Last 10 Expenses:**\n\n" if not (before or after) else "📝 **Expenses:**\n\n"
+    for idx, (exp_id, amount, category, description, ts) in enumerate(expenses, 1):
+        date_obj = from_epoch(ts)
+        date_str = date_obj.strftime("%d-%m-%Y %H:%M")
+        list_text += f"{idx}. {category} - {CURRENCY}{amount:.2f} ({date_str})\n"
+
+    # Callback data carries the keyset cursor: list|<direction>|<ts>|<id>
+    buttons = []
+    if has_newer:
+        first_id, first_ts = expenses[0][0], expenses[0][4]
+        buttons.append(InlineKeyboardButton("⬅️ Newer", callback_data=f"list|newer|{first_ts}|{first_id}"))
+    if has_older:
+        last_id, last_ts = expenses[-1][0], expenses[-1][4]
+        buttons.append(InlineKeyboardButton("Older ➡️", callback_data=f"list|older|{last_ts}|{last_id}"))
+    keyboard = InlineKeyboardMarkup([buttons]) if buttons else None
+
+    return list_text, keyboard
+
 async def list_expenses(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """List last 10 expenses"""
+    """List last 10 expenses with older/newer paging"""
     user_id = update.effective_user.id
-    expenses = db.get_expenses(user_id)[:10]
+    list_text, keyboard = await _expense_page(user_id)
     
-    if not expenses:
+    if not list_text:
         await update.message.reply_text("No expenses found.")
         return
     
-    list_text = "📝 **Last 10 Expenses:**\n\n"
-    for idx, (exp_id, amount, category, description, date) in enumerate(expenses, 1):
-        date_obj = datetime.fromisoformat(date)
-        date_str = date_obj.strftime("%d-%m-%Y %H:%M")
-        list_text += f"{idx}. {category} - {CURRENCY}{amount:.2f} ({date_str})\n"
+    await update.message.reply_text(list_text, parse_mode='Markdown', reply_markup=keyboard)
+
+async def list_expenses_page(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle older/newer buttons under /list"""
+    query = update.callback_query
+    await query.answer()
+    
+    _, direction, ts, exp_id = query.data.split('|')
+    cursor = (int(ts), int(exp_id))
+    user_id = update.effective_user.id
+    
+    if direction == 'older':
+        list_text, keyboard = await _expense_page(user_id, before=cursor)
+    else:
+        list_text, keyboard = await _expense_page(user_id, after=cursor)
+    
+    if not list_text:
+        await query.edit_message_text("No more expenses.")
+        return
     
-    await update.message.reply_text(list_text, parse_mode='Markdown')
+    await query.edit_message_text(list_text, parse_mode='Markdown', reply_markup=keyboard)
 
 async def delete_expense(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Delete last expense"""
     user_id = update.effective_user.id
-    expenses = db.get_expenses(user_id)
+    expenses = await db.get_expenses(user_id, limit=1)
     
     if not expenses:
         await update.message.reply_text("No expenses to delete.")
         return
     
-    exp_id = expenses[0][0]
-    db.delete_expense(exp_id, user_id)
+    exp_id, amount, category, _, ts = expenses[0]
+    await db.delete_expense(exp_id, user_id)
+    budget_alerts.remove_expense(user_id, amount, ts, category)
+    forecasts.forget(user_id)
     
     await update.message.reply_text("✅ Last expense deleted!")
 
+SEARCH_PAGE_SIZE = 10
+
+async def search_expenses(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Full-text search over expense descriptions"""
+    user_id = update.effective_user.id
+    
+    terms, start, end, page = [], None, None, 1
+    try:
+        for arg in context.args or []:
+            key, _, value = arg.partition(':')
+            if key == 'from' and value:
+                start = datetime.strptime(value, "%Y-%m-%d")
+            elif key == 'to' and value:
+                end = datetime.strptime(value, "%Y-%m-%d") + timedelta(days=1)
+            elif key == 'page' and value:
+                page = max(1, int(value))
+            else:
+                terms.append(arg)
+    except ValueError:
+        await update.message.reply_text("❌ Dates must look like 2024-03-31 and page must be a number.")
+        return
+    
+    if not terms:
+        await update.message.reply_text(
+            "🔍 Usage: /search <words> [from:YYYY-MM-DD] [to:YYYY-MM-DD] [page:N]\n"
+            "Example: /search biryani from:2024-01-01"
+        )
+        return
+    
+    text = ' '.join(terms)
+    # Fetch one extra row to know whether a next page exists
+    results = await db.search_expenses(user_id, text, start=start, end=end,
+                                       limit=SEARCH_PAGE_SIZE + 1, offset=(page - 1) * SEARCH_PAGE_SIZE)
+    
+    if not results:
+        await update.message.reply_text(f"🔍 No expenses found for \"{text}\".")
+        return
+    
+    search_text = f"🔍 Results for \"{text}\" (page {page}):\n\n"
+    for idx, (exp_id, amount, category, description, ts) in enumerate(results[:SEARCH_PAGE_SIZE], 1):
+        date_str = from_epoch(ts).strftime("%d-%m-%Y")
+        search_text += f"{idx}. {description} - {CURRENCY}{amount:.2f} ({category}, {date_str})\n"
+    if len(results) > SEARCH_PAGE_SIZE:
+        search_text += f"\nMore results: add page:{page + 1} to your search"
+    
+    await update.message.reply_text(search_text)
+
 async def statistics(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Show detailed statistics"""
     user_id = update.effective_user.id
-    expenses_30 = db.get_summary(user_id, 30)
-    expenses_7 = db.get_summary(user_id, 7)
+    summaries = await db.get_multi_window_summary(user_id, (7, 30))
+    expenses_7, expenses_30 = summaries[7], summaries[30]
     
     stats_text = "📈 **Detailed Statistics**\n\n"
     
@@ -224,7 +372,7 @@ async def export_all(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
     
     try:
         # Generate Excel file
-        filename = exporter.export_all_expenses(user_id)
+        filename = await db.run(exporter.export_all_expenses, user_id)
         
         # Send file to user
         with open(filename, 'rb') as excel_file:
@@ -250,7 +398,7 @@ async def export_monthly(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     
     try:
         # Generate Excel file
-        filename = exporter.export_monthly_expenses(user_id)
+        filename = await db.run(exporter.export_monthly_expenses, user_id)
         
         # Send file to user
         with open(filename, 'rb') as excel_file:
@@ -276,7 +424,7 @@ async def export_weekly(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     
     try:
         # Generate Excel file
-        filename = exporter.export_custom_period(user_id, days=7)
+        filename = await db.run(exporter.export_custom_period, user_id, days=7)
         
         # Send file to user
         with open(filename, 'rb') as excel_file:
@@ -302,7 +450,7 @@ async def export_today_data(update: Update, context: ContextTypes.DEFAULT_TYPE)
     
     try:
         # Generate Excel file
-        filename = exporter.export_custom_period(user_id, days=1)
+        filename = await db.run(exporter.export_custom_period, user_id, days=1)
         
         # Send file to user
         with open(filename, 'rb') as excel_file:
@@ -332,7 +480,9 @@ async def set_daily_limit(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     
     try:
         amount = float(context.args[0])
-        db.set_budget_limit(user_id, 'daily', amount)
+        await db.set_budget_limit(user_id, 'daily', amount)
+        budget_alerts.forget(user_id)
+        forecasts.forget(user_id)
         await update.message.reply_text(f"✅ Daily limit set to {CURRENCY}{amount:.2f}")
     except ValueError:
         await update.message.reply_text("❌ Invalid amount. Please enter a number.")
@@ -347,7 +497,9 @@ async def set_weekly_limit(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     
     try:
         amount = float(context.args[0])
-        db.set_budget_limit(user_id, 'weekly', amount)
+        await db.set_budget_limit(user_id, 'weekly', amount)
+        budget_alerts.forget(user_id)
+        forecasts.forget(user_id)
         await update.message.reply_text(f"✅ Weekly limit set to {CURRENCY}{amount:.2f}")
     except ValueError:
         await update.message.reply_text("❌ Invalid amount. Please enter a number.")
@@ -362,7 +514,9 @@ async def set_monthly_limit(update: Update, context: ContextTypes.DEFAULT_TYPE)
     
     try:
         amount = float(context.args[0])
-        db.set_budget_limit(user_id, 'monthly', amount)
+        await db.set_budget_limit(user_id, 'monthly', amount)
+        budget_alerts.forget(user_id)
+        forecasts.forget(user_id)
         await update.message.reply_text(f"✅ Monthly limit set to {CURRENCY}{amount:.2f}")
     except ValueError:
         await update.message.reply_text("❌ Invalid amount. Please enter a number.")
@@ -387,7 +541,8 @@ async def check_limits(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     """Check budget status"""
     user_id = update.effective_user.id
     
-    daily_limit, weekly_limit, monthly_limit = db.get_budget_limits(user_id)
+    (daily_limit, weekly_limit, monthly_limit,
+     today_total, week_total, month_total) = await db.get_budget_snapshot(user_id)
     
     if not any([daily_limit, weekly_limit, monthly_limit]):
         await update.message.reply_text(
@@ -399,10 +554,6 @@ async def check_limits(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         )
         return
     
-    today_total = db.get_total_today(user_id)
-    week_total = db.get_total_week(user_id)
-    month_total = db.get_total_month(user_id)
-    
     limits_text = "💰 **Budget Status**\n\n"
     
     if daily_limit:
@@ -419,10 +570,159 @@ async def check_limits(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     
     await update.message.reply_text(limits_text, parse_mode='Markdown')
 
+async def set_category_budget(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Set or remove a monthly budget for one category"""
+    user_id = update.effective_user.id
+    
+    if len(context.args) != 2:
+        await update.message.reply_text(
+            "❌ Usage: /setbudget <category> <amount>\n"
+            "Example: `/setbudget Food 3000`\n"
+            "Use `/setbudget Food off` to remove a budget.",
+            parse_mode='Markdown'
+        )
+        return
+    
+    name, value = context.args
+    category = next((c for c in EXPENSE_CATEGORIES if c.lower() == name.lower()), None)
+    if category is None:
+        await update.message.reply_text(f"❌ Unknown category. Choose one of: {', '.join(EXPENSE_CATEGORIES)}")
+        return
+    
+    try:
+        amount = None if value.lower() == 'off' else float(value)
+        if amount is not None and amount < 0:
+            raise ValueError
+    except ValueError:
+        await update.message.reply_text("❌ Invalid amount. Please enter a positive number or 'off'.")
+        return
+    
+    await db.set_category_budget(user_id, category, amount or None)
+    budget_alerts.forget(user_id)
+    forecasts.forget(user_id)
+    if amount:
+        await update.message.reply_text(f"✅ {category} budget set to {CURRENCY}{amount:.2f} per month")
+    else:
+        await update.message.reply_text(f"✅ {category} budget removed")
+
+async def list_category_budgets(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Show spending against each category budget (last 30 days)"""
+    user_id = update.effective_user.id
+    budgets = await db.get_category_budgets(user_id)
+    
+    if not budgets:
+        await update.message.reply_text(
+            "❌ No category budgets set.\n\nSet one using:\n`/setbudget Food 3000`",
+            parse_mode='Markdown'
+        )
+        return
+    
+    budgets_text = "🏷️ **Category Budgets (Last 30 Days)**\n\n"
+    for category, limit, spent in budgets:
+        status, percentage = get_limit_status(spent, limit)
+        budgets_text += f"{status} **{category}:** {CURRENCY}{spent:.2f} / {CURRENCY}{limit:.2f} ({percentage:.0f}%)\n"
+    
+    await update.message.reply_text(budgets_text, parse_mode='Markdown')
+
+async def forecast(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Forecast the next 30 days from recent spending, with trends per category"""
+    user_id = update.effective_user.id
+    result = await db.run(forecasts.forecast, user_id)
+    
+    if result is None:
+        await update.message.reply_text(
+            f"🔮 Not enough history yet. Keep logging expenses for {FORECAST_MIN_DAYS} days to get a forecast."
+        )
+        return
+    
+    forecast_text = f"🔮 **Forecast (Next {HORIZON_DAYS} Days)**\n\n"
+    forecast_text += f"💰 Expected: {CURRENCY}{result['total']:.2f} ({CURRENCY}{result['daily_average']:.2f}/day)\n"
+    if result['monthly_limit']:
+        status, percentage = get_limit_status(result['total'], result['monthly_limit'])
+        forecast_text += f"{status} Monthly limit: {CURRENCY}{result['monthly_limit']:.2f} ({percentage:.0f}%)\n"
+    forecast_text += f"📅 Busiest day: {result['busiest_weekday']}\n"
+    
+    if result['categories']:
+        forecast_text += "\n**By Category:**\n"
+        for category, expected, trend, budget in result['categories']:
+            arrow = "↑" if trend > 0.01 else "↓" if trend < -0.01 else "→"
+            forecast_text += f"{arrow} {category}: {CURRENCY}{expected:.2f}"
+            if budget:
+                forecast_text += f" / {CURRENCY}{budget:.2f}"
+            forecast_text += "\n"
+    
+    await update.message.reply_text(forecast_text, parse_mode='Markdown')
+
+async def recurring_expenses(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """List, add or cancel recurring expenses"""
+    user_id = update.effective_user.id
+    args = context.args or []
+    shard = db.sync.shard_for(user_id)
+    
+    if not args:
+        items = await db.get_recurring_expenses(user_id)
+        if not items:
+            await update.message.reply_text(
+                "🔁 No recurring expenses.\n\n"
+                "Add one with: /recurring add <amount> <category> <frequency> <description>\n"
+                "Example: /recurring add 499 Entertainment monthly Netflix"
+            )
+            return
+        recurring_text = "🔁 Recurring expenses:\n\n"
+        for recurring_id, amount, category, description, frequency, _, next_due in items:
+            due_str = from_epoch(next_due).strftime("%d-%m-%Y")
+            recurring_text += (f"#{recurring_id} {description} - {CURRENCY}{amount:.2f} "
+                               f"({category}, {frequency}, next {due_str})\n")
+        recurring_text += "\nCancel one with: /recurring cancel <id>"
+        await update.message.reply_text(recurring_text)
+        return
+    
+    action = args[0].lower()
+    if action == 'add' and len(args) >= 5:
+        category = next((c for c in EXPENSE_CATEGORIES if c.lower() == args[2].lower()), None)
+        frequency = args[3].lower()
+        if category is None:
+            await update.message.reply_text(f"❌ Unknown category. Choose one of: {', '.join(EXPENSE_CATEGORIES)}")
+            return
+        if frequency not in FREQUENCIES:
+            await update.message.reply_text(f"❌ Frequency must be one of: {', '.join(FREQUENCIES)}")
+            return
+        try:
+            amount = float(args[1])
+            if amount <= 0:
+                raise ValueError
+        except ValueError:
+            await update.message.reply_text("❌ Invalid amount. Please enter a positive number.")
+            return
+        
+        recurring_id = await db.run_write(recurring.add_recurring_expense, user_id, amount, category,
+                                          ' '.join(args[4:]), frequency, shard=shard)
+        # Store the first occurrence now rather than on the next job tick (there may be no job queue)
+        added = await db.run_write(recurring.add_due, user_id, recurring_id, shard=shard)
+        first = "The first one is recorded now." if user_id in added else "The first one is recorded when it comes due."
+        await update.message.reply_text(
+            f"✅ Recurring expense #{recurring_id} added: {CURRENCY}{amount:.2f} ({category}), {frequency}.\n"
+            f"{first}"
+        )
+        await send_recurring_alerts(context.bot, added)
+    elif action == 'cancel' and len(args) == 2 and args[1].lstrip('#').isdigit():
+        recurring_id = int(args[1].lstrip('#'))
+        if await db.run_write(recurring.cancel_recurring_expense, user_id, recurring_id, shard=shard):
+            await update.message.reply_text(f"✅ Recurring expense #{recurring_id} cancelled.")
+        else:
+            await update.message.reply_text(f"❌ No recurring expense #{recurring_id}.")
+    else:
+        await update.message.reply_text(
+            "❌ Usage:\n"
+            "/recurring - list recurring expenses\n"
+            "/recurring add <amount> <category> <daily|weekly|monthly|yearly> <description>\n"
+            "/recurring cancel <id>"
+        )
+
 async def report_week(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Show weekly report"""
     user_id = update.effective_user.id
-    expenses = db.get_summary(user_id, 7)
+    expenses = await db.get_summary(user_id, 7)
     
     if not expenses:
         await update.message.reply_text("No expenses found for this week.")
@@ -442,7 +742,7 @@ async def report_week(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
 async def report_month(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Show monthly report"""
     user_id = update.effective_user.id
-    expenses = db.get_summary(user_id, 30)
+    expenses = await db.get_summary(user_id, 30)
     
     if not expenses:
         await update.message.reply_text("No expenses found for this month.")
@@ -462,22 +762,14 @@ async def report_month(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 async def export_csv(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Export all expenses as CSV"""
     user_id = update.effective_user.id
-    expenses = db.get_expenses(user_id)
     
-    if not expenses:
+    # Rows are streamed straight from the database into the file
+    filename = await db.run(exporter.export_csv, user_id)
+    
+    if not filename:
         await update.message.reply_text("No expenses to export.")
         return
     
-    # Create CSV content
-    csv_content = "Date,Category,Amount,Description\n"
-    for exp_id, amount, category, description, date in expenses:
-        csv_content += f'"{date}","{category}","{amount}","{description}"\n'
-    
-    # Save to file
-    filename = f"expenses_{user_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-    with open(filename, 'w') as f:
-        f.write(csv_content)
-    
     # Send file
     with open(filename, 'rb') as csv_file:
         await update.message.reply_document(
@@ -492,6 +784,99 @@ async def export_csv(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
     
     await update.message.reply_text("✅ CSV exported successfully!")
 
+async def import_help(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Explain how to import a statement file"""
+    await update.message.reply_text(
+        "📥 **Import Expenses**\n\n"
+        "Send a .csv or .xlsx bank statement (or a /export\\_csv file) as a document.\n\n"
+        "It needs a header row with at least a Date and an Amount (or Debit/Withdrawal) column. "
+        "Description/Narration, Category and Reference/Transaction ID columns are used when present; "
+        "rows whose transaction ID is already stored are skipped, and so are credits "
+        "(Deposit/Credit columns, negative or Cr amounts).",
+        parse_mode='Markdown'
+    )
+
+async def import_document(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Import expenses from an uploaded CSV/XLSX document"""
+    user = update.effective_user
+    await db.add_user(user.id, user.username, user.first_name)
+    document = update.message.document
+    extension = os.path.splitext(document.file_name or "")[1].lower()
+    filename = f"temp_import_{user.id}{extension}"
+    
+    await update.message.reply_text("⏳ Importing...")
+    try:
+        file = await context.bot.get_file(document.file_id)
+        await file.download_to_drive(filename)
+        # Runs on the user's shard writer: one large transaction per batch
+        result = await db.run_write(importer.import_file, user.id, filename, shard=db.sync.shard_for(user.id))
+    except ValueError as e:
+        await update.message.reply_text(f"❌ Couldn't import this file: {e}")
+        return
+    finally:
+        if os.path.exists(filename):
+            os.remove(filename)
+    budget_alerts.forget(user.id)
+    forecasts.forget(user.id)
+    
+    await update.message.reply_text(
+        f"✅ **Import complete!**\n\n"
+        f"📥 Imported: {result['imported']}\n"
+        f"🔁 Duplicates skipped: {result['duplicates']}\n"
+        f"💵 Credits skipped: {result['credits']}\n"
+        f"⚠️ Unreadable rows: {result['invalid']}\n\n"
+        f"Use /summary to see your spending.",
+        parse_mode='Markdown'
+    )
+
+async def maintenance(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Run database maintenance now (admins only)"""
+    if update.effective_user.id not in ADMIN_USER_IDS:
+        await update.message.reply_text("⛔ This command is only for bot admins.")
+        return
+    
+    await update.message.reply_text("🧹 Running database maintenance...")
+    reports = await db.maintain()
+    
+    text = "✅ Maintenance finished:\n"
+    for report in reports:
+        text += (f"\n{os.path.basename(report['path'])}: {report['seconds']:.2f}s, "
+                 f"{report['reclaimed_bytes'] / 1024:.0f} KB reclaimed")
+        if report['skipped']:
+            text += f"\n  skipped: {', '.join(report['skipped'])}"
+    await update.message.reply_text(text)
+
+async def dbstats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Show shard sizes and result cache counters (admins only)"""
+    if update.effective_user.id not in ADMIN_USER_IDS:
+        await update.message.reply_text("⛔ This command is only for bot admins.")
+        return
+    
+    text = "🗄️ Database stats:\n"
+    for path, users, expenses in await db.get_shard_stats():
+        text += f"\n{os.path.basename(path)}: {users} users, {expenses} expenses"
+    
+    cache = await db.get_cache_stats()
+    if cache:
+        text += (f"\n\nResult cache: {cache['hits']} hits, {cache['misses']} misses "
+                 f"({cache['hit_rate']:.0%} hit rate), {cache['entries']} entries")
+    else:
+        text += "\n\nResult cache: off"
+    await update.message.reply_text(text)
+
+async def maintenance_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Daily job-queue callback; the maintenance module logs what it did"""
+    await db.maintain()
+
+async def recurring_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Job-queue callback storing every recurring expense that has come due, each shard on its own writer"""
+    results = await asyncio.gather(*(
+        db.run_write(functools.partial(recurring.auto_add_recurring, shard=shard), shard=shard)
+        for shard in range(db.sync.shards)
+    ))
+    for added in results:
+        await send_recurring_alerts(context.bot, added)
+
 async def export_pdf(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Placeholder for PDF export"""
     await update.message.reply_text("📄 PDF export coming soon! Use /export_monthly for Excel format.")
@@ -0,0 +1,191 @@
+"""
+Incremental budget alerts
+Keeps each active user's spending per day for the last 30 days, with
+running totals for the same windows /limits reports (today, last 7 days,
+last 30 days), and the same 30-day running total for every category that
+has its own budget. Recording or removing an expense is O(1) whatever the
+number of category budgets, and an alert is raised only when a window or
+category crosses a new threshold, not on every message.
+"""
+from datetime import date, datetime
+
+from config import BUDGET_ALERT_CACHE_SIZE, BUDGET_ALERT_THRESHOLDS, CURRENCY
+from database import from_epoch
+from result_cache import VersionedUserLRU
+
+# (limit type, days in the window, label), in get_budget_limits order
+WINDOWS = (
+    ("daily", 1, "Daily"),
+    ("weekly", 7, "Weekly"),
+    ("monthly", 30, "Monthly"),
+)
+HISTORY_DAYS = max(days for _, days, _ in WINDOWS)
+
+
+def _level(total, limit):
+    """Highest threshold (percent) total has reached against limit, 0 if none or no limit"""
+    if not limit:
+        return 0
+    return max((t for t in BUDGET_ALERT_THRESHOLDS if total / limit * 100 >= t), default=0)
+
+
+class _UserBudget:
+    """One user's limits, per-day totals and window sums"""
+
+    __slots__ = ("limits", "days", "today", "totals", "alerted", "epoch",
+                 "category_limits", "category_days", "category_totals", "category_alerted")
+
+    def __init__(self, limits, daily_totals, today, category_limits=None, epoch=0):
+        """daily_totals holds (day, category, total) rows, read at the store's data epoch"""
+        self.epoch = epoch
+        self.limits = list(limits)
+        self.category_limits = dict(category_limits or {})
+        self.days = {}
+        self.category_days = {category: {} for category in self.category_limits}
+        for day, category, total in daily_totals:
+            self.days[day] = self.days.get(day, 0) + total
+            if category in self.category_days:
+                self.category_days[category][day] = total
+        self.today = None
+        self.totals = [0] * len(WINDOWS)
+        self.category_totals = {}
+        self.roll(today)
+        # Thresholds already passed before we started watching don't alert again
+        self.alerted = self.levels()
+        self.category_alerted = self.category_levels()
+
+    def roll(self, today):
+        """Move the windows to a new day: drop old days and re-add the rest"""
+        if today == self.today:
+            return
+        self.today = today
+        self.days = {day: total for day, total in self.days.items() if (today - day).days < HISTORY_DAYS}
+        self.totals = [
+            sum(total for day, total in self.days.items() if (today - day).days < span)
+            for _, span, _ in WINDOWS
+        ]
+        for category, days in self.category_days.items():
+            self.category_days[category] = {
+                day: total for day, total in days.items() if (today - day).days < HISTORY_DAYS}
+            self.category_totals[category] = sum(self.category_days[category].values())
+
+    def add(self, day, amount, category=None):
+        if (self.today - day).days >= HISTORY_DAYS:
+            return
+        self.days[day] = self.days.get(day, 0) + amount
+        for i, (_, span, _) in enumerate(WINDOWS):
+            if (self.today - day).days < span:
+                self.totals[i] += amount
+        # Only budgeted categories are tracked, so this is one dict lookup
+        days = self.category_days.get(category)
+        if days is not None:
+            days[day] = days.get(day, 0) + amount
+            self.category_totals[category] += amount
+
+    def levels(self):
+        """Highest threshold (percent) each window has reached, 0 if none or no limit"""
+        return [_level(total, limit) for total, limit in zip(self.totals, self.limits)]
+
+    def category_levels(self):
+        """{category: highest threshold reached} for the budgeted categories"""
+        return {category: _level(self.category_totals[category], limit)
+                for category, limit in self.category_limits.items()}
+
+
+class BudgetAlertEngine(VersionedUserLRU):
+    """Per-user running budget totals with threshold-crossing alerts
+
+    Users are loaded from the store on first use and kept in an LRU of
+    max_users; idle users are evicted and simply reload next time. Call
+    record_expense after the expense is stored, and forget(user_id) after
+    anything else changes a user's limits, category budgets or history in
+    bulk. The store is read without holding the engine lock, so one user's
+    warm-up never holds up calls for anyone else. A user is also reloaded
+    when the store's data epoch moves, i.e. after a bulk write such as an
+    import or archive run from another process.
+    """
+
+    def __init__(self, db, max_users=BUDGET_ALERT_CACHE_SIZE):
+        super().__init__(max_users)
+        self.db = db
+
+    def _roll(self, state, today):
+        state.roll(today)
+
+    def _read(self, user_id, today):
+        """Build user_id's state from the store; called without the lock"""
+        with self.db.read_snapshot(user_id):
+            epoch = self.db.get_data_epoch(user_id)
+            limits = self.db.get_budget_limits(user_id)
+            category_limits = {category: limit for category, limit, _ in self.db.get_category_budgets(user_id)}
+            daily_totals = [(date.fromisoformat(day), category, total)
+                            for day, category, total in self.db.get_daily_totals(user_id, HISTORY_DAYS)]
+        return _UserBudget(limits, daily_totals, today, category_limits, epoch)
+
+    def record_expense(self, user_id, amount, category=None, ts=None):
+        """Account for a stored expense, return the alerts it triggers
+
+        Alerts are (limit type, threshold, total, limit) tuples, one per
+        window that crossed a higher threshold than it had before, then one
+        for the expense's category budget if that crossed one; its limit
+        type is the category name.
+        """
+        when = from_epoch(ts) if ts is not None else datetime.utcnow()
+        today = datetime.utcnow().date()
+        state, version = self._cached(user_id, today, self.db.get_data_epoch(user_id))
+        loaded = state is None
+        if loaded:
+            state = self._read(user_id, today)
+        with self._lock:
+            if loaded:
+                self._install(user_id, state, version)
+                # A fresh load already read this expense; measure crossings from just before it
+                state.add(when.date(), -amount, category)
+                state.alerted = state.levels()
+                state.category_alerted = state.category_levels()
+            state.add(when.date(), amount, category)
+
+            levels = state.levels()
+            alerts = [
+                (limit_type, level, total, limit)
+                for (limit_type, _, _), level, alerted, total, limit
+                in zip(WINDOWS, levels, state.alerted, state.totals, state.limits)
+                if level > alerted
+            ]
+            state.alerted = levels
+
+            limit = state.category_limits.get(category)
+            if limit:
+                total = state.category_totals[category]
+                level = _level(total, limit)
+                if level > state.category_alerted[category]:
+                    alerts.append((category, level, total, limit))
+                state.category_alerted[category] = level
+            return alerts
+
+    def remove_expense(self, user_id, amount, ts, category=None):
+        """Account for a deleted expense, so its thresholds can alert again"""
+        with self._lock:
+            # A read in progress may have missed the delete
+            self._version += 1
+            state = self._users.get(user_id)
+            if state is None:
+                return
+            state.roll(datetime.utcnow().date())
+            state.add(from_epoch(ts).date(), -amount, category)
+            state.alerted = [min(alerted, level) for alerted, level in zip(state.alerted, state.levels())]
+            if category in state.category_limits:
+                state.category_alerted[category] = min(
+                    state.category_alerted[category],
+                    _level(state.category_totals[category], state.category_limits[category]))
+
+
+def format_alert(limit_type, level, total, limit):
+    """One line of the budget alert message; a category alert names its category"""
+    label = next((label for name, _, label in WINDOWS if name == limit_type), limit_type)
+    amounts = f"{CURRENCY}{total:.2f} / {CURRENCY}{limit:.2f}"
+    if level >= 100:
+        return f"🔴 {label} limit EXCEEDED: {amounts}"
+    if level >= 90:
+        return f"⚠️ {label} limit at {level}%: {amounts}"
+    return f"⚡ {label} limit at {level}%: {amounts}"
@@ -12,6 +12,65 @@ BOT_TOKEN = "8140750596:AAEaSEXVus7m1_3iVhQ7BXDtA4uu-YEzyno"
 # Database
 DATABASE_PATH = "expenses.db"
 
+# Storage engine (see storage.ENGINES): "sqlite" for the bot, "memory" for
+# throwaway runs such as load simulations
+DATABASE_ENGINE = "sqlite"
+
+# Number of SQLite files users are spread over (1 = just DATABASE_PATH).
+# Changing it needs `python manage.py shard --to N` (run while this is still the
+# old count) to move existing data.
+DATABASE_SHARDS = 1
+
+# SQLite connection tuning (applied to every pooled connection)
+DB_CACHE_SIZE_KB = 65536          # page cache per connection (64 MB)
+DB_MMAP_SIZE = 268435456          # memory-mapped I/O window (256 MB)
+DB_BUSY_TIMEOUT = 5.0             # seconds to wait on a locked database
+
+# Reader threads used by the async database layer (writes get one thread per shard)
+DB_READER_THREADS = 4
+
+# Write-behind mode: queue add_expense inserts and commit them in groups
+WRITE_BEHIND_ENABLED = False
+WRITE_BEHIND_MAX_ROWS = 200       # flush once this many rows are queued
+WRITE_BEHIND_MAX_DELAY_MS = 50    # or once the oldest row waited this long
+
+# Expenses older than this move to per-year archive files (manage.py archive)
+ARCHIVE_AFTER_DAYS = 365
+
+# Registered users remembered in memory so add_user skips unchanged profiles
+USER_CACHE_SIZE = 10000
+
+# Budget alerts: thresholds (percent of a limit) that trigger a warning once
+# each, and how many active users keep running totals in memory
+BUDGET_ALERT_THRESHOLDS = (75, 90, 100)
+BUDGET_ALERT_CACHE_SIZE = 10000
+
+# Spending forecasts: smoothing weights for the daily level, weekday
+# offsets and category trends, the history a model is warmed from, the
+# history needed before forecasting, and how many users keep a model
+FORECAST_ALPHA = 0.1
+FORECAST_GAMMA = 0.5
+FORECAST_BETA = 0.05
+FORECAST_HISTORY_DAYS = 56
+FORECAST_MIN_DAYS = 7
+FORECAST_CACHE_SIZE = 10000
+
+# Cache summary/total query results per user until their next write
+RESULT_CACHE_ENABLED = True
+RESULT_CACHE_SIZE = 50000         # cached results kept across all users
+
+# Daily database maintenance (ANALYZE, incremental vacuum, WAL checkpoint)
+MAINTENANCE_HOUR_UTC = 3          # quiet hour the bot's job queue runs it
+MAINTENANCE_TIME_BUDGET = 30      # seconds a run may take
+MAINTENANCE_VACUUM_PAGES = 1000   # free pages released per incremental_vacuum step
+MAINTENANCE_ANALYSIS_LIMIT = 1000 # rows sampled per index by ANALYZE
+
+# How often the bot stores recurring expenses that have come due
+RECURRING_TICK_SECONDS = 60
+
+# Telegram user IDs allowed to run admin commands such as /maintenance
+ADMIN_USER_IDS = set()
+
 # Supported categories
 EXPENSE_CATEGORIES = [
     "Food",
@@ -1,233 +1,982 @@
 """
 Database initialization and management
 """
+import calendar
+import functools
+import logging
+import re
 import sqlite3
-from datetime import datetime
-from config import DATABASE_PATH, EXPENSE_CATEGORIES
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from config import (
+    ARCHIVE_AFTER_DAYS,
+    DATABASE_PATH,
+    DATABASE_SHARDS,
+    EXPENSE_CATEGORIES,
+    DB_CACHE_SIZE_KB,
+    DB_MMAP_SIZE,
+    DB_BUSY_TIMEOUT,
+    MAINTENANCE_TIME_BUDGET,
+    RESULT_CACHE_ENABLED,
+    USER_CACHE_SIZE,
+    WRITE_BEHIND_ENABLED,
+    WRITE_BEHIND_MAX_ROWS,
+    WRITE_BEHIND_MAX_DELAY_MS,
+)
+from migrations import apply_migrations, backfill_epoch_timestamps, rebuild_daily_rollups
+from sharding import shard_for, shard_paths
+from archive import ARCHIVE_COLUMNS, archive_years, attach_archive, attach_archives
+from maintenance import maintain_shard
+from result_cache import ResultCache
+
+logger = logging.getLogger(__name__)
+
+
+def to_epoch(value):
+    """Convert a UTC datetime or 'YYYY-MM-DD[ HH:MM:SS]' string to epoch seconds"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if isinstance(value, datetime):
+        return calendar.timegm(value.utctimetuple())
+    return int(value)
+
+
+def from_epoch(ts):
+    """Naive UTC datetime for an expense's epoch timestamp"""
+    return datetime.fromtimestamp(ts, timezone.utc).replace(tzinfo=None)
+
+
+def fts_query(text):
+    """FTS5 MATCH expression for free text: every word must match
+
+    The last word also matches as a prefix, so a half-typed "biry" finds
+    "biryani"; earlier words match whole, which keeps the index lookups cheap.
+    """
+    words = [f'"{word}"' for word in re.findall(r'\w+', text or '')]
+    if words:
+        words[-1] += '*'
+    return ' '.join(words)
+
+
+def window_start(days):
+    """UTC start of a window covering the last `days` calendar days"""
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    return today - timedelta(days=days - 1)
+
+
+def _freeze(value):
+    """A hashable stand-in for a cache key argument (lists become tuples)"""
+    return tuple(value) if isinstance(value, list) else value
+
+
+def _cached(method):
+    """Serve a per-user aggregate read from the instance's ResultCache
+
+    Reads inside read_snapshot bypass the cache: they may see data older
+    than the user's current version. The shard's data epoch is read first,
+    so bulk writes from other processes make cached results miss.
+    """
+    @functools.wraps(method)
+    def cached(self, user_id, *args, **kwargs):
+        if self._results is None or self._in_snapshot(user_id):
+            return method(self, user_id, *args, **kwargs)
+        key = (method.__name__,) + tuple(_freeze(arg) for arg in args) \
+            + tuple(sorted((name, _freeze(value)) for name, value in kwargs.items()))
+        return self._results.get_or_compute(user_id, key, lambda: method(self, user_id, *args, **kwargs),
+                                            self.get_data_epoch(user_id))
+
+    return cached
+
 
 class ExpenseDatabase:
-    def __init__(self):
-        self.db_path = DATABASE_PATH
+    def __init__(self, db_path=None, write_behind=WRITE_BEHIND_ENABLED, shards=DATABASE_SHARDS,
+                 result_cache=RESULT_CACHE_ENABLED):
+        self.db_path = db_path or DATABASE_PATH
+        self.shards = max(1, int(shards))
+        self.shard_paths = shard_paths(self.db_path, self.shards)
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._admin_pool = None
+
+        # Write-behind queue for add_expense (see flush)
+        self.write_behind = write_behind
+        self._pending = []
+        self._pending_users = set()
+        self._pending_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        # One long-lived flusher thread commits delayed batches, so timed
+        # flushes reuse its connections instead of opening new ones
+        self._flush_wakeup = threading.Condition(self._pending_lock)
+        self._flush_deadline = None
+        self._flusher = None
+        self._stopping = False
+
+        # LRU of user_id -> (username, first_name) already stored
+        self._known_users = OrderedDict()
+        self._known_users_lock = threading.Lock()
+
+        # Summary and total results per user, invalidated by that user's writes
+        self._results = ResultCache() if result_cache else None
+
         self.init_db()
-    
+
+    def _get_connection(self, shard=0):
+        """Return this thread's long-lived connection to a shard, opening it on first use"""
+        conns = getattr(self._local, 'conns', None)
+        if conns is None:
+            conns = self._local.conns = {}
+        conn = conns.get(shard)
+        if conn is None:
+            conn = sqlite3.connect(self.shard_paths[shard], timeout=DB_BUSY_TIMEOUT, check_same_thread=False)
+            self._configure_connection(conn)
+            conns[shard] = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def open_connections(self):
+        """Open this thread's connection to every shard (thread pool initializer)"""
+        for shard in range(self.shards):
+            self._get_connection(shard)
+
+    def shard_for(self, user_id):
+        """Index of the shard holding user_id's data"""
+        return shard_for(user_id, self.shards)
+
+    def _connection_for(self, user_id):
+        """This thread's connection to the shard holding user_id's data"""
+        return self._get_connection(self.shard_for(user_id))
+
+    @contextmanager
+    def read_snapshot(self, user_id):
+        """Run every read for user_id inside the block against one snapshot
+
+        Opens a read transaction on this thread's connection to the user's
+        shard (archives attached first, since ATTACH can't run inside one).
+        Under WAL, readers see the database as of their first read and never
+        block writers, so a multi-query export or report stays consistent
+        while inserts carry on. Blocks nest; don't write on this thread
+        inside one.
+        """
+        shard = self.shard_for(user_id)
+        snapshots = getattr(self._local, 'snapshots', None)
+        if snapshots is None:
+            snapshots = self._local.snapshots = set()
+        if shard in snapshots:
+            yield
+            return
+
+        self._flush_user(user_id)
+        conn = self._get_connection(shard)
+        schemas = ['main'] + attach_archives(conn, self.shard_paths[shard])
+        conn.execute('BEGIN')
+        snapshots.add(shard)
+        try:
+            # The snapshot of each database file is taken at its first read
+            for schema in schemas:
+                conn.execute(f'SELECT COUNT(*) FROM {schema}.sqlite_master').fetchone()
+            yield
+        finally:
+            snapshots.discard(shard)
+            conn.rollback()
+
+    def _in_snapshot(self, user_id):
+        return self.shard_for(user_id) in getattr(self._local, 'snapshots', ())
+
+    def fan_out(self, func):
+        """Run func(shard) for every shard in parallel, return the results in shard order
+
+        Admin work (rebuilds, backfills, cross-user stats) uses this so its
+        wall time is that of the slowest shard rather than the sum.
+        """
+        if self.shards == 1:
+            return [func(0)]
+        with self._connections_lock:
+            if self._admin_pool is None:
+                self._admin_pool = ThreadPoolExecutor(max_workers=self.shards, thread_name_prefix="db-shard")
+        return list(self._admin_pool.map(func, range(self.shards)))
+
+    def _configure_connection(self, conn):
+        """Apply journaling and cache pragmas to a new connection"""
+        # Only takes effect on a new, empty file; existing ones switch with maintain(full_vacuum=True)
+        conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA cache_size=-{int(DB_CACHE_SIZE_KB)}')
+        conn.execute(f'PRAGMA mmap_size={int(DB_MMAP_SIZE)}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+
+    def close(self):
+        """Flush queued writes and close every connection opened by this instance"""
+        with self._pending_lock:
+            flusher, self._flusher = self._flusher, None
+            self._stopping = True
+            self._flush_wakeup.notify_all()
+        if flusher is not None:
+            flusher.join()
+        with self._pending_lock:
+            self._stopping = False
+        self.flush()
+        with self._connections_lock:
+            pool, self._admin_pool = self._admin_pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+
     def init_db(self):
-        """Initialize database with required tables"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Users table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                first_name TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Expenses table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS expenses (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                amount REAL NOT NULL,
-                category TEXT NOT NULL,
-                description TEXT,
-                date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                source TEXT,
-                transaction_id TEXT,
-                account_name TEXT,
-                payment_method TEXT,
-                FOREIGN KEY (user_id) REFERENCES users(user_id)
-            )
-        ''')
-        
-        # Categories table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS categories (
-                category_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                name TEXT NOT NULL UNIQUE,
-                color TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users(user_id)
-            )
-        ''')
-        
-        # Budget limits table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS budget_limits (
-                limit_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL UNIQUE,
-                daily_limit REAL,
-                weekly_limit REAL,
-                monthly_limit REAL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users(user_id)
-            )
-        ''')
-        
-        conn.commit()
-        conn.close()
-    
+        """Initialize every shard by applying pending schema migrations"""
+        for shard in range(self.shards):
+            apply_migrations(self._get_connection(shard))
+        self.backfill_epoch()
+
+    def backfill_epoch(self, batch_size=5000):
+        """Fill the epoch ts column for rows written before it existed
+
+        Runs in short batches so other writers get the lock in between.
+        Returns the number of rows updated (0 once the backfill is done).
+        """
+        return sum(self.fan_out(
+            lambda shard: backfill_epoch_timestamps(self._get_connection(shard), batch_size)
+        ))
+
+    def rebuild_rollups(self):
+        """Recompute daily_rollups from raw expenses, return the number of rollup rows"""
+        self.flush()
+
+        def rebuild(shard):
+            conn = self._get_connection(shard)
+            with conn:
+                cursor = conn.cursor()
+                rebuild_daily_rollups(cursor)
+                self._bump_data_epoch(cursor)
+                cursor.execute('SELECT COUNT(*) FROM daily_rollups')
+                return cursor.fetchone()[0]
+
+        rows = sum(self.fan_out(rebuild))
+        if self._results is not None:
+            self._results.clear()
+        return rows
+
+    def maintain(self, time_budget=MAINTENANCE_TIME_BUDGET, full_vacuum=False):
+        """Analyze, vacuum and checkpoint every shard within time_budget seconds
+
+        Shards run in parallel, each on its own connection. Returns one
+        report per shard (see maintenance.maintain_shard).
+        """
+        self.flush()
+        deadline = time.monotonic() + time_budget
+        return self.fan_out(lambda shard: maintain_shard(
+            self._get_connection(shard), self.shard_paths[shard], deadline, full_vacuum))
+
+    def get_shard_stats(self):
+        """(shard path, users, expenses) for every shard, queried in parallel"""
+        self.flush()
+
+        def stats(shard):
+            cursor = self._get_connection(shard).cursor()
+            users = cursor.execute('SELECT COUNT(*) FROM users').fetchone()[0]
+            expenses = cursor.execute('SELECT COUNT(*) FROM expenses').fetchone()[0]
+            return self.shard_paths[shard], users, expenses
+
+        return self.fan_out(stats)
+
+    def is_known_user(self, user_id, username, first_name):
+        """True if the user is already stored with exactly this profile"""
+        with self._known_users_lock:
+            if self._known_users.get(user_id) != (username, first_name):
+                return False
+            self._known_users.move_to_end(user_id)
+            return True
+
     def add_user(self, user_id, username, first_name):
-        """Add or update user"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT OR REPLACE INTO users (user_id, username, first_name)
-            VALUES (?, ?, ?)
-        ''', (user_id, username, first_name))
-        
-        conn.commit()
-        conn.close()
-    
+        """Add or update user, skipping the write when the profile is unchanged"""
+        if self.is_known_user(user_id, username, first_name):
+            return
+
+        conn = self._connection_for(user_id)
+
+        # Upsert keeps created_at; the WHERE skips rewriting an identical row
+        with conn:
+            conn.execute('''
+                INSERT INTO users (user_id, username, first_name)
+                VALUES (?, ?, ?)
+                ON CONFLICT (user_id) DO UPDATE
+                SET username = excluded.username, first_name = excluded.first_name
+                WHERE username IS NOT excluded.username OR first_name IS NOT excluded.first_name
+            ''', (user_id, username, first_name))
+
+        with self._known_users_lock:
+            self._known_users[user_id] = (username, first_name)
+            self._known_users.move_to_end(user_id)
+            while len(self._known_users) > USER_CACHE_SIZE:
+                self._known_users.popitem(last=False)
+
     def add_expense(self, user_id, amount, category, description, source="text", transaction_id=None, account_name=None, payment_method=None):
-        """Add a new expense"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO expenses (user_id, amount, category, description, source, transaction_id, account_name, payment_method)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (user_id, amount, category, description, source, transaction_id, account_name, payment_method))
-        
-        conn.commit()
-        conn.close()
-    
-    def get_expenses(self, user_id, days=None):
-        """Get expenses for a user"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
+        """Add a new expense, return False if its transaction_id is already stored
+
+        In write-behind mode the row is queued for a group commit, except
+        rows with a transaction_id: those are inserted at once so a
+        duplicate can be reported to the caller.
+        """
+        transaction_id = transaction_id or None
+        now = datetime.utcnow().replace(microsecond=0)
+        # date stays NULL: ts is the timestamp (see migrations._rollups_from_ts)
+        row = (user_id, amount, category, description, None, to_epoch(now),
+               source, transaction_id, account_name, payment_method)
+
+        if not self.write_behind or transaction_id:
+            self._flush_user(user_id)
+            return self._insert_expenses([row]) == 1
+
+        with self._pending_lock:
+            self._pending.append(row)
+            self._pending_users.add(user_id)
+            batch_full = len(self._pending) >= WRITE_BEHIND_MAX_ROWS
+            if not batch_full and self._flush_deadline is None:
+                self._flush_deadline = time.monotonic() + WRITE_BEHIND_MAX_DELAY_MS / 1000
+                if self._flusher is None:
+                    self._flusher = threading.Thread(target=self._flush_loop, name="db-flusher", daemon=True)
+                    self._flusher.start()
+                self._flush_wakeup.notify()
+        # Cached results now miss, and the read that recomputes them flushes first
+        self._invalidate(user_id)
+
+        if batch_full:
+            self.flush()
+        return True
+
+    def get_data_epoch(self, user_id):
+        """Bulk-write counter for user_id; it changes whenever their cached state may be stale"""
+        return self._connection_for(user_id).execute('''
+            SELECT epoch + COALESCE((SELECT epoch FROM user_data_epoch WHERE user_id = ?), 0)
+            FROM data_epoch
+        ''', (user_id,)).fetchone()[0]
+
+    @staticmethod
+    def _bump_data_epoch(conn, user_ids=None):
+        """Mark a bulk write for user_ids (default: everyone on the shard), inside its transaction
+
+        See migrations._add_data_epoch and _add_user_data_epoch.
+        """
+        if user_ids is None:
+            conn.execute('UPDATE data_epoch SET epoch = epoch + 1')
+            return
+        conn.executemany('''
+            INSERT INTO user_data_epoch (user_id, epoch) VALUES (?, 1)
+            ON CONFLICT (user_id) DO UPDATE SET epoch = epoch + 1
+        ''', [(user_id,) for user_id in user_ids])
+
+    def _insert_expenses(self, rows, bulk=False):
+        """Insert expense rows in a single transaction per shard
+
+        Rows repeating a (user_id, transaction_id) already stored are dropped
+        by the unique index, or before inserting if the copy was archived.
+        A bulk insert also bumps the data epoch of the users it added rows
+        for. Returns the number of rows inserted.
+        """
+        by_shard = defaultdict(list)
+        for row in rows:
+            by_shard[self.shard_for(row[0])].append(row)
+
+        inserted = 0
+        for shard, shard_rows in by_shard.items():
+            conn = self._get_connection(shard)
+            shard_rows = self._drop_archived_transactions(shard, shard_rows)
+            with conn:
+                cursor = conn.executemany('''
+                    INSERT INTO expenses (user_id, amount, category, description, date, ts, source, transaction_id, account_name, payment_method)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT DO NOTHING
+                ''', shard_rows)
+                inserted += cursor.rowcount
+                if bulk and cursor.rowcount:
+                    self._bump_data_epoch(conn, {row[0] for row in shard_rows})
+            for user_id in {row[0] for row in shard_rows}:
+                self._invalidate(user_id)
+        return inserted
+
+    def _drop_archived_transactions(self, shard, rows):
+        """rows minus those whose (user_id, transaction_id) is in one of the shard's archives
+
+        The hot table's unique index can't see archived rows, so re-importing
+        an old statement would otherwise store its transactions again. Each
+        archive not attached already is attached just for its lookup, since
+        SQLite caps the number of attached files.
+        """
+        wanted = defaultdict(set)
+        for row in rows:
+            if row[7]:
+                wanted[row[0]].add(row[7])
+        years = archive_years(self.shard_paths[shard]) if wanted else []
+        if not years:
+            return rows
+
+        conn = self._get_connection(shard)
+        attached = {row[1] for row in conn.execute('PRAGMA database_list')}
+        archived = set()
+        for year in years:
+            schema = attach_archive(conn, self.shard_paths[shard], year)
+            try:
+                for user_id, transaction_ids in wanted.items():
+                    transaction_ids = list(transaction_ids)
+                    for i in range(0, len(transaction_ids), 500):
+                        chunk = transaction_ids[i:i + 500]
+                        archived.update(conn.execute(f'''
+                            SELECT user_id, transaction_id FROM {schema}.expenses
+                            WHERE user_id = ? AND transaction_id IN ({', '.join('?' * len(chunk))})
+                        ''', [user_id] + chunk))
+            finally:
+                if schema not in attached:
+                    conn.execute(f'DETACH DATABASE {schema}')
+        if not archived:
+            return rows
+        return [row for row in rows if (row[0], row[7]) not in archived]
+
+    def _invalidate(self, user_id):
+        """Mark user_id's cached results stale; call once the write is committed"""
+        if self._results is not None:
+            self._results.invalidate(user_id)
+
+    def get_cache_stats(self):
+        """Result cache counters: hits, misses, entries and hit_rate (None when disabled)"""
+        return self._results.stats() if self._results is not None else None
+
+    def import_expenses(self, user_id, expenses):
+        """Insert a batch of imported expenses for one user in one transaction
+
+        expenses are (amount, category, description, ts, source,
+        transaction_id, account_name, payment_method) tuples. Rows whose
+        transaction_id is already stored for the user (or repeated within the
+        batch) are dropped by the unique index. Returns (inserted, duplicates).
+        """
+        self._flush_user(user_id)
+        rows = [
+            (user_id, amount, category, description, None, ts,
+             source, transaction_id or None, account_name, payment_method)
+            for amount, category, description, ts, source, transaction_id, account_name, payment_method in expenses
+        ]
+        inserted = self._insert_expenses(rows, bulk=True)
+        return inserted, len(rows) - inserted
+
+    def flush(self):
+        """Commit every queued write-behind insert in one transaction"""
+        with self._flush_lock:
+            with self._pending_lock:
+                batch, self._pending = self._pending, []
+                self._flush_deadline = None
+
+            try:
+                if batch:
+                    self._insert_expenses(batch)
+            except Exception:
+                # Put the rows back so a later flush can retry them
+                with self._pending_lock:
+                    self._pending[:0] = batch
+                raise
+            finally:
+                # Users leave the pending set only once their rows are committed
+                with self._pending_lock:
+                    self._pending_users = {row[0] for row in self._pending}
+
+    def _flush_loop(self):
+        """Flusher thread: commit the queue once its oldest row has waited the maximum delay"""
+        while True:
+            with self._pending_lock:
+                while not self._stopping and (
+                        self._flush_deadline is None or self._flush_deadline > time.monotonic()):
+                    timeout = None if self._flush_deadline is None else self._flush_deadline - time.monotonic()
+                    self._flush_wakeup.wait(timeout)
+                if self._stopping:
+                    return
+            try:
+                self.flush()
+            except Exception:
+                # The rows stay queued for the next flush
+                logger.exception("Write-behind flush failed")
+
+    def _flush_user(self, user_id):
+        """Make queued inserts for user_id visible before reading their data
+
+        Inside read_snapshot the view is fixed, so nothing is flushed (a
+        commit on this connection would end the snapshot).
+        """
+        if user_id in self._pending_users and not self._in_snapshot(user_id):
+            self.flush()
+
+    def get_expenses(self, user_id, days=None, limit=None, before_ts=None, before_id=None,
+                     after_ts=None, after_id=None):
+        """Get expenses for a user, newest first
+
+        Rows are (id, amount, category, description, ts) with ts in epoch
+        seconds. days limits the result to the last `days` calendar days. For
+        keyset paging pass the (ts, id) of the last row seen as before_ts and
+        before_id to get older rows, or of the first row seen as after_ts
+        and after_id to get the newer rows just above it.
+        """
+        if (before_ts is None) != (before_id is None) or (after_ts is None) != (after_id is None):
+            raise ValueError("Paging cursors need both a timestamp and an id")
+
+        self._flush_user(user_id)
+        cursor = self._connection_for(user_id).cursor()
+
+        conditions = ['user_id = ?']
+        params = [user_id]
         if days:
-            query = '''
-                SELECT id, amount, category, description, date
-                FROM expenses
-                WHERE user_id = ? AND date >= datetime('now', '-' || ? || ' days')
-                ORDER BY date DESC
-            '''
-            cursor.execute(query, (user_id, days))
-        else:
-            query = '''
-                SELECT id, amount, category, description, date
-                FROM expenses
-                WHERE user_id = ?
-                ORDER BY date DESC
-            '''
-            cursor.execute(query, (user_id,))
-        
+            conditions.append('ts >= ?')
+            params.append(to_epoch(window_start(days)))
+        if before_id is not None:
+            conditions.append('(ts, id) < (?, ?)')
+            params.extend([int(before_ts), before_id])
+        if after_id is not None:
+            conditions.append('(ts, id) > (?, ?)')
+            params.extend([int(after_ts), after_id])
+
+        # Rows just above an "after" cursor are found walking upwards, then flipped
+        order = 'ASC' if after_id is not None else 'DESC'
+        query = f'''
+            SELECT id, amount, category, description, ts
+            FROM expenses
+            WHERE {' AND '.join(conditions)}
+            ORDER BY ts {order}, id {order}
+        '''
+        if limit:
+            query += ' LIMIT ?'
+            params.append(int(limit))
+
+        cursor.execute(query, params)
         expenses = cursor.fetchall()
-        conn.close()
+        if after_id is not None:
+            expenses.reverse()
         return expenses
-    
-    def get_summary(self, user_id, days=30):
-        """Get expense summary by category"""
-        conn = sqlite3.connect(self.db_path)
+
+    def iter_expenses(self, user_id, start=None, end=None, batch_size=500, include_archive=False):
+        """Stream a user's expenses newest first without materializing them
+
+        Rows match get_expenses. start/end are inclusive/exclusive bounds on
+        the expense time, given as UTC datetimes, 'YYYY-MM-DD[ HH:MM:SS]'
+        strings or epoch seconds. Rows are fetched batch_size at a time, so
+        memory stays flat for any history length. include_archive merges in
+        rows moved to the yearly archive files.
+        """
+        self._flush_user(user_id)
+        conn = self._connection_for(user_id)
+        schemas = ['main']
+        if include_archive:
+            schemas += attach_archives(conn, self.shard_paths[self.shard_for(user_id)])
         cursor = conn.cursor()
-        
+
+        conditions = ['user_id = ?']
+        params = [user_id]
+        if start is not None:
+            conditions.append('ts >= ?')
+            params.append(to_epoch(start))
+        if end is not None:
+            conditions.append('ts < ?')
+            params.append(to_epoch(end))
+
+        # Each part walks its own (user_id, ts) index; SQLite merges them in order
+        cursor.execute(' UNION ALL '.join(
+            f"SELECT id, amount, category, description, ts FROM {schema}.expenses "
+            f"WHERE {' AND '.join(conditions)}"
+            for schema in schemas
+        ) + ' ORDER BY ts DESC, id DESC', params * len(schemas))
+
+        try:
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            cursor.close()
+
+    def search_expenses(self, user_id, text, start=None, end=None, limit=10, offset=0):
+        """Full-text search of a user's expense descriptions, best match first
+
+        Rows match get_expenses. Every word in text must appear (the last
+        one as a prefix, see fts_query); start/end bound the expense time
+        like iter_expenses. Results are ranked with bm25 and paged with
+        limit/offset. Only the hot table is searched, not the archives.
+        """
+        query = fts_query(text)
+        if not query:
+            return []
+
+        self._flush_user(user_id)
+        cursor = self._connection_for(user_id).cursor()
+
+        # The user_id token narrows the match inside the index; the column
+        # filter keeps digits typed in the search away from other user ids
+        conditions = ['expenses_fts MATCH ?', 'e.user_id = ?']
+        params = [f'user_id : "{user_id}" AND description : ({query})', user_id]
+        if start is not None:
+            conditions.append('e.ts >= ?')
+            params.append(to_epoch(start))
+        if end is not None:
+            conditions.append('e.ts < ?')
+            params.append(to_epoch(end))
+        params.extend([int(limit), int(offset)])
+
+        cursor.execute(f'''
+            SELECT e.id, e.amount, e.category, e.description, e.ts
+            FROM expenses_fts
+            JOIN expenses AS e ON e.id = expenses_fts.rowid
+            WHERE {' AND '.join(conditions)}
+            ORDER BY bm25(expenses_fts, 1.0, 0.0), e.ts DESC
+            LIMIT ? OFFSET ?
+        ''', params)
+        return cursor.fetchall()
+
+    def archive_expenses(self, older_than_days=ARCHIVE_AFTER_DAYS, batch_size=5000):
+        """Move expenses older than older_than_days into per-year archive files
+
+        Works through each shard in parallel, batch_size rows per transaction.
+        Archived rows leave daily_rollups with them, so the age must stay
+        beyond the longest rollup window (30 days). Returns rows moved.
+        """
+        if older_than_days <= 31:
+            raise ValueError("Archive age must be more than 31 days to keep rollup windows hot")
+        self.flush()
+        cutoff = to_epoch(window_start(older_than_days))
+        return sum(self.fan_out(lambda shard: self._archive_shard(shard, cutoff, batch_size)))
+
+    def _archive_shard(self, shard, cutoff, batch_size):
+        """Move one shard's rows with ts < cutoff into their year's archive"""
+        conn = self._get_connection(shard)
+        moved = 0
+        last_id = 0
+        while True:
+            rows = conn.execute('''
+                SELECT id, CAST(strftime('%Y', ts, 'unixepoch') AS INTEGER), user_id
+                FROM expenses
+                WHERE id > ? AND ts < ?
+                ORDER BY id
+                LIMIT ?
+            ''', (last_id, cutoff, batch_size)).fetchall()
+            if not rows:
+                return moved
+            last_id = rows[-1][0]
+
+            by_year = defaultdict(list)
+            for expense_id, year, _ in rows:
+                by_year[year].append(expense_id)
+            schemas = {year: attach_archive(conn, self.shard_paths[shard], year) for year in by_year}
+
+            # Copy then delete in one transaction; OR IGNORE makes a re-run after a crash harmless
+            with conn:
+                for year, ids in by_year.items():
+                    for i in range(0, len(ids), 500):
+                        chunk = ids[i:i + 500]
+                        placeholders = ', '.join('?' * len(chunk))
+                        conn.execute(f'''
+                            INSERT OR IGNORE INTO {schemas[year]}.expenses ({ARCHIVE_COLUMNS})
+                            SELECT {ARCHIVE_COLUMNS} FROM main.expenses WHERE id IN ({placeholders})
+                        ''', chunk)
+                        conn.execute(f'DELETE FROM main.expenses WHERE id IN ({placeholders})', chunk)
+                self._bump_data_epoch(conn, {row[2] for row in rows})
+            for user_id in {row[2] for row in rows}:
+                self._invalidate(user_id)
+            moved += len(rows)
+
+    @_cached
+    def get_summary(self, user_id, days=30):
+        """Get expense summary by category for the last `days` calendar days"""
+        self._flush_user(user_id)
+        cursor = self._connection_for(user_id).cursor()
+
+        # Read the per-day rollups: cost grows with days in the window, not expenses
         query = '''
-            SELECT category, SUM(amount) as total, COUNT(*) as count
-            FROM expenses
-            WHERE user_id = ? AND date >= datetime('now', '-' || ? || ' days')
+            SELECT category, SUM(total) as total, SUM(count) as count
+            FROM daily_rollups
+            WHERE user_id = ? AND day > date('now', '-' || ? || ' days')
             GROUP BY category
             ORDER BY total DESC
         '''
         cursor.execute(query, (user_id, days))
-        summary = cursor.fetchall()
-        conn.close()
-        return summary
-    
+        return cursor.fetchall()
+
+    @_cached
+    def get_multi_window_summary(self, user_id, windows=(1, 7, 30)):
+        """get_summary for several windows at once: {days: [(category, total, count)]}
+
+        One scan of the widest window's rollups; each window's totals come
+        from conditional aggregates over the same rows.
+        """
+        self._flush_user(user_id)
+        cursor = self._connection_for(user_id).cursor()
+        windows = sorted(set(windows))
+
+        in_window = "day > date('now', '-' || ? || ' days')"
+        columns = ', '.join(
+            f'SUM(CASE WHEN {in_window} THEN total ELSE 0 END), SUM(CASE WHEN {in_window} THEN count ELSE 0 END)'
+            for _ in windows
+        )
+        cursor.execute(f'''
+            SELECT category, {columns}
+            FROM daily_rollups
+            WHERE user_id = ? AND {in_window}
+            GROUP BY category
+        ''', [days for days in windows for _ in range(2)] + [user_id, windows[-1]])
+        rows = cursor.fetchall()
+
+        summaries = {}
+        for i, days in enumerate(windows):
+            summary = [(row[0], row[1 + 2 * i], row[2 + 2 * i]) for row in rows if row[2 + 2 * i]]
+            summaries[days] = sorted(summary, key=lambda item: item[1], reverse=True)
+        return summaries
+
     def delete_expense(self, expense_id, user_id):
         """Delete an expense"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('DELETE FROM expenses WHERE id = ? AND user_id = ?', (expense_id, user_id))
-        conn.commit()
-        conn.close()
-    
+        self._flush_user(user_id)
+        conn = self._connection_for(user_id)
+
+        with conn:
+            conn.execute('DELETE FROM expenses WHERE id = ? AND user_id = ?', (expense_id, user_id))
+        self._invalidate(user_id)
+
+    @_cached
     def get_total_today(self, user_id):
         """Get total expenses for today"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
+        self._flush_user(user_id)
+        cursor = self._connection_for(user_id).cursor()
+
         query = '''
-            SELECT SUM(amount) as total
-            FROM expenses
-            WHERE user_id = ? AND date >= datetime('now', 'start of day')
+            SELECT SUM(total) as total
+            FROM daily_rollups
+            WHERE user_id = ? AND day >= date('now')
         '''
         cursor.execute(query, (user_id,))
         result = cursor.fetchone()
-        conn.close()
-        
-        return result[0] if result[0] else 0    
+
+        return result[0] if result[0] else 0
+
     def set_budget_limit(self, user_id, limit_type, amount):
         """Set budget limit (daily/weekly/monthly)"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Check if limit exists
-        cursor.execute('SELECT limit_id FROM budget_limits WHERE user_id = ?', (user_id,))
-        exists = cursor.fetchone()
-        
-        if exists:
-            # Update existing limit
-            query = f'UPDATE budget_limits SET {limit_type}_limit = ?, updated_at = CURRENT_TIMESTAMP WHERE user_id = ?'
-            cursor.execute(query, (amount, user_id))
-        else:
-            # Create new limit entry
-            if limit_type == 'daily':
-                cursor.execute('INSERT INTO budget_limits (user_id, daily_limit) VALUES (?, ?)', (user_id, amount))
-            elif limit_type == 'weekly':
-                cursor.execute('INSERT INTO budget_limits (user_id, weekly_limit) VALUES (?, ?)', (user_id, amount))
-            elif limit_type == 'monthly':
-                cursor.execute('INSERT INTO budget_limits (user_id, monthly_limit) VALUES (?, ?)', (user_id, amount))
-        
-        conn.commit()
-        conn.close()
-    
+        conn = self._connection_for(user_id)
+
+        with conn:
+            cursor = conn.cursor()
+
+            # Check if limit exists
+            cursor.execute('SELECT limit_id FROM budget_limits WHERE user_id = ?', (user_id,))
+            exists = cursor.fetchone()
+
+            if exists:
+                # Update existing limit
+                query = f'UPDATE budget_limits SET {limit_type}_limit = ?, updated_at = CURRENT_TIMESTAMP WHERE user_id = ?'
+                cursor.execute(query, (amount, user_id))
+            else:
+                # Create new limit entry
+                if limit_type == 'daily':
+                    cursor.execute('INSERT INTO budget_limits (user_id, daily_limit) VALUES (?, ?)', (user_id, amount))
+                elif limit_type == 'weekly':
+                    cursor.execute('INSERT INTO budget_limits (user_id, weekly_limit) VALUES (?, ?)', (user_id, amount))
+                elif limit_type == 'monthly':
+                    cursor.execute('INSERT INTO budget_limits (user_id, monthly_limit) VALUES (?, ?)', (user_id, amount))
+        self._invalidate(user_id)
+
     def get_budget_limits(self, user_id):
         """Get user's budget limits"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
+        cursor = self._connection_for(user_id).cursor()
+
         cursor.execute('SELECT daily_limit, weekly_limit, monthly_limit FROM budget_limits WHERE user_id = ?', (user_id,))
         result = cursor.fetchone()
-        conn.close()
-        
+
         return result if result else (None, None, None)
-    
+
+    def get_daily_totals(self, user_id, days=30):
+        """(day 'YYYY-MM-DD', category, total) for the last `days` calendar days, oldest first"""
+        self._flush_user(user_id)
+        cursor = self._connection_for(user_id).cursor()
+
+        cursor.execute('''
+            SELECT day, category, total
+            FROM daily_rollups
+            WHERE user_id = ? AND day > date('now', '-' || ? || ' days') AND count > 0
+            ORDER BY day
+        ''', (user_id, days))
+        return cursor.fetchall()
+
+    def set_category_budget(self, user_id, category, amount):
+        """Set a monthly (last 30 days) budget for one category, or remove it when amount is None"""
+        conn = self._connection_for(user_id)
+
+        with conn:
+            if amount is None:
+                conn.execute('DELETE FROM category_budgets WHERE user_id = ? AND category = ?', (user_id, category))
+                return
+            conn.execute('''
+                INSERT INTO category_budgets (user_id, category, monthly_limit)
+                VALUES (?, ?, ?)
+                ON CONFLICT (user_id, category) DO UPDATE
+                SET monthly_limit = excluded.monthly_limit, updated_at = CURRENT_TIMESTAMP
+            ''', (user_id, category, amount))
+
+    def get_category_budgets(self, user_id):
+        """(category, monthly_limit, spent in the last 30 days) for each of a user's category budgets"""
+        self._flush_user(user_id)
+        cursor = self._connection_for(user_id).cursor()
+
+        # Each budget's spend is a PK range scan of its own rollup rows
+        cursor.execute('''
+            SELECT b.category, b.monthly_limit, COALESCE(SUM(r.total), 0)
+            FROM category_budgets AS b
+            LEFT JOIN daily_rollups AS r
+                ON r.user_id = b.user_id AND r.category = b.category AND r.day > date('now', '-30 days')
+            WHERE b.user_id = ?
+            GROUP BY b.category
+            ORDER BY b.category
+        ''', (user_id,))
+        return cursor.fetchall()
+
+    @_cached
+    def get_budget_snapshot(self, user_id):
+        """Get limits and windowed totals in one query
+
+        Returns (daily_limit, weekly_limit, monthly_limit,
+                 today_total, week_total, month_total)
+        """
+        self._flush_user(user_id)
+        cursor = self._connection_for(user_id).cursor()
+
+        query = '''
+            SELECT b.daily_limit, b.weekly_limit, b.monthly_limit,
+                   COALESCE(r.today, 0), COALESCE(r.week, 0), COALESCE(r.month, 0)
+            FROM (
+                SELECT SUM(CASE WHEN day >= date('now') THEN total END) AS today,
+                       SUM(CASE WHEN day > date('now', '-7 days') THEN total END) AS week,
+                       SUM(total) AS month
+                FROM daily_rollups
+                WHERE user_id = ? AND day > date('now', '-30 days')
+            ) AS r
+            LEFT JOIN budget_limits AS b ON b.user_id = ?
+        '''
+        cursor.execute(query, (user_id, user_id))
+        return cursor.fetchone()
+
+    @_cached
     def get_total_week(self, user_id):
-        """Get total expenses for current week"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
+        """Get total expenses for the last 7 days"""
+        self._flush_user(user_id)
+        cursor = self._connection_for(user_id).cursor()
+
         query = '''
-            SELECT SUM(amount) as total
-            FROM expenses
-            WHERE user_id = ? AND date >= datetime('now', '-7 days')
+            SELECT SUM(total) as total
+            FROM daily_rollups
+            WHERE user_id = ? AND day > date('now', '-7 days')
         '''
         cursor.execute(query, (user_id,))
         result = cursor.fetchone()
-        conn.close()
-        
+
         return result[0] if result[0] else 0
-    
+
+    @_cached
     def get_total_month(self, user_id):
-        """Get total expenses for current month"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
+        """Get total expenses for the last 30 days"""
+        self._flush_user(user_id)
+        cursor = self._connection_for(user_id).cursor()
+
         query = '''
-            SELECT SUM(amount) as total
-            FROM expenses
-            WHERE user_id = ? AND date >= datetime('now', '-30 days')
+            SELECT SUM(total) as total
+            FROM daily_rollups
+            WHERE user_id = ? AND day > date('now', '-30 days')
         '''
         cursor.execute(query, (user_id,))
         result = cursor.fetchone()
-        conn.close()
-        
-        return result[0] if result[0] else 0
\ No newline at end of file
+
+        return result[0] if result[0] else 0
+
+    def add_recurring_expense(self, user_id, amount, category, description, frequency, start_ts):
+        """Store a recurring expense first due at start_ts, return its id"""
+        conn = self._connection_for(user_id)
+
+        with conn:
+            cursor = conn.execute('''
+                INSERT INTO recurring_expenses (user_id, amount, category, description, frequency, start_ts, next_due)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (user_id, amount, category, description, frequency, start_ts, start_ts))
+        return cursor.lastrowid
+
+    def get_recurring_expenses(self, user_id):
+        """(id, amount, category, description, frequency, start_ts, next_due) for a user, soonest first"""
+        cursor = self._connection_for(user_id).cursor()
+        cursor.execute('''
+            SELECT id, amount, category, description, frequency, start_ts, next_due
+            FROM recurring_expenses
+            WHERE user_id = ?
+            ORDER BY next_due, id
+        ''', (user_id,))
+        return cursor.fetchall()
+
+    def delete_recurring_expense(self, recurring_id, user_id):
+        """Stop a recurring expense, return False if the user has no such id"""
+        conn = self._connection_for(user_id)
+
+        with conn:
+            cursor = conn.execute('DELETE FROM recurring_expenses WHERE id = ? AND user_id = ?',
+                                  (recurring_id, user_id))
+        return cursor.rowcount == 1
+
+    def get_recurring_schedule(self, shard=None):
+        """(user_id, id, frequency, start_ts, next_due) for every recurring expense on one shard, or every shard"""
+        def schedule(shard):
+            cursor = self._get_connection(shard).cursor()
+            cursor.execute('SELECT user_id, id, frequency, start_ts, next_due FROM recurring_expenses')
+            return cursor.fetchall()
+
+        if shard is not None:
+            return schedule(shard)
+        return [row for rows in self.fan_out(schedule) for row in rows]
+
+    def materialize_recurring(self, occurrences):
+        """Insert due recurring expenses and move their schedules forward
+
+        occurrences are (user_id, recurring_id, due_ts, next_due) tuples.
+        Each shard's rows go in one transaction together with the next_due
+        updates. Every occurrence carries the transaction_id
+        'recurring:<id>:<due_ts>', so replaying one that is already stored
+        (a catch-up after a crash, or a second process) inserts nothing,
+        and next_due never moves backwards. Occurrences of a recurring
+        expense deleted in the meantime are skipped. Returns the rows
+        inserted as {user_id: [(amount, category, ts)]}, so callers can run
+        them through the same budget alerts as any other expense.
+        """
+        by_shard = defaultdict(list)
+        for occurrence in occurrences:
+            by_shard[self.shard_for(occurrence[0])].append(occurrence)
+
+        inserted = defaultdict(list)
+        for shard, shard_occurrences in by_shard.items():
+            conn = self._get_connection(shard)
+            templates = {}
+            with conn:
+                for user_id, recurring_id, due_ts, next_due in shard_occurrences:
+                    if recurring_id not in templates:
+                        templates[recurring_id] = conn.execute(
+                            'SELECT amount, category FROM recurring_expenses WHERE id = ? AND user_id = ?',
+                            (recurring_id, user_id)).fetchone()
+                    cursor = conn.execute('''
+                        INSERT INTO expenses (user_id, amount, category, description, date, ts, source, transaction_id)
+                        SELECT user_id, amount, category, description, NULL, ?, 'recurring', ?
+                        FROM recurring_expenses
+                        WHERE id = ? AND user_id = ?
+                        ON CONFLICT DO NOTHING
+                    ''', (due_ts, f"recurring:{recurring_id}:{due_ts}", recurring_id, user_id))
+                    if cursor.rowcount > 0:
+                        amount, category = templates[recurring_id]
+                        inserted[user_id].append((amount, category, due_ts))
+                conn.executemany('''
+                    UPDATE recurring_expenses SET next_due = MAX(next_due, ?) WHERE id = ? AND user_id = ?
+                ''', [(next_due, recurring_id, user_id) for user_id, recurring_id, _, next_due in shard_occurrences])
+            for user_id, _, _, _ in shard_occurrences:
+                self._invalidate(user_id)
+        return dict(inserted)
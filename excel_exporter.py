@@ -1,344 +1,327 @@
 """
 Excel export functionality for expense data
 Exports expenses to .xlsx format with formatting, summaries, and charts
+Workbooks are written in openpyxl's write-only mode and expense rows are
+streamed from the database, so memory use does not grow with history length.
 """
+import csv
+import functools
 import os
 from datetime import datetime
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
 from openpyxl.utils import get_column_letter
-from database import ExpenseDatabase
+from database import from_epoch, window_start
 from config import CURRENCY
+from storage import create_store
+
+CURRENCY_FORMAT = f'"{CURRENCY}"#,##0.00'
+
+def _snapshot(export):
+    """Run an export against one read snapshot so every sheet agrees"""
+    @functools.wraps(export)
+    def wrapper(self, user_id, *args, **kwargs):
+        with self.db.read_snapshot(user_id):
+            return export(self, user_id, *args, **kwargs)
+    return wrapper
 
 class ExcelExporter:
-    def __init__(self):
-        self.db = ExpenseDatabase()
+    def __init__(self, db=None):
+        self.db = db or create_store()
         self.thin_border = Border(
             left=Side(style='thin'),
             right=Side(style='thin'),
             top=Side(style='thin'),
             bottom=Side(style='thin')
         )
-    
+
+    @_snapshot
     def export_all_expenses(self, user_id, filename=None):
         """Export all user expenses to Excel"""
         if not filename:
             filename = f"expenses_{user_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-        
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "All Expenses"
-        
-        # Get all expenses
-        expenses = self.db.get_expenses(user_id)
-        
-        if not expenses:
-            ws['A1'] = "No expenses found"
+
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet("All Expenses")
+
+        # Column widths must be set before the first row is written
+        for col, width in zip("ABCDEF", [8, 18, 15, 12, 30, 12]):
+            ws.column_dimensions[col].width = width
+
+        # Stream all expenses, grouping by month on the way through
+        headers = ["ID", "Date", "Category", "Amount", "Description", "Source"]
+        monthly_data = {}
+        row_count = 0
+
+        for exp_id, amount, category, description, ts in self.db.iter_expenses(user_id, include_archive=True):
+            if row_count == 0:
+                self._add_headers(ws, headers)
+            row_count += 1
+
+            date_obj = from_epoch(ts)
+            month_key = date_obj.strftime("%Y-%m")
+            monthly_data[month_key] = monthly_data.get(month_key, 0) + amount
+
+            ws.append([
+                self._cell(ws, exp_id, border=True),
+                self._cell(ws, date_obj.strftime("%d-%m-%Y %H:%M"), border=True),
+                self._cell(ws, category, border=True),
+                self._cell(ws, amount, border=True, number_format=CURRENCY_FORMAT),
+                self._cell(ws, description, border=True),
+                self._cell(ws, "Text", border=True),
+            ])
+
+        if not row_count:
+            ws.append(["No expenses found"])
             wb.save(filename)
             return filename
-        
-        # Headers
-        headers = ["ID", "Date", "Category", "Amount", "Description", "Source"]
-        self._add_headers(ws, headers)
-        
-        # Data
-        for row_idx, (exp_id, amount, category, description, date) in enumerate(expenses, start=2):
-            date_obj = datetime.fromisoformat(date)
-            ws[f'A{row_idx}'] = exp_id
-            ws[f'B{row_idx}'] = date_obj.strftime("%d-%m-%Y %H:%M")
-            ws[f'C{row_idx}'] = category
-            ws[f'D{row_idx}'] = amount
-            ws[f'E{row_idx}'] = description
-            ws[f'F{row_idx}'] = "Text"
-            
-            # Format currency column
-            ws[f'D{row_idx}'].number_format = f'"{CURRENCY}"#,##0.00'
-            
-            # Apply border
-            for col in ['A', 'B', 'C', 'D', 'E', 'F']:
-                ws[f'{col}{row_idx}'].border = self.thin_border
-        
-        # Auto-adjust column widths
-        ws.column_dimensions['A'].width = 8
-        ws.column_dimensions['B'].width = 18
-        ws.column_dimensions['C'].width = 15
-        ws.column_dimensions['D'].width = 12
-        ws.column_dimensions['E'].width = 30
-        ws.column_dimensions['F'].width = 12
-        
+
         # Add summary sheet
-        self._add_summary_sheet(wb, user_id, expenses)
-        
+        self._add_summary_sheet(wb, user_id)
+
         # Add monthly breakdown sheet
-        self._add_monthly_breakdown(wb, user_id, expenses)
-        
+        self._add_monthly_breakdown(wb, monthly_data)
+
         wb.save(filename)
         return filename
-    
+
+    @_snapshot
     def export_monthly_expenses(self, user_id, filename=None):
         """Export expenses for the current month"""
         if not filename:
             filename = f"expenses_monthly_{user_id}_{datetime.now().strftime('%Y%m_%d_%H%M%S')}.xlsx"
-        
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Monthly Expenses"
-        
+
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet("Monthly Expenses")
+
         # Get monthly expenses
         expenses = self.db.get_summary(user_id, days=30)
-        all_expenses = self.db.get_expenses(user_id, days=30)
-        
-        if not all_expenses:
-            ws['A1'] = "No expenses found for this month"
+
+        if not expenses:
+            ws.append(["No expenses found for this month"])
             wb.save(filename)
             return filename
-        
+
+        # Column widths
+        for col, width in zip("ABCD", [15, 15, 18, 18]):
+            ws.column_dimensions[col].width = width
+
         # Headers
         headers = ["Category", "Total Amount", "Transaction Count", "Average Per Item"]
         self._add_headers(ws, headers)
-        
+
         # Data
-        for row_idx, (category, total, count) in enumerate(expenses, start=2):
+        for category, total, count in expenses:
             avg = total / count if count > 0 else 0
-            ws[f'A{row_idx}'] = category
-            ws[f'B{row_idx}'] = total
-            ws[f'C{row_idx}'] = count
-            ws[f'D{row_idx}'] = avg
-            
-            # Format currency columns
-            ws[f'B{row_idx}'].number_format = f'"{CURRENCY}"#,##0.00'
-            ws[f'D{row_idx}'].number_format = f'"{CURRENCY}"#,##0.00'
-            
-            # Apply border
-            for col in ['A', 'B', 'C', 'D']:
-                ws[f'{col}{row_idx}'].border = self.thin_border
-        
+            ws.append([
+                self._cell(ws, category, border=True),
+                self._cell(ws, total, border=True, number_format=CURRENCY_FORMAT),
+                self._cell(ws, count, border=True),
+                self._cell(ws, avg, border=True, number_format=CURRENCY_FORMAT),
+            ])
+
         # Add total row
         total_row = len(expenses) + 2
-        ws[f'A{total_row}'] = "TOTAL"
-        ws[f'A{total_row}'].font = Font(bold=True)
-        ws[f'B{total_row}'] = f"=SUM(B2:B{total_row - 1})"
-        ws[f'B{total_row}'].font = Font(bold=True)
-        ws[f'B{total_row}'].number_format = f'"{CURRENCY}"#,##0.00'
-        ws[f'B{total_row}'].fill = PatternFill(start_color="FFFF00", end_color="FFFF00", fill_type="solid")
-        
-        for col in ['A', 'B']:
-            ws[f'{col}{total_row}'].border = self.thin_border
-        
-        # Column widths
-        ws.column_dimensions['A'].width = 15
-        ws.column_dimensions['B'].width = 15
-        ws.column_dimensions['C'].width = 18
-        ws.column_dimensions['D'].width = 18
-        
+        ws.append([
+            self._cell(ws, "TOTAL", font=Font(bold=True), border=True),
+            self._cell(ws, f"=SUM(B2:B{total_row - 1})", font=Font(bold=True), border=True,
+                       number_format=CURRENCY_FORMAT,
+                       fill=PatternFill(start_color="FFFF00", end_color="FFFF00", fill_type="solid")),
+        ])
+
         # Add detailed transactions sheet
-        self._add_detailed_sheet(wb, all_expenses)
-        
+        self._add_detailed_sheet(wb, self.db.iter_expenses(user_id, start=window_start(30)))
+
         wb.save(filename)
         return filename
-    
+
+    @_snapshot
     def export_custom_period(self, user_id, days, filename=None):
         """Export expenses for a custom period"""
         if not filename:
             filename = f"expenses_{days}days_{user_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-        
-        wb = Workbook()
-        ws = wb.active
-        ws.title = f"Last {days} Days"
-        
+
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet(f"Last {days} Days")
+
         # Get expenses for period
-        all_expenses = self.db.get_expenses(user_id, days=days)
         summary = self.db.get_summary(user_id, days=days)
-        
-        if not all_expenses:
-            ws['A1'] = f"No expenses found in the last {days} days"
+
+        if not summary:
+            ws.append([f"No expenses found in the last {days} days"])
             wb.save(filename)
             return filename
-        
+
+        # Column widths
+        for col, width in zip("ABCD", [15, 15, 12, 15]):
+            ws.column_dimensions[col].width = width
+
         # Summary section
-        ws['A1'] = f"Expense Summary - Last {days} Days"
-        ws['A1'].font = Font(bold=True, size=14)
-        ws['A1'].fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
-        ws['A1'].font = Font(bold=True, size=14, color="FFFFFF")
-        
+        ws.append([self._cell(ws, f"Expense Summary - Last {days} Days",
+                              font=Font(bold=True, size=14, color="FFFFFF"),
+                              fill=PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid"))])
+        ws.append([])
+
         # Summary headers
-        ws['A3'] = "Category"
-        ws['B3'] = "Total"
-        ws['C3'] = "Count"
-        ws['D3'] = "Avg/Item"
-        
-        for col in ['A', 'B', 'C', 'D']:
-            ws[f'{col}3'].font = Font(bold=True)
-            ws[f'{col}3'].fill = PatternFill(start_color="E7E6E6", end_color="E7E6E6", fill_type="solid")
-            ws[f'{col}3'].border = self.thin_border
-        
+        header_fill = PatternFill(start_color="E7E6E6", end_color="E7E6E6", fill_type="solid")
+        ws.append([
+            self._cell(ws, header, font=Font(bold=True), fill=header_fill, border=True)
+            for header in ["Category", "Total", "Count", "Avg/Item"]
+        ])
+
         # Summary data
         total_sum = 0
-        for row_idx, (category, total, count) in enumerate(summary, start=4):
+        for category, total, count in summary:
             avg = total / count if count > 0 else 0
-            ws[f'A{row_idx}'] = category
-            ws[f'B{row_idx}'] = total
-            ws[f'C{row_idx}'] = count
-            ws[f'D{row_idx}'] = avg
             total_sum += total
-            
-            ws[f'B{row_idx}'].number_format = f'"{CURRENCY}"#,##0.00'
-            ws[f'D{row_idx}'].number_format = f'"{CURRENCY}"#,##0.00'
-            
-            for col in ['A', 'B', 'C', 'D']:
-                ws[f'{col}{row_idx}'].border = self.thin_border
-        
+            ws.append([
+                self._cell(ws, category, border=True),
+                self._cell(ws, total, border=True, number_format=CURRENCY_FORMAT),
+                self._cell(ws, count, border=True),
+                self._cell(ws, avg, border=True, number_format=CURRENCY_FORMAT),
+            ])
+
         # Total row
-        total_row = len(summary) + 4
-        ws[f'A{total_row}'] = "TOTAL"
-        ws[f'A{total_row}'].font = Font(bold=True)
-        ws[f'B{total_row}'] = total_sum
-        ws[f'B{total_row}'].font = Font(bold=True)
-        ws[f'B{total_row}'].number_format = f'"{CURRENCY}"#,##0.00'
-        ws[f'B{total_row}'].fill = PatternFill(start_color="92D050", end_color="92D050", fill_type="solid")
-        
-        for col in ['A', 'B']:
-            ws[f'{col}{total_row}'].border = self.thin_border
-        
-        # Column widths
-        ws.column_dimensions['A'].width = 15
-        ws.column_dimensions['B'].width = 15
-        ws.column_dimensions['C'].width = 12
-        ws.column_dimensions['D'].width = 15
-        
+        ws.append([
+            self._cell(ws, "TOTAL", font=Font(bold=True), border=True),
+            self._cell(ws, total_sum, font=Font(bold=True), border=True,
+                       number_format=CURRENCY_FORMAT,
+                       fill=PatternFill(start_color="92D050", end_color="92D050", fill_type="solid")),
+        ])
+
         # Add detailed transactions sheet
-        self._add_detailed_sheet(wb, all_expenses, sheet_name=f"Details - {days}d")
-        
+        self._add_detailed_sheet(wb, self.db.iter_expenses(user_id, start=window_start(days)),
+                                 sheet_name=f"Details - {days}d")
+
         wb.save(filename)
         return filename
-    
+
+    @_snapshot
+    def export_csv(self, user_id, filename=None):
+        """Export all user expenses to CSV, return None if there are none"""
+        if not filename:
+            filename = f"expenses_{user_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+
+        row_count = 0
+        with open(filename, 'w', newline='', encoding='utf-8') as f:
+            f.write("Date,Category,Amount,Description\n")
+            writer = csv.writer(f, quoting=csv.QUOTE_ALL, lineterminator="\n")
+            for exp_id, amount, category, description, ts in self.db.iter_expenses(user_id, include_archive=True):
+                writer.writerow([from_epoch(ts).strftime("%Y-%m-%d %H:%M:%S"), category, amount, description])
+                row_count += 1
+
+        if not row_count:
+            os.remove(filename)
+            return None
+        return filename
+
+    def _cell(self, ws, value, font=None, fill=None, border=False, number_format=None, alignment=None):
+        """Build a styled cell for a write-only worksheet"""
+        cell = WriteOnlyCell(ws, value=value)
+        if font:
+            cell.font = font
+        if fill:
+            cell.fill = fill
+        if border:
+            cell.border = self.thin_border
+        if number_format:
+            cell.number_format = number_format
+        if alignment:
+            cell.alignment = alignment
+        return cell
+
     def _add_headers(self, ws, headers):
         """Add formatted headers to worksheet"""
         header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
         header_font = Font(bold=True, color="FFFFFF", size=12)
-        
-        for col_idx, header in enumerate(headers, start=1):
-            cell = ws.cell(row=1, column=col_idx)
-            cell.value = header
-            cell.fill = header_fill
-            cell.font = header_font
-            cell.alignment = Alignment(horizontal='center', vertical='center')
-            cell.border = self.thin_border
-    
-    def _add_summary_sheet(self, wb, user_id, expenses):
+
+        ws.append([
+            self._cell(ws, header, font=header_font, fill=header_fill, border=True,
+                       alignment=Alignment(horizontal='center', vertical='center'))
+            for header in headers
+        ])
+
+    def _add_summary_sheet(self, wb, user_id):
         """Add summary sheet to workbook"""
         ws = wb.create_sheet("Summary")
-        
-        ws['A1'] = "Expense Summary"
-        ws['A1'].font = Font(bold=True, size=14)
-        ws['A1'].fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
-        ws['A1'].font = Font(bold=True, size=14, color="FFFFFF")
-        
+        for col, width in zip("ABC", [20, 15, 10]):
+            ws.column_dimensions[col].width = width
+
+        ws.append([self._cell(ws, "Expense Summary",
+                              font=Font(bold=True, size=14, color="FFFFFF"),
+                              fill=PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid"))])
+        ws.append([])
+
         # Calculate summary data
-        summary_30 = self.db.get_summary(user_id, days=30)
-        summary_7 = self.db.get_summary(user_id, days=7)
-        
+        summaries = self.db.get_multi_window_summary(user_id, (7, 30))
+        summary_7, summary_30 = summaries[7], summaries[30]
+
         total_30 = sum(amount for _, amount, _ in summary_30)
         total_7 = sum(amount for _, amount, _ in summary_7)
-        
+
         # Summary stats
-        ws['A3'] = "Last 7 Days:"
-        ws['B3'] = total_7
-        ws['B3'].number_format = f'"{CURRENCY}"#,##0.00'
-        ws['B3'].font = Font(bold=True)
-        
-        ws['A4'] = "Last 30 Days:"
-        ws['B4'] = total_30
-        ws['B4'].number_format = f'"{CURRENCY}"#,##0.00'
-        ws['B4'].font = Font(bold=True)
-        
+        ws.append(["Last 7 Days:", self._cell(ws, total_7, font=Font(bold=True), number_format=CURRENCY_FORMAT)])
+        ws.append(["Last 30 Days:", self._cell(ws, total_30, font=Font(bold=True), number_format=CURRENCY_FORMAT)])
+
         if total_30 > 0:
-            ws['A5'] = "Daily Average (30d):"
-            ws['B5'] = total_30 / 30
-            ws['B5'].number_format = f'"{CURRENCY}"#,##0.00'
-        
+            ws.append(["Daily Average (30d):", self._cell(ws, total_30 / 30, number_format=CURRENCY_FORMAT)])
+        else:
+            ws.append([])
+        ws.append([])
+
         # Category breakdown
-        ws['A7'] = "Category Breakdown (30 Days)"
-        ws['A7'].font = Font(bold=True, size=11)
-        
-        ws['A8'] = "Category"
-        ws['B8'] = "Amount"
-        ws['C8'] = "Count"
-        
-        for col in ['A', 'B', 'C']:
-            ws[f'{col}8'].font = Font(bold=True)
-            ws[f'{col}8'].fill = PatternFill(start_color="E7E6E6", end_color="E7E6E6", fill_type="solid")
-        
-        for row_idx, (category, amount, count) in enumerate(summary_30, start=9):
-            ws[f'A{row_idx}'] = category
-            ws[f'B{row_idx}'] = amount
-            ws[f'C{row_idx}'] = count
-            ws[f'B{row_idx}'].number_format = f'"{CURRENCY}"#,##0.00'
-        
-        ws.column_dimensions['A'].width = 20
-        ws.column_dimensions['B'].width = 15
-        ws.column_dimensions['C'].width = 10
-    
-    def _add_monthly_breakdown(self, wb, user_id, expenses):
-        """Add monthly breakdown sheet"""
+        ws.append([self._cell(ws, "Category Breakdown (30 Days)", font=Font(bold=True, size=11))])
+
+        header_fill = PatternFill(start_color="E7E6E6", end_color="E7E6E6", fill_type="solid")
+        ws.append([
+            self._cell(ws, header, font=Font(bold=True), fill=header_fill)
+            for header in ["Category", "Amount", "Count"]
+        ])
+
+        for category, amount, count in summary_30:
+            ws.append([category, self._cell(ws, amount, number_format=CURRENCY_FORMAT), count])
+
+    def _add_monthly_breakdown(self, wb, monthly_data):
+        """Add monthly breakdown sheet from {YYYY-MM: total}"""
         ws = wb.create_sheet("Monthly Breakdown")
-        
-        ws['A1'] = "Monthly Breakdown"
-        ws['A1'].font = Font(bold=True, size=14)
-        ws['A1'].fill = PatternFill(start_color="70AD47", end_color="70AD47", fill_type="solid")
-        ws['A1'].font = Font(bold=True, size=14, color="FFFFFF")
-        
-        # Group by month
-        monthly_data = {}
-        for _, amount, category, _, date in expenses:
-            date_obj = datetime.fromisoformat(date)
-            month_key = date_obj.strftime("%Y-%m")
-            if month_key not in monthly_data:
-                monthly_data[month_key] = 0
-            monthly_data[month_key] += amount
-        
-        ws['A3'] = "Month"
-        ws['B3'] = "Total Spent"
-        
-        for col in ['A', 'B']:
-            ws[f'{col}3'].font = Font(bold=True)
-            ws[f'{col}3'].fill = PatternFill(start_color="E7E6E6", end_color="E7E6E6", fill_type="solid")
-        
-        for row_idx, (month, total) in enumerate(sorted(monthly_data.items()), start=4):
-            ws[f'A{row_idx}'] = month
-            ws[f'B{row_idx}'] = total
-            ws[f'B{row_idx}'].number_format = f'"{CURRENCY}"#,##0.00'
-        
-        ws.column_dimensions['A'].width = 15
-        ws.column_dimensions['B'].width = 15
-    
+        for col, width in zip("AB", [15, 15]):
+            ws.column_dimensions[col].width = width
+
+        ws.append([self._cell(ws, "Monthly Breakdown",
+                              font=Font(bold=True, size=14, color="FFFFFF"),
+                              fill=PatternFill(start_color="70AD47", end_color="70AD47", fill_type="solid"))])
+        ws.append([])
+
+        header_fill = PatternFill(start_color="E7E6E6", end_color="E7E6E6", fill_type="solid")
+        ws.append([
+            self._cell(ws, header, font=Font(bold=True), fill=header_fill)
+            for header in ["Month", "Total Spent"]
+        ])
+
+        for month, total in sorted(monthly_data.items()):
+            ws.append([month, self._cell(ws, total, number_format=CURRENCY_FORMAT)])
+
     def _add_detailed_sheet(self, wb, expenses, sheet_name="Detailed"):
-        """Add detailed transactions sheet"""
+        """Add detailed transactions sheet from an iterable of expense rows"""
         ws = wb.create_sheet(sheet_name)
-        
+        for col, width in zip("ABCD", [18, 15, 12, 35]):
+            ws.column_dimensions[col].width = width
+
         # Headers
         headers = ["Date", "Category", "Amount", "Description"]
-        for col_idx, header in enumerate(headers, start=1):
-            cell = ws.cell(row=1, column=col_idx)
-            cell.value = header
-            cell.font = Font(bold=True, color="FFFFFF")
-            cell.fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-            cell.border = self.thin_border
-        
+        ws.append([
+            self._cell(ws, header, font=Font(bold=True, color="FFFFFF"), border=True,
+                       fill=PatternFill(start_color="366092", end_color="366092", fill_type="solid"))
+            for header in headers
+        ])
+
         # Data
-        for row_idx, (_, amount, category, description, date) in enumerate(expenses, start=2):
-            date_obj = datetime.fromisoformat(date)
-            ws[f'A{row_idx}'] = date_obj.strftime("%d-%m-%Y %H:%M")
-            ws[f'B{row_idx}'] = category
-            ws[f'C{row_idx}'] = amount
-            ws[f'D{row_idx}'] = description
-            
-            ws[f'C{row_idx}'].number_format = f'"{CURRENCY}"#,##0.00'
-            
-            for col in ['A', 'B', 'C', 'D']:
-                ws[f'{col}{row_idx}'].border = self.thin_border
-        
-        ws.column_dimensions['A'].width = 18
-        ws.column_dimensions['B'].width = 15
-        ws.column_dimensions['C'].width = 12
-        ws.column_dimensions['D'].width = 35
+        for _, amount, category, description, ts in expenses:
+            date_obj = from_epoch(ts)
+            ws.append([
+                self._cell(ws, date_obj.strftime("%d-%m-%Y %H:%M"), border=True),
+                self._cell(ws, category, border=True),
+                self._cell(ws, amount, border=True, number_format=CURRENCY_FORMAT),
+                self._cell(ws, description, border=True),
+            ])
@@ -0,0 +1,271 @@
+"""
+Spending forecasts
+Each active user gets a small model updated as expenses arrive: an
+exponentially weighted level of daily spend, a day-of-week adjustment and
+a level and trend per category. Recording an expense only adds to today's
+running totals; each day is folded into the model once, when a later day
+starts, so an update never revisits history.
+"""
+from datetime import date, datetime, timedelta
+
+from config import (
+    CURRENCY,
+    FORECAST_ALPHA,
+    FORECAST_BETA,
+    FORECAST_CACHE_SIZE,
+    FORECAST_GAMMA,
+    FORECAST_HISTORY_DAYS,
+    FORECAST_MIN_DAYS,
+)
+from database import from_epoch
+from result_cache import VersionedUserLRU
+
+# Forecasts cover the same 30 days as the monthly limit
+HORIZON_DAYS = 30
+WEEKDAYS = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+
+
+class SpendingModel:
+    """Incremental daily-spend model for one user
+
+    level is an EWMA of daily spend with the weekday effect taken out,
+    season holds additive offsets per weekday (Monday first) and
+    categories maps each category to [level, trend] (Holt's linear
+    smoothing). day is the open day whose spending is still being summed.
+    """
+
+    __slots__ = ("day", "spent", "spent_by_category", "level", "season", "categories", "days_seen")
+
+    def __init__(self, day):
+        self.day = day
+        self.spent = 0.0
+        self.spent_by_category = {}
+        self.level = None
+        self.season = [0.0] * 7
+        self.categories = {}
+        self.days_seen = 0
+
+    @classmethod
+    def from_daily_totals(cls, rows, today):
+        """Warm a model from (day 'YYYY-MM-DD', category, total) rows, oldest first
+
+        Days after today (dated in a timezone ahead of UTC) are counted as
+        today, so the open day is never later than today.
+        """
+        model = None
+        for day, category, total in rows:
+            day = min(date.fromisoformat(day), today)
+            if model is None:
+                model = cls(day)
+            model.add(day, category, total)
+        model = model or cls(today)
+        model.advance(today)
+        return model
+
+    def add(self, day, category, amount):
+        """Count spending on day, which must not be before the open day"""
+        self.advance(day)
+        self.spent += amount
+        self.spent_by_category[category] = self.spent_by_category.get(category, 0) + amount
+
+    def advance(self, day):
+        """Fold every day before `day` into the model and open `day`
+
+        After a gap longer than the history window the old days carry no
+        weight worth keeping, so at most FORECAST_HISTORY_DAYS are folded.
+        """
+        gap = (day - self.day).days
+        for _ in range(min(gap, FORECAST_HISTORY_DAYS)):
+            self._close_day()
+        if gap > 0:
+            self.day = day
+
+    def _close_day(self):
+        spent, weekday = self.spent, self.day.weekday()
+        if self.level is None:
+            self.level = spent
+        else:
+            self.level = FORECAST_ALPHA * (spent - self.season[weekday]) + (1 - FORECAST_ALPHA) * self.level
+        self.season[weekday] = FORECAST_GAMMA * (spent - self.level) + (1 - FORECAST_GAMMA) * self.season[weekday]
+
+        new = self.spent_by_category.keys() - self.categories.keys()
+        for category, state in self.categories.items():
+            level, trend = state
+            state[0] = (FORECAST_ALPHA * self.spent_by_category.get(category, 0.0)
+                        + (1 - FORECAST_ALPHA) * (level + trend))
+            state[1] = FORECAST_BETA * (state[0] - level) + (1 - FORECAST_BETA) * trend
+        # A category's first day starts its level, with no trend yet
+        for category in new:
+            self.categories[category] = [self.spent_by_category[category], 0.0]
+
+        self.days_seen += 1
+        self.day += timedelta(days=1)
+        self.spent = 0.0
+        self.spent_by_category = {}
+
+    def expected(self, day):
+        """Expected spend on a future day"""
+        if self.level is None:
+            return 0.0
+        return max(0.0, self.level + self.season[day.weekday()])
+
+    def forecast_total(self, days=HORIZON_DAYS):
+        """Expected spend over the open day and the days - 1 after it"""
+        total = max(self.spent, self.expected(self.day))
+        if self.level is None:
+            return total
+        # The later days only differ by weekday, so add each weekday's expected spend once per occurrence
+        weeks, extra = divmod(days - 1, 7)
+        first = self.day.weekday() + 1
+        for offset in range(7):
+            total += (weeks + (offset < extra)) * max(0.0, self.level + self.season[(first + offset) % 7])
+        return total
+
+    def forecast_category(self, category, days=HORIZON_DAYS):
+        """Expected spend in one category over the same days as forecast_total"""
+        spent = self.spent_by_category.get(category, 0.0)
+        level, trend = self.categories.get(category, (0.0, 0.0))
+        return max(spent, level) + sum(max(0.0, level + h * trend) for h in range(1, days))
+
+    def forecast_categories(self, days=HORIZON_DAYS):
+        """{category: (expected spend, trend per day)} for every category seen"""
+        categories = self.categories.keys() | self.spent_by_category.keys()
+        return {category: (self.forecast_category(category, days), self.categories.get(category, (0, 0))[1])
+                for category in categories}
+
+
+class _UserForecast:
+    """One user's model plus the limits its forecasts are checked against"""
+
+    __slots__ = ("model", "monthly_limit", "category_limits", "warned", "epoch")
+
+    def __init__(self, model, monthly_limit, category_limits, epoch=0):
+        self.epoch = epoch
+        self.model = model
+        self.monthly_limit = monthly_limit
+        self.category_limits = category_limits
+        self.warned = set()
+
+    def overruns(self):
+        """{None or category: (forecast, limit)} for every limit the forecast exceeds"""
+        if self.model.days_seen < FORECAST_MIN_DAYS:
+            return {}
+        overruns = {}
+        if self.monthly_limit:
+            total = self.model.forecast_total()
+            if total > self.monthly_limit:
+                overruns[None] = (total, self.monthly_limit)
+        for category, limit in self.category_limits.items():
+            total = self.model.forecast_category(category)
+            if total > limit:
+                overruns[category] = (total, limit)
+        return overruns
+
+
+class ForecastEngine(VersionedUserLRU):
+    """Per-user spending models with early budget-overrun warnings
+
+    A user's model is warmed from the last FORECAST_HISTORY_DAYS of daily
+    totals on first use and kept in an LRU of max_users; after that each
+    expense is an O(1) update. Call record_expense after the expense is
+    stored, and forget(user_id) after limits change or history is edited.
+    Warm-ups read the store without holding the engine lock, and a model
+    is warmed again when the store's data epoch moves (a bulk write such as
+    an import, possibly from another process).
+    """
+
+    def __init__(self, db, max_users=FORECAST_CACHE_SIZE):
+        super().__init__(max_users)
+        self.db = db
+
+    def _roll(self, state, today):
+        state.model.advance(today)
+
+    def _read(self, user_id, today):
+        """Warm user_id's model from the store; called without the lock"""
+        with self.db.read_snapshot(user_id):
+            epoch = self.db.get_data_epoch(user_id)
+            monthly_limit = self.db.get_budget_limits(user_id)[2]
+            category_limits = {category: limit for category, limit, _ in self.db.get_category_budgets(user_id)}
+            rows = self.db.get_daily_totals(user_id, FORECAST_HISTORY_DAYS)
+        return _UserForecast(SpendingModel.from_daily_totals(rows, today), monthly_limit, category_limits, epoch)
+
+    def _state(self, user_id, today):
+        """Cached state for user_id, warmed from the store on a miss"""
+        state, version = self._cached(user_id, today, self.db.get_data_epoch(user_id))
+        if state is None:
+            state = self._read(user_id, today)
+            with self._lock:
+                self._install(user_id, state, version)
+        return state
+
+    def record_expense(self, user_id, amount, category, ts=None):
+        """Account for a stored expense, return new overrun warnings
+
+        Warnings are (category or None for the monthly limit, forecast,
+        limit) tuples, each given once until the forecast drops back under
+        its limit. A backdated expense just drops the cached model; one
+        dated after today counts as today, as it did in the warm-up.
+        """
+        today = datetime.utcnow().date()
+        day = min((from_epoch(ts) if ts is not None else datetime.utcnow()).date(), today)
+        state, version = self._cached(user_id, today, self.db.get_data_epoch(user_id))
+        loaded = state is None
+        if loaded:
+            state = self._read(user_id, today)
+        with self._lock:
+            if loaded:
+                self._install(user_id, state, version)
+            if day != state.model.day:
+                self._users.pop(user_id, None)
+                return []
+            if loaded:
+                # A fresh load already read this expense; compare against the forecast without it
+                state.model.add(day, category, -amount)
+                state.warned = set(state.overruns())
+            state.model.add(day, category, amount)
+
+            overruns = state.overruns()
+            warnings = [(name, total, limit) for name, (total, limit) in overruns.items() if name not in state.warned]
+            state.warned = set(overruns)
+            return warnings
+
+    def forecast_total(self, user_id):
+        """Expected spend over the next HORIZON_DAYS days from the user's cached model"""
+        state = self._state(user_id, datetime.utcnow().date())
+        with self._lock:
+            return state.model.forecast_total()
+
+    def forecast(self, user_id):
+        """Forecast for the next HORIZON_DAYS days, None until FORECAST_MIN_DAYS of history
+
+        A dict with total, daily_average, monthly_limit, the busiest
+        weekday and categories: [(category, forecast, trend per day,
+        budget or None)] largest first.
+        """
+        state = self._state(user_id, datetime.utcnow().date())
+        with self._lock:
+            model = state.model
+            if model.days_seen < FORECAST_MIN_DAYS:
+                return None
+            total = model.forecast_total()
+            categories = sorted(
+                ((category, expected, trend, state.category_limits.get(category))
+                 for category, (expected, trend) in model.forecast_categories().items() if expected >= 0.01),
+                key=lambda item: item[1], reverse=True)
+            return {
+                "total": total,
+                "daily_average": total / HORIZON_DAYS,
+                "monthly_limit": state.monthly_limit,
+                "busiest_weekday": WEEKDAYS[max(range(7), key=model.season.__getitem__)],
+                "categories": categories,
+            }
+
+
+def format_forecast_warning(category, total, limit):
+    """One line of an early overrun warning"""
+    if category is None:
+        return (f"🔮 At this pace you'll spend {CURRENCY}{total:.2f} in the next {HORIZON_DAYS} days, "
+                f"over your {CURRENCY}{limit:.2f} monthly limit")
+    return (f"🔮 {category} is on pace for {CURRENCY}{total:.2f} in the next {HORIZON_DAYS} days, "
+            f"over its {CURRENCY}{limit:.2f} budget")
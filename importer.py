@@ -0,0 +1,224 @@
+"""
+Bulk import of expenses from bank statements and spreadsheet files
+Rows are streamed from CSV or XLSX files, categorized in batches and
+inserted one large transaction per batch, so memory use stays flat no
+matter how long the statement is.
+"""
+import csv
+import os
+import re
+import zipfile
+from datetime import datetime
+
+from config import EXPENSE_CATEGORIES
+from database import to_epoch
+from nlp_processor import ExpenseParser
+from storage import create_store
+
+IMPORT_BATCH_SIZE = 5000
+
+# Normalized header names (lowercase letters and digits only) for each field
+HEADER_ALIASES = {
+    "date": {"date", "transactiondate", "txndate", "valuedate", "postingdate", "trandate"},
+    "amount": {"amount", "debit", "debitamount", "withdrawal", "withdrawalamt", "withdrawalamount",
+               "amountinr", "amountrs"},
+    "credit": {"credit", "creditamount", "deposit", "depositamt", "depositamount"},
+    "type": {"drcr", "crdr", "debitcredit", "transactiontype", "txntype"},
+    "description": {"description", "narration", "particulars", "remarks", "details", "transactiondetails"},
+    "category": {"category"},
+    "transaction_id": {"transactionid", "txnid", "reference", "refno", "referenceno", "refnochequeno",
+                       "chqrefno", "utr", "utrno"},
+}
+
+DATE_FORMATS = [
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%d",
+    "%d-%m-%Y %H:%M",
+    "%d-%m-%Y",
+    "%d/%m/%Y",
+    "%d/%m/%y",
+    "%d-%b-%Y",
+    "%d %b %Y",
+    "%d-%b-%y",
+]
+
+# Rows scanned for a header before giving up (statements often start with a preamble)
+HEADER_SCAN_ROWS = 30
+
+# Distinct date strings remembered per import; statements repeat each day many times
+DATE_CACHE_SIZE = 4096
+
+# The number in an amount cell, whatever currency text surrounds it
+AMOUNT_PATTERN = re.compile(r'-?\d[\d,]*(?:\.\d+)?')
+
+
+def _normalize_header(value):
+    return re.sub(r'[^a-z0-9]', '', str(value or '').lower())
+
+
+def _parse_date(value, formats=DATE_FORMATS):
+    """(datetime, matching format) from a cell or statement date string, or (None, None)"""
+    if isinstance(value, datetime):
+        return value, None
+    text = str(value or '').strip()
+    for fmt in formats:
+        try:
+            return datetime.strptime(text, fmt), fmt
+        except ValueError:
+            continue
+    return None, None
+
+
+def _parse_amount(value):
+    """Signed float from a cell like '1,234.50', '₹ 99', 'Rs.500', '250.00 Dr' or '250.00 Cr', or None
+
+    Credits (a minus sign or a Cr suffix) come back negative.
+    """
+    if isinstance(value, (int, float)):
+        amount = float(value)
+    else:
+        text = str(value or '')
+        # The number itself, so the dot of a prefix such as "Rs." isn't read as a decimal point
+        match = AMOUNT_PATTERN.search(text)
+        if not match:
+            return None
+        amount = float(match.group().replace(',', ''))
+        if re.search(r'(?<![a-z])cr\.?\s*$', text, re.IGNORECASE):
+            amount = -abs(amount)
+    return amount if amount else None
+
+
+def _is_credit_type(value):
+    """True for a Dr/Cr or transaction type cell marking a credit"""
+    return str(value or '').strip().lower().startswith(('cr', 'credit'))
+
+
+def iter_rows(path):
+    """Stream the cells of each row of a .csv or .xlsx file"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.csv':
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            yield from csv.reader(f)
+    elif extension == '.xlsx':
+        from openpyxl import load_workbook
+        try:
+            wb = load_workbook(path, read_only=True, data_only=True)
+        except zipfile.BadZipFile:
+            raise ValueError("Not a valid .xlsx file")
+        try:
+            yield from wb.active.iter_rows(values_only=True)
+        finally:
+            wb.close()
+    else:
+        raise ValueError(f"Unsupported file type {extension!r}, use .csv or .xlsx")
+
+
+def _find_columns(rows):
+    """Consume rows up to the header, return {field: column index}"""
+    for _, row in zip(range(HEADER_SCAN_ROWS), rows):
+        columns = {}
+        for index, cell in enumerate(row):
+            name = _normalize_header(cell)
+            for field, aliases in HEADER_ALIASES.items():
+                if name in aliases and field not in columns:
+                    columns[field] = index
+        if "date" in columns and "amount" in columns:
+            return columns
+    raise ValueError("No header row with a date and an amount column found")
+
+
+class _DateReader:
+    """Date cells of one import as epoch seconds
+
+    Each distinct string is parsed once, and the format that matched last
+    is tried first, since a statement uses one format throughout.
+    """
+
+    def __init__(self):
+        self.cache = {}
+        self.formats = list(DATE_FORMATS)
+
+    def epoch(self, value):
+        """Epoch seconds for a date cell, or None if it isn't a date"""
+        if value in self.cache:
+            return self.cache[value]
+
+        date, fmt = _parse_date(value, self.formats)
+        if fmt and fmt != self.formats[0]:
+            self.formats.remove(fmt)
+            self.formats.insert(0, fmt)
+        ts = to_epoch(date) if date else None
+
+        if len(self.cache) >= DATE_CACHE_SIZE:
+            self.cache.clear()
+        self.cache[value] = ts
+        return ts
+
+
+class ExpenseImporter:
+    """Import expenses for a user from a CSV or XLSX statement"""
+
+    def __init__(self, db=None, parser=None, batch_size=IMPORT_BATCH_SIZE):
+        self.db = db or create_store()
+        self.parser = parser or ExpenseParser()
+        self.batch_size = batch_size
+
+    def import_file(self, user_id, path, source="import"):
+        """Import every expense row in path
+
+        Returns a dict with the number of rows imported, skipped as
+        duplicate transaction IDs, skipped as credits (refunds, deposits,
+        negative or Cr amounts), and skipped as unreadable.
+        """
+        result = {"imported": 0, "duplicates": 0, "credits": 0, "invalid": 0}
+        rows = iter_rows(path)
+        columns = _find_columns(rows)
+        # Per-call, since the bot shares one importer between concurrent imports
+        dates = _DateReader()
+
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                self._import_batch(user_id, batch, columns, dates, source, result)
+                batch = []
+        if batch:
+            self._import_batch(user_id, batch, columns, dates, source, result)
+        return result
+
+    def _import_batch(self, user_id, batch, columns, dates, source, result):
+        """Parse, categorize and insert one batch of raw rows"""
+        def cell(row, field):
+            index = columns.get(field)
+            return row[index] if index is not None and index < len(row) else None
+
+        parsed = []
+        for row in batch:
+            ts = dates.epoch(cell(row, "date"))
+            amount = _parse_amount(cell(row, "amount"))
+            if ts is not None and (
+                    (amount or 0) < 0 or _is_credit_type(cell(row, "type"))
+                    or (amount is None and (_parse_amount(cell(row, "credit")) or 0) > 0)):
+                # Money coming in is not an expense
+                result["credits"] += 1
+                continue
+            if ts is None or not amount:
+                result["invalid"] += 1
+                continue
+            description = str(cell(row, "description") or "").strip()
+            category = str(cell(row, "category") or "").strip().capitalize()
+            transaction_id = str(cell(row, "transaction_id") or "").strip() or None
+            parsed.append([amount, category, description, ts, transaction_id])
+
+        # Only rows without a known category go through the parser
+        uncategorized = [row for row in parsed if row[1] not in EXPENSE_CATEGORIES]
+        for row, category in zip(uncategorized, self.parser.categorize_batch([row[2] for row in uncategorized])):
+            row[1] = category
+
+        expenses = [
+            (amount, category, description, ts, source, transaction_id, None, None)
+            for amount, category, description, ts, transaction_id in parsed
+        ]
+        inserted, duplicates = self.db.import_expenses(user_id, expenses)
+        result["imported"] += inserted
+        result["duplicates"] += duplicates
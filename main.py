@@ -2,20 +2,24 @@
 Main Telegram Bot Handler for Expense Tracker
 """
 import logging
+import re
+from datetime import time
 from telegram import Update
 from telegram.ext import (
     Application,
     CommandHandler,
+    CallbackQueryHandler,
     MessageHandler,
     filters,
     ContextTypes,
 )
 from telegram.error import TelegramError
 
-from config import BOT_TOKEN, CURRENCY
-from database import ExpenseDatabase
+from config import BOT_TOKEN, CURRENCY, MAINTENANCE_HOUR_UTC, RECURRING_TICK_SECONDS
 from nlp_processor import ExpenseParser
 from bot_commands import (
+    open_store,
+    budget_alert_lines,
     start,
     help_command,
     summary,
@@ -24,7 +28,9 @@ from bot_commands import (
     today_total,
     show_categories,
     list_expenses,
+    list_expenses_page,
     delete_expense,
+    search_expenses,
     statistics,
     export_all,
     export_monthly,
@@ -34,11 +40,21 @@ from bot_commands import (
     set_weekly_limit,
     set_monthly_limit,
     check_limits,
+    set_category_budget,
+    list_category_budgets,
+    forecast,
+    recurring_expenses,
     report_week,
     report_month,
     export_csv,
     export_pdf,
     export_graph,
+    import_help,
+    import_document,
+    maintenance,
+    maintenance_job,
+    dbstats,
+    recurring_job,
 )
 
 # Set up logging
@@ -48,9 +64,21 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Initialize database and parser
-db = ExpenseDatabase()
+# A real transaction reference in a screenshot caption ("TXID: ...", "UTR #...", "Txn ID: ...");
+# other caption lines such as "UPI ID: name@bank" are not transaction IDs
+TRANSACTION_ID_PATTERN = re.compile(r'\b(?:TXID|UTR|Txn\s*ID)\s*[:#]\s*([A-Za-z0-9]{6,})', re.I)
+
+# Initialize parser; the async database is shared with bot_commands and opened in main()
 parser = ExpenseParser()
+db = None
+
+
+async def send_budget_alerts(update: Update, user_id, amount, category) -> None:
+    """Update the running budget totals and forecast, warn about crossed or projected limits"""
+    lines = await budget_alert_lines(user_id, amount, category)
+    if lines:
+        warning_text = "*Budget Alert:*\n" + "\n".join(lines)
+        await update.message.reply_text(warning_text, parse_mode='Markdown')
 
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -60,7 +88,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return
     
     user = update.effective_user
-    db.add_user(user.id, user.username, user.first_name)
+    await db.add_user(user.id, user.username, user.first_name)
     
     text = update.message.text.strip()
     
@@ -87,7 +115,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return
     
     # Store in database
-    db.add_expense(user.id, amount, category, description, source="text")
+    await db.add_expense(user.id, amount, category, description, source="text")
     
     # Send confirmation
     confirmation = (
@@ -100,50 +128,8 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     
     await update.message.reply_text(confirmation, parse_mode='Markdown')
     
-    # Check budget limits and send warning if needed
-    daily_limit, weekly_limit, monthly_limit = db.get_budget_limits(user.id)
-    
-    if any([daily_limit, weekly_limit, monthly_limit]):
-        today_total = db.get_total_today(user.id)
-        week_total = db.get_total_week(user.id)
-        month_total = db.get_total_month(user.id)
-        
-        warnings = []
-        
-        # Check daily limit
-        if daily_limit:
-            daily_percentage = (today_total / daily_limit) * 100
-            if daily_percentage >= 100:
-                warnings.append(f"🔴 Daily limit EXCEEDED: {CURRENCY}{today_total:.2f} / {CURRENCY}{daily_limit:.2f}")
-            elif daily_percentage >= 90:
-                warnings.append(f"⚠️ Daily limit at 90%: {CURRENCY}{today_total:.2f} / {CURRENCY}{daily_limit:.2f}")
-            elif daily_percentage >= 75:
-                warnings.append(f"⚡ Daily limit at 75%: {CURRENCY}{today_total:.2f} / {CURRENCY}{daily_limit:.2f}")
-        
-        # Check weekly limit
-        if weekly_limit:
-            weekly_percentage = (week_total / weekly_limit) * 100
-            if weekly_percentage >= 100:
-                warnings.append(f"🔴 Weekly limit EXCEEDED: {CURRENCY}{week_total:.2f} / {CURRENCY}{weekly_limit:.2f}")
-            elif weekly_percentage >= 90:
-                warnings.append(f"⚠️ Weekly limit at 90%: {CURRENCY}{week_total:.2f} / {CURRENCY}{weekly_limit:.2f}")
-            elif weekly_percentage >= 75:
-                warnings.append(f"⚡ Weekly limit at 75%: {CURRENCY}{week_total:.2f} / {CURRENCY}{weekly_limit:.2f}")
-        
-        # Check monthly limit
-        if monthly_limit:
-            monthly_percentage = (month_total / monthly_limit) * 100
-            if monthly_percentage >= 100:
-                warnings.append(f"🔴 Monthly limit EXCEEDED: {CURRENCY}{month_total:.2f} / {CURRENCY}{monthly_limit:.2f}")
-            elif monthly_percentage >= 90:
-                warnings.append(f"⚠️ Monthly limit at 90%: {CURRENCY}{month_total:.2f} / {CURRENCY}{monthly_limit:.2f}")
-            elif monthly_percentage >= 75:
-                warnings.append(f"⚡ Monthly limit at 75%: {CURRENCY}{month_total:.2f} / {CURRENCY}{monthly_limit:.2f}")
-        
-        # Send warning if any
-        if warnings:
-            warning_text = "*Budget Alert:*\n" + "\n".join(warnings)
-            await update.message.reply_text(warning_text, parse_mode='Markdown')
+    # Budget warnings fire once per threshold crossed, not on every message
+    await send_budget_alerts(update, user.id, amount, category)
 
 
 async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -153,7 +139,7 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         return
     
     user = update.effective_user
-    db.add_user(user.id, user.username, user.first_name)
+    await db.add_user(user.id, user.username, user.first_name)
     
     # Get the file
     photo = update.message.photo[-1]  # Get largest quality
@@ -176,7 +162,7 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
             return
         
         # Store expense
-        db.add_expense(
+        await db.add_expense(
             user.id,
             result['amount'],
             result['category'],
@@ -193,6 +179,7 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         )
         
         await update.message.reply_text(confirmation, parse_mode='Markdown')
+        await send_budget_alerts(update, user.id, result['amount'], result['category'])
         
     except Exception as e:
         logger.error(f"Error processing receipt: {str(e)}")
@@ -214,7 +201,7 @@ async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         return
     
     user = update.effective_user
-    db.add_user(user.id, user.username, user.first_name)
+    await db.add_user(user.id, user.username, user.first_name)
     
     await update.message.reply_text("🎤 Processing voice message...")
     
@@ -252,7 +239,7 @@ async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
             return
         
         # Store expense
-        db.add_expense(user.id, amount, category, description, source="voice")
+        await db.add_expense(user.id, amount, category, description, source="voice")
         
         confirmation = (
             f"✅ **Voice Bill Recorded!**\n\n"
@@ -264,6 +251,7 @@ async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         )
         
         await update.message.reply_text(confirmation, parse_mode='Markdown')
+        await send_budget_alerts(update, user.id, amount, category)
         
     except Exception as e:
         logger.error(f"Error processing voice: {str(e)}")
@@ -285,7 +273,7 @@ async def handle_screenshot(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return
     
     user = update.effective_user
-    db.add_user(user.id, user.username, user.first_name)
+    await db.add_user(user.id, user.username, user.first_name)
     
     # Check if it's a screenshot (caption might indicate payment info)
     caption = update.message.caption or ""
@@ -323,15 +311,15 @@ async def handle_screenshot(update: Update, context: ContextTypes.DEFAULT_TYPE)
         
         # Try to extract from caption
         if caption:
-            lines = caption.split('\n')
-            for line in lines:
-                if 'tx' in line.lower() or 'id' in line.lower():
-                    transaction_id = line.split(':')[-1].strip()
+            match = TRANSACTION_ID_PATTERN.search(caption)
+            if match:
+                transaction_id = match.group(1)
+            for line in caption.split('\n'):
                 if 'account' in line.lower():
                     account_name = line.split(':')[-1].strip()
         
-        # Store with transaction details
-        db.add_expense(
+        # Store with transaction details (the unique index rejects a repeated transaction ID)
+        inserted = await db.add_expense(
             user.id,
             result['amount'],
             result['category'],
@@ -342,21 +330,30 @@ async def handle_screenshot(update: Update, context: ContextTypes.DEFAULT_TYPE)
             payment_method="digital"
         )
         
-        confirmation = (
-            f"✅ **Online Payment Recorded!**\n\n"
-            f"💰 Amount: {CURRENCY}{result['amount']:.2f}\n"
-            f"🏷️ Category: {result['category']}\n"
-        )
-        
-        if transaction_id:
-            confirmation += f"🔑 Transaction ID: `{transaction_id}`\n"
-        if account_name:
-            confirmation += f"🏦 Account: {account_name}\n"
-        
-        confirmation += f"\n📱 Source: Online Payment/Screenshot\n\n"
-        confirmation += f"Use /summary to track your spending!"
+        if inserted:
+            confirmation = (
+                f"✅ **Online Payment Recorded!**\n\n"
+                f"💰 Amount: {CURRENCY}{result['amount']:.2f}\n"
+                f"🏷️ Category: {result['category']}\n"
+            )
+            
+            if transaction_id:
+                confirmation += f"🔑 Transaction ID: `{transaction_id}`\n"
+            if account_name:
+                confirmation += f"🏦 Account: {account_name}\n"
+            
+            confirmation += f"\n📱 Source: Online Payment/Screenshot\n\n"
+            confirmation += f"Use /summary to track your spending!"
+        else:
+            confirmation = (
+                f"⚠️ **Duplicate payment skipped**\n\n"
+                f"Transaction ID `{transaction_id}` is already recorded.\n"
+                f"Use /list to see your expenses."
+            )
         
         await update.message.reply_text(confirmation, parse_mode='Markdown')
+        if inserted:
+            await send_budget_alerts(update, user.id, result['amount'], result['category'])
         
     except Exception as e:
         logger.error(f"Error processing payment screenshot: {str(e)}")
@@ -376,11 +373,18 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     logger.error(msg="Exception while handling an update:", exc_info=context.error)
 
 
+async def on_shutdown(application: Application) -> None:
+    """Drain pending database work and close connections"""
+    db.close()
+
+
 def main():
     """Start the bot"""
+    global db
+    db = open_store()
     
     # Create application
-    application = Application.builder().token(BOT_TOKEN).build()
+    application = Application.builder().token(BOT_TOKEN).post_shutdown(on_shutdown).build()
     
     # Add handlers
     application.add_handler(CommandHandler("start", start))
@@ -391,7 +395,9 @@ def main():
     application.add_handler(CommandHandler("today", today_total))
     application.add_handler(CommandHandler("categories", show_categories))
     application.add_handler(CommandHandler("list", list_expenses))
+    application.add_handler(CallbackQueryHandler(list_expenses_page, pattern=r'^list\|'))
     application.add_handler(CommandHandler("delete", delete_expense))
+    application.add_handler(CommandHandler("search", search_expenses))
     application.add_handler(CommandHandler("stats", statistics))
     
     # Export commands
@@ -400,6 +406,7 @@ def main():
     application.add_handler(CommandHandler("export_weekly", export_weekly))
     application.add_handler(CommandHandler("export_today", export_today_data))
     application.add_handler(CommandHandler("export_csv", export_csv))
+    application.add_handler(CommandHandler("import", import_help))
     application.add_handler(CommandHandler("pdf", export_pdf))
     application.add_handler(CommandHandler("graph", export_graph))
     
@@ -408,19 +415,39 @@ def main():
     application.add_handler(CommandHandler("setweekly", set_weekly_limit))
     application.add_handler(CommandHandler("setmonthly", set_monthly_limit))
     application.add_handler(CommandHandler("limits", check_limits))
+    application.add_handler(CommandHandler("setbudget", set_category_budget))
+    application.add_handler(CommandHandler("budgets", list_category_budgets))
+    application.add_handler(CommandHandler("forecast", forecast))
+    application.add_handler(CommandHandler("recurring", recurring_expenses))
     
     # Report commands
     application.add_handler(CommandHandler("week", report_week))
     application.add_handler(CommandHandler("month", report_month))
     
+    # Admin commands
+    application.add_handler(CommandHandler("maintenance", maintenance))
+    application.add_handler(CommandHandler("dbstats", dbstats))
+    
     # Message handlers
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
     application.add_handler(MessageHandler(filters.PHOTO, handle_screenshot))
     application.add_handler(MessageHandler(filters.VOICE, handle_voice))
+    application.add_handler(MessageHandler(
+        filters.Document.FileExtension("csv") | filters.Document.FileExtension("xlsx"), import_document
+    ))
     
     # Error handler
     application.add_error_handler(error_handler)
     
+    # Daily database maintenance at a quiet hour; recurring expenses as they come due
+    # (the first run right at startup catches up on anything missed while the bot was down)
+    if application.job_queue:
+        application.job_queue.run_daily(maintenance_job, time=time(hour=MAINTENANCE_HOUR_UTC), name="db-maintenance")
+        application.job_queue.run_repeating(recurring_job, interval=RECURRING_TICK_SECONDS, first=0, name="recurring")
+    else:
+        logger.warning("No job queue (install python-telegram-bot[job-queue]); scheduled maintenance "
+                       "and recurring expenses are off")
+    
     # Start polling
     logger.info("Bot started polling...")
     print("[*] Expense Tracker Bot is running!")
@@ -0,0 +1,75 @@
+"""
+Routine SQLite upkeep for the expense database
+Refreshes planner statistics, hands free pages back to the filesystem and
+checkpoints the WAL, one shard file at a time, stopping once its time
+budget is spent. The bot runs it daily at a quiet hour; admins can also
+run it with /maintenance or `python manage.py maintain`.
+"""
+import logging
+import os
+import time
+
+from config import MAINTENANCE_ANALYSIS_LIMIT, MAINTENANCE_VACUUM_PAGES
+
+logger = logging.getLogger(__name__)
+
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+def file_bytes(path):
+    """Bytes used on disk by a database file and its WAL"""
+    return sum(os.path.getsize(p) for p in (path, path + '-wal') if os.path.exists(p))
+
+
+def maintain_shard(conn, path, deadline, full_vacuum=False, vacuum_pages=MAINTENANCE_VACUUM_PAGES):
+    """Run the maintenance steps on one database file until deadline (time.monotonic())
+
+    full_vacuum rebuilds the file with VACUUM when it isn't in incremental
+    auto_vacuum mode yet; that blocks writers for the whole rebuild, so the
+    bot never asks for it. Returns a report dict with the path, seconds
+    taken, bytes reclaimed and the steps run and skipped.
+    """
+    start = time.monotonic()
+    before = file_bytes(path)
+    report = {"path": path, "steps": [], "skipped": []}
+
+    def step(name, func):
+        if time.monotonic() >= deadline:
+            report["skipped"].append(name)
+            return
+        func()
+        report["steps"].append(name)
+
+    def analyze():
+        # A full ANALYZE the first time, then PRAGMA optimize re-analyzes only what drifted
+        conn.execute(f'PRAGMA analysis_limit={int(MAINTENANCE_ANALYSIS_LIMIT)}')
+        analyzed = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone()
+        conn.execute('PRAGMA optimize' if analyzed else 'ANALYZE')
+
+    def vacuum():
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != AUTO_VACUUM_INCREMENTAL:
+            if full_vacuum:
+                conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+                conn.execute('VACUUM')
+            else:
+                report["skipped"].append("incremental vacuum (needs a full vacuum first)")
+            return
+        # Release free pages in small steps so the budget is honoured
+        while conn.execute('PRAGMA freelist_count').fetchone()[0] and time.monotonic() < deadline:
+            conn.execute(f'PRAGMA incremental_vacuum({int(vacuum_pages)})').fetchall()
+
+    def checkpoint():
+        busy, _, _ = conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()
+        if busy:
+            report["skipped"].append("WAL truncate (readers active)")
+
+    step("analyze", analyze)
+    step("vacuum", vacuum)
+    step("checkpoint", checkpoint)
+
+    report["seconds"] = time.monotonic() - start
+    report["reclaimed_bytes"] = before - file_bytes(path)
+    logger.info("Maintenance of %s took %.2fs, reclaimed %d bytes (ran: %s; skipped: %s)",
+                path, report["seconds"], report["reclaimed_bytes"],
+                ', '.join(report["steps"]) or 'nothing', ', '.join(report["skipped"]) or 'nothing')
+    return report
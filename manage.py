@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Administrative commands for the expense database
+Usage: python manage.py <command> [options]
+"""
+import argparse
+import sqlite3
+import sys
+import time
+
+from config import ARCHIVE_AFTER_DAYS, DATABASE_PATH, DATABASE_SHARDS, DB_BUSY_TIMEOUT, MAINTENANCE_TIME_BUDGET
+from database import ExpenseDatabase
+from importer import IMPORT_BATCH_SIZE, ExpenseImporter
+from migrations import apply_migrations, backfill_epoch_timestamps
+from sharding import reshard, shard_paths
+
+
+def rebuild_rollups(args):
+    """Repopulate the daily_rollups table from raw expenses"""
+    db = ExpenseDatabase(args.db, shards=args.shards)
+    start = time.perf_counter()
+    rows = db.rebuild_rollups()
+    db.close()
+    print(f"✅ Rebuilt {rows} daily rollup rows in {time.perf_counter() - start:.2f}s")
+    return 0
+
+
+def backfill_epoch(args):
+    """Fill the epoch ts column for rows that predate it"""
+    # Plain connections: ExpenseDatabase would already backfill on open
+    start = time.perf_counter()
+    rows = 0
+    for path in shard_paths(args.db, args.shards):
+        conn = sqlite3.connect(path, timeout=DB_BUSY_TIMEOUT)
+        apply_migrations(conn)
+        rows += backfill_epoch_timestamps(conn, args.batch_size)
+        conn.close()
+    print(f"✅ Backfilled ts for {rows} expenses in {time.perf_counter() - start:.2f}s")
+    return 0
+
+
+def shard(args):
+    """Split the current database files into a new number of shards"""
+    sources = shard_paths(args.db, args.shards)
+    targets = shard_paths(args.db, args.to)
+    if sources == targets:
+        print(f"Nothing to do: already {args.to} shard(s)")
+        return 0
+
+    start = time.perf_counter()
+    try:
+        moved = reshard(sources, targets)
+    except FileExistsError as e:
+        print(f"❌ {e}")
+        return 1
+    for path, users in zip(targets, moved):
+        print(f"  {path}: {users} users")
+    print(f"✅ Resharded into {args.to} file(s) in {time.perf_counter() - start:.2f}s")
+    print(f"Set DATABASE_SHARDS = {args.to} in config.py to start using them")
+    return 0
+
+
+def stats(args):
+    """Show users and expenses per shard"""
+    db = ExpenseDatabase(args.db, shards=args.shards)
+    for path, users, expenses in db.get_shard_stats():
+        print(f"{path}: {users} users, {expenses} expenses")
+    db.close()
+    return 0
+
+
+def import_file(args):
+    """Import a CSV/XLSX statement for one user"""
+    db = ExpenseDatabase(args.db, shards=args.shards)
+    start = time.perf_counter()
+    try:
+        result = ExpenseImporter(db, batch_size=args.batch_size).import_file(args.user, args.file)
+    except (OSError, ValueError) as e:
+        print(f"❌ {e}")
+        return 1
+    finally:
+        db.close()
+    print(f"✅ Imported {result['imported']} expenses in {time.perf_counter() - start:.2f}s "
+          f"({result['duplicates']} duplicates, {result['credits']} credits, "
+          f"{result['invalid']} unreadable rows skipped)")
+    return 0
+
+
+def archive(args):
+    """Move old expenses into per-year archive files"""
+    db = ExpenseDatabase(args.db, shards=args.shards)
+    start = time.perf_counter()
+    try:
+        rows = db.archive_expenses(args.older_than, args.batch_size)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return 1
+    finally:
+        db.close()
+    print(f"✅ Archived {rows} expenses older than {args.older_than} days in {time.perf_counter() - start:.2f}s")
+    return 0
+
+
+def maintain(args):
+    """Analyze, vacuum and checkpoint the database files"""
+    db = ExpenseDatabase(args.db, shards=args.shards)
+    try:
+        reports = db.maintain(args.time_budget, full_vacuum=args.full_vacuum)
+    finally:
+        db.close()
+    for report in reports:
+        skipped = f" (skipped: {', '.join(report['skipped'])})" if report['skipped'] else ""
+        print(f"  {report['path']}: {report['seconds']:.2f}s, {report['reclaimed_bytes']} bytes reclaimed{skipped}")
+    print(f"✅ Maintenance done, {sum(report['reclaimed_bytes'] for report in reports)} bytes reclaimed")
+    return 0
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Expense database administration")
+    arg_parser.add_argument("--db", default=DATABASE_PATH, help="database file (default: %(default)s)")
+    arg_parser.add_argument("--shards", type=int, default=DATABASE_SHARDS,
+                            help="current number of shard files (default: %(default)s)")
+    commands = arg_parser.add_subparsers(dest="command", required=True)
+
+    rebuild = commands.add_parser("rebuild-rollups", help="recompute daily summary rollups")
+    rebuild.set_defaults(func=rebuild_rollups)
+
+    backfill = commands.add_parser("backfill-epoch", help="fill integer timestamps for old expenses")
+    backfill.add_argument("--batch-size", type=int, default=5000, help="rows per transaction (default: %(default)s)")
+    backfill.set_defaults(func=backfill_epoch)
+
+    split = commands.add_parser("shard", help="copy users into a new set of shard files")
+    split.add_argument("--to", type=int, required=True, help="number of shards to create")
+    split.set_defaults(func=shard)
+
+    show = commands.add_parser("stats", help="users and expenses per shard")
+    show.set_defaults(func=stats)
+
+    load = commands.add_parser("import", help="import a CSV/XLSX bank statement for a user")
+    load.add_argument("--user", type=int, required=True, help="Telegram user ID to import for")
+    load.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE,
+                      help="rows per transaction (default: %(default)s)")
+    load.add_argument("file", help="statement file (.csv or .xlsx)")
+    load.set_defaults(func=import_file)
+
+    cold = commands.add_parser("archive", help="move old expenses into per-year archive files")
+    cold.add_argument("--older-than", type=int, default=ARCHIVE_AFTER_DAYS,
+                      help="age in days (default: %(default)s)")
+    cold.add_argument("--batch-size", type=int, default=5000, help="rows per transaction (default: %(default)s)")
+    cold.set_defaults(func=archive)
+
+    upkeep = commands.add_parser("maintain", help="analyze, vacuum and checkpoint the database files")
+    upkeep.add_argument("--time-budget", type=float, default=MAINTENANCE_TIME_BUDGET,
+                        help="seconds to spend (default: %(default)s)")
+    upkeep.add_argument("--full-vacuum", action="store_true",
+                        help="rebuild files not yet in incremental auto_vacuum mode (blocks writers)")
+    upkeep.set_defaults(func=maintain)
+
+    args = arg_parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,483 @@
+"""
+Versioned schema migrations for the expense database
+Each migration runs once, in order, inside its own transaction and is
+recorded in the schema_migrations table.
+"""
+
+
+def _create_base_tables(cursor):
+    """Tables that existed before versioned migrations"""
+    # Users table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Expenses table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS expenses (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            amount REAL NOT NULL,
+            category TEXT NOT NULL,
+            description TEXT,
+            date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            source TEXT,
+            transaction_id TEXT,
+            account_name TEXT,
+            payment_method TEXT,
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        )
+    ''')
+
+    # Categories table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS categories (
+            category_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            name TEXT NOT NULL UNIQUE,
+            color TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        )
+    ''')
+
+    # Budget limits table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS budget_limits (
+            limit_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL UNIQUE,
+            daily_limit REAL,
+            weekly_limit REAL,
+            monthly_limit REAL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        )
+    ''')
+
+
+def _add_user_date_indexes(cursor):
+    """Covering index so per-user windowed queries never scan the table"""
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_expenses_user_date
+        ON expenses (user_id, date, category, amount)
+    ''')
+    cursor.execute('ANALYZE expenses')
+
+
+# An expense's rollup day: from ts, or from the text date for rows still
+# waiting for their ts (the bot stops writing date in v14)
+EXPENSE_DAY = "COALESCE(date({row}ts, 'unixepoch'), date({row}date))"
+
+
+def rebuild_daily_rollups(cursor):
+    """Repopulate daily_rollups from the raw expenses table"""
+    day = EXPENSE_DAY.format(row='')
+    cursor.execute('DELETE FROM daily_rollups')
+    cursor.execute(f'''
+        INSERT INTO daily_rollups (user_id, day, category, total, count)
+        SELECT user_id, {day}, category, SUM(amount), COUNT(*)
+        FROM expenses
+        GROUP BY user_id, {day}, category
+    ''')
+
+
+def _add_daily_rollups(cursor):
+    """Per-user, per-day, per-category totals kept in sync by triggers"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS daily_rollups (
+            user_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            category TEXT NOT NULL,
+            total REAL NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (user_id, day, category)
+        ) WITHOUT ROWID
+    ''')
+
+    # Triggers run inside the statement that changes expenses, so rollups
+    # commit (or roll back) in the same transaction as the expense itself
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_expenses_rollup_insert
+        AFTER INSERT ON expenses
+        BEGIN
+            INSERT INTO daily_rollups (user_id, day, category, total, count)
+            VALUES (NEW.user_id, date(NEW.date), NEW.category, NEW.amount, 1)
+            ON CONFLICT (user_id, day, category)
+            DO UPDATE SET total = total + excluded.total, count = count + 1;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_expenses_rollup_delete
+        AFTER DELETE ON expenses
+        BEGIN
+            UPDATE daily_rollups
+            SET total = total - OLD.amount, count = count - 1
+            WHERE user_id = OLD.user_id AND day = date(OLD.date) AND category = OLD.category;
+            DELETE FROM daily_rollups
+            WHERE user_id = OLD.user_id AND day = date(OLD.date) AND category = OLD.category
+              AND count <= 0;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_expenses_rollup_update
+        AFTER UPDATE OF user_id, amount, category, date ON expenses
+        BEGIN
+            UPDATE daily_rollups
+            SET total = total - OLD.amount, count = count - 1
+            WHERE user_id = OLD.user_id AND day = date(OLD.date) AND category = OLD.category;
+            DELETE FROM daily_rollups
+            WHERE user_id = OLD.user_id AND day = date(OLD.date) AND category = OLD.category
+              AND count <= 0;
+            INSERT INTO daily_rollups (user_id, day, category, total, count)
+            VALUES (NEW.user_id, date(NEW.date), NEW.category, NEW.amount, 1)
+            ON CONFLICT (user_id, day, category)
+            DO UPDATE SET total = total + excluded.total, count = count + 1;
+        END
+    ''')
+
+    # Written out rather than rebuild_daily_rollups(): ts doesn't exist yet
+    cursor.execute('DELETE FROM daily_rollups')
+    cursor.execute('''
+        INSERT INTO daily_rollups (user_id, day, category, total, count)
+        SELECT user_id, date(date), category, SUM(amount), COUNT(*)
+        FROM expenses
+        GROUP BY user_id, date(date), category
+    ''')
+
+
+def _add_user_recent_index(cursor):
+    """(user_id, date) index whose implicit rowid suffix orders by (date, id)"""
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_expenses_user_recent
+        ON expenses (user_id, date)
+    ''')
+
+
+def _add_epoch_timestamps(cursor):
+    """Integer epoch column so range filters compare integers, not text
+
+    Existing rows are backfilled afterwards in small batches by
+    backfill_epoch_timestamps, so no single transaction rewrites the table.
+    """
+    cursor.execute('ALTER TABLE expenses ADD COLUMN ts INTEGER')
+
+    # Rows inserted without ts (raw SQL, older clients) get it from date
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_expenses_ts_insert
+        AFTER INSERT ON expenses
+        WHEN NEW.ts IS NULL
+        BEGIN
+            UPDATE expenses SET ts = CAST(strftime('%s', NEW.date) AS INTEGER) WHERE id = NEW.id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_expenses_ts_update
+        AFTER UPDATE OF date ON expenses
+        BEGIN
+            UPDATE expenses SET ts = CAST(strftime('%s', NEW.date) AS INTEGER) WHERE id = NEW.id;
+        END
+    ''')
+
+    # Tiny partial index: finds rows still waiting for the backfill
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_expenses_ts_pending
+        ON expenses (id) WHERE ts IS NULL
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_expenses_user_ts
+        ON expenses (user_id, ts)
+    ''')
+    cursor.execute('DROP INDEX IF EXISTS idx_expenses_user_recent')
+
+
+def backfill_epoch_timestamps(conn, batch_size=5000):
+    """Fill expenses.ts for old rows, one short transaction per batch"""
+    updated = 0
+    while True:
+        with conn:
+            cursor = conn.execute('''
+                UPDATE expenses
+                SET ts = CAST(strftime('%s', date) AS INTEGER)
+                WHERE id IN (SELECT id FROM expenses WHERE ts IS NULL LIMIT ?)
+            ''', (batch_size,))
+        if cursor.rowcount <= 0:
+            return updated
+        updated += cursor.rowcount
+
+
+def _add_transaction_id_index(cursor):
+    """Index for looking up a user's expenses by transaction_id (import dedupe)"""
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_expenses_user_transaction
+        ON expenses (user_id, transaction_id) WHERE transaction_id IS NOT NULL
+    ''')
+
+
+def _make_transaction_id_unique(cursor):
+    """One expense per (user_id, transaction_id); earlier copies keep the ID
+
+    Later rows sharing a transaction_id lose it rather than being deleted
+    (older captions could yield pseudo-IDs such as a payee's UPI handle, so
+    the rows may be distinct payments), then the lookup index becomes a
+    unique one.
+    """
+    cursor.execute('''
+        UPDATE expenses SET transaction_id = NULL
+        WHERE transaction_id IS NOT NULL
+          AND id NOT IN (
+              SELECT MIN(id) FROM expenses
+              WHERE transaction_id IS NOT NULL
+              GROUP BY user_id, transaction_id
+          )
+    ''')
+    cursor.execute('DROP INDEX IF EXISTS idx_expenses_user_transaction')
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_expenses_user_transaction_unique
+        ON expenses (user_id, transaction_id) WHERE transaction_id IS NOT NULL
+    ''')
+
+
+def _add_description_search(cursor):
+    """FTS5 index over expense descriptions, kept in sync by triggers
+
+    External-content table: the text lives only in expenses, the FTS table
+    stores just the inverted index keyed by expense id. user_id is indexed
+    as a token too, so a search intersects with one user's rows inside the
+    index instead of ranking every user's matches and filtering afterwards.
+    """
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS expenses_fts USING fts5(
+            description,
+            user_id,
+            content='expenses',
+            content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='2 3'
+        )
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_expenses_fts_insert
+        AFTER INSERT ON expenses
+        BEGIN
+            INSERT INTO expenses_fts (rowid, description, user_id) VALUES (NEW.id, NEW.description, NEW.user_id);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_expenses_fts_delete
+        AFTER DELETE ON expenses
+        BEGIN
+            INSERT INTO expenses_fts (expenses_fts, rowid, description, user_id)
+            VALUES ('delete', OLD.id, OLD.description, OLD.user_id);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_expenses_fts_update
+        AFTER UPDATE OF description, user_id ON expenses
+        BEGIN
+            INSERT INTO expenses_fts (expenses_fts, rowid, description, user_id)
+            VALUES ('delete', OLD.id, OLD.description, OLD.user_id);
+            INSERT INTO expenses_fts (rowid, description, user_id) VALUES (NEW.id, NEW.description, NEW.user_id);
+        END
+    ''')
+    cursor.execute("INSERT INTO expenses_fts (expenses_fts) VALUES ('rebuild')")
+
+
+def _add_category_budgets(cursor):
+    """Per-user, per-category monthly budgets, one row per (user_id, category)"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS category_budgets (
+            user_id INTEGER NOT NULL,
+            category TEXT NOT NULL,
+            monthly_limit REAL NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, category)
+        ) WITHOUT ROWID
+    ''')
+
+
+def _add_recurring_expenses(cursor):
+    """Recurring expenses and the next time each one is due
+
+    start_ts anchors the schedule (a monthly one started on the 31st stays
+    on the last day of shorter months). The scheduler loads every row's
+    next_due at startup, so only the per-user listing needs an index.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS recurring_expenses (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            amount REAL NOT NULL,
+            category TEXT NOT NULL,
+            description TEXT,
+            frequency TEXT NOT NULL,
+            start_ts INTEGER NOT NULL,
+            next_due INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_recurring_user ON recurring_expenses (user_id)
+    ''')
+
+
+def _add_data_epoch(cursor):
+    """One-row counter bumped by bulk writes: imports, archiving, rollup rebuilds
+
+    Results cached in memory (the result cache, budget alert and forecast
+    engines) are only invalidated by writes in their own process; comparing
+    this counter lets them notice bulk changes made by another one, such as
+    manage.py.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS data_epoch (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            epoch INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('INSERT OR IGNORE INTO data_epoch (id, epoch) VALUES (0, 0)')
+
+
+def _drop_user_date_index(cursor):
+    """Drop v2's (user_id, date, category, amount) index
+
+    Summaries moved to daily_rollups (v3) and windows and paging to the ts
+    column (v5), so nothing filters on date any more, yet every insert was
+    still maintaining this wide index.
+    """
+    cursor.execute('DROP INDEX IF EXISTS idx_expenses_user_date')
+
+
+def _add_user_data_epoch(cursor):
+    """Per-user bulk-write counters next to v11's shard-wide one
+
+    An import or archive run only bumps the users it touched, so their
+    cached state is dropped without re-warming everyone else on the shard.
+    The shard-wide counter stays for writes that touch every user, such as
+    rollup rebuilds.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_data_epoch (
+            user_id INTEGER PRIMARY KEY,
+            epoch INTEGER NOT NULL
+        )
+    ''')
+
+
+def _rollups_from_ts(cursor):
+    """Key the rollup triggers on ts, so new rows can leave the text date empty
+
+    Once every row has ts the TEXT date column only repeated it as a
+    19-character string. The bot now stores NULL there; rows from raw SQL
+    or older clients still carry a date, which fills ts (v5) and stands in
+    for it until then. The column itself stays, since SQLite can't drop a
+    column that triggers still name.
+    """
+    old_day, new_day = EXPENSE_DAY.format(row='OLD.'), EXPENSE_DAY.format(row='NEW.')
+    for trigger in ('trg_expenses_rollup_insert', 'trg_expenses_rollup_delete', 'trg_expenses_rollup_update'):
+        cursor.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+    cursor.execute(f'''
+        CREATE TRIGGER trg_expenses_rollup_insert
+        AFTER INSERT ON expenses
+        BEGIN
+            INSERT INTO daily_rollups (user_id, day, category, total, count)
+            VALUES (NEW.user_id, {new_day}, NEW.category, NEW.amount, 1)
+            ON CONFLICT (user_id, day, category)
+            DO UPDATE SET total = total + excluded.total, count = count + 1;
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER trg_expenses_rollup_delete
+        AFTER DELETE ON expenses
+        BEGIN
+            UPDATE daily_rollups
+            SET total = total - OLD.amount, count = count - 1
+            WHERE user_id = OLD.user_id AND day = {old_day} AND category = OLD.category;
+            DELETE FROM daily_rollups
+            WHERE user_id = OLD.user_id AND day = {old_day} AND category = OLD.category
+              AND count <= 0;
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER trg_expenses_rollup_update
+        AFTER UPDATE OF user_id, amount, category, date, ts ON expenses
+        BEGIN
+            UPDATE daily_rollups
+            SET total = total - OLD.amount, count = count - 1
+            WHERE user_id = OLD.user_id AND day = {old_day} AND category = OLD.category;
+            DELETE FROM daily_rollups
+            WHERE user_id = OLD.user_id AND day = {old_day} AND category = OLD.category
+              AND count <= 0;
+            INSERT INTO daily_rollups (user_id, day, category, total, count)
+            VALUES (NEW.user_id, {new_day}, NEW.category, NEW.amount, 1)
+            ON CONFLICT (user_id, day, category)
+            DO UPDATE SET total = total + excluded.total, count = count + 1;
+        END
+    ''')
+
+
+# (version, description, migration) - append only, never reorder
+MIGRATIONS = [
+    (1, "Create base tables", _create_base_tables),
+    (2, "Add (user_id, date, category, amount) covering index", _add_user_date_indexes),
+    (3, "Add trigger-maintained daily_rollups table", _add_daily_rollups),
+    (4, "Add (user_id, date) index for keyset paging", _add_user_recent_index),
+    (5, "Add integer epoch ts column", _add_epoch_timestamps),
+    (6, "Add (user_id, transaction_id) lookup index", _add_transaction_id_index),
+    (7, "Make (user_id, transaction_id) unique", _make_transaction_id_unique),
+    (8, "Add FTS5 search over descriptions", _add_description_search),
+    (9, "Add per-category monthly budgets", _add_category_budgets),
+    (10, "Add recurring expenses", _add_recurring_expenses),
+    (11, "Add bulk-write data epoch", _add_data_epoch),
+    (12, "Drop unused (user_id, date) covering index", _drop_user_date_index),
+    (13, "Add per-user data epochs", _add_user_data_epoch),
+    (14, "Key rollups on ts and stop requiring the text date", _rollups_from_ts),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(conn):
+    """Return the highest applied migration version (0 for a new database)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    result = conn.execute('SELECT MAX(version) FROM schema_migrations').fetchone()
+    return result[0] or 0
+
+
+def apply_migrations(conn):
+    """Apply every pending migration in order, return the resulting version"""
+    version = get_schema_version(conn)
+
+    for target, description, migrate in MIGRATIONS:
+        if target <= version:
+            continue
+
+        # Take the write lock first so concurrent starters apply each step once
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            version = get_schema_version(conn)
+            if target > version:
+                cursor = conn.cursor()
+                migrate(cursor)
+                cursor.execute(
+                    'INSERT INTO schema_migrations (version, description) VALUES (?, ?)',
+                    (target, description)
+                )
+                version = target
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    return version
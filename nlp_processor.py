@@ -64,7 +64,15 @@ class ExpenseParser:
                     return category.capitalize()
         
         return "Other"
-    
+
+    def categorize_batch(self, descriptions):
+        """Categorize many descriptions at once, matching each distinct text only once"""
+        categories = {}
+        for description in descriptions:
+            if description not in categories:
+                categories[description] = self._extract_category((description or "").lower())
+        return [categories[description] for description in descriptions]
+
     def is_valid_expense(self, amount, category):
         """Validate if parsed data is valid"""
         if not amount or amount <= 0:
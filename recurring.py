@@ -0,0 +1,174 @@
+"""
+Recurring expense scheduler
+Keeps a min-heap per shard of every recurring expense's next due time
+across that shard's users. Each tick pops whatever is due, works out every
+missed occurrence (so a bot that was down for a week catches up), and hands
+them to the store in one batch; nothing is polled per user.
+"""
+import calendar
+import heapq
+import threading
+from datetime import datetime
+
+from database import from_epoch, to_epoch
+
+# frequency -> (days, months) between occurrences
+FREQUENCIES = {
+    "daily": (1, 0),
+    "weekly": (7, 0),
+    "monthly": (0, 1),
+    "yearly": (0, 12),
+}
+
+
+def _add_months(start, months):
+    """start moved by whole months, clamped to the last day of shorter months"""
+    month_index = start.month - 1 + months
+    year, month = start.year + month_index // 12, month_index % 12 + 1
+    day = min(start.day, calendar.monthrange(year, month)[1])
+    return start.replace(year=year, month=month, day=day)
+
+
+def occurrence(start_ts, frequency, n):
+    """Epoch time of the n-th occurrence (0 is start_ts itself)"""
+    days, months = FREQUENCIES[frequency]
+    if months:
+        return to_epoch(_add_months(from_epoch(start_ts), n * months))
+    return start_ts + n * days * 86400
+
+
+def next_occurrence(start_ts, frequency, after_ts):
+    """First occurrence strictly later than after_ts"""
+    if after_ts < start_ts:
+        return start_ts
+    days, months = FREQUENCIES[frequency]
+    if months:
+        start, after = from_epoch(start_ts), from_epoch(after_ts)
+        n = ((after.year - start.year) * 12 + after.month - start.month) // months
+    else:
+        n = (after_ts - start_ts) // (days * 86400)
+    # The estimate is at most one period short
+    while occurrence(start_ts, frequency, n) <= after_ts:
+        n += 1
+    return occurrence(start_ts, frequency, n)
+
+
+class RecurringScheduler:
+    """Min-heap of (next_due, user_id, recurring_id) over every recurring expense, one per shard
+
+    Each shard's heap is read from the store on its first tick and has its
+    own lock, so every shard's writer thread ticks only its own rows. Call
+    schedule() after adding a recurring expense and cancel() after deleting
+    one; cancelled entries are dropped lazily when they reach the top.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._heaps = [[] for _ in range(db.shards)]
+        # Per shard: (user_id, recurring_id) -> [frequency, start_ts, next_due]
+        self._entries = [{} for _ in range(db.shards)]
+        self._loaded = [False] * db.shards
+        self._locks = [threading.Lock() for _ in range(db.shards)]
+
+    def _load(self, shard):
+        entries = self._entries[shard] = {
+            (user_id, recurring_id): [frequency, start_ts, next_due]
+            for user_id, recurring_id, frequency, start_ts, next_due in self.db.get_recurring_schedule(shard)
+        }
+        heap = self._heaps[shard] = [(next_due, user_id, recurring_id)
+                                     for (user_id, recurring_id), (_, _, next_due) in entries.items()]
+        heapq.heapify(heap)
+        self._loaded[shard] = True
+
+    def schedule(self, user_id, recurring_id, frequency, start_ts):
+        """Start tracking a recurring expense that was just stored"""
+        shard = self.db.shard_for(user_id)
+        with self._locks[shard]:
+            if not self._loaded[shard]:
+                return  # the first tick reads it from the store
+            self._entries[shard][(user_id, recurring_id)] = [frequency, start_ts, start_ts]
+            heapq.heappush(self._heaps[shard], (start_ts, user_id, recurring_id))
+
+    def cancel(self, user_id, recurring_id):
+        """Stop tracking a recurring expense that was deleted"""
+        shard = self.db.shard_for(user_id)
+        with self._locks[shard]:
+            self._entries[shard].pop((user_id, recurring_id), None)
+
+    def _drop_stale(self, shard):
+        """Pop cancelled or superseded entries off the top of the shard's heap"""
+        heap, entries = self._heaps[shard], self._entries[shard]
+        while heap:
+            due, user_id, recurring_id = heap[0]
+            entry = entries.get((user_id, recurring_id))
+            if entry is not None and entry[2] == due:
+                return
+            heapq.heappop(heap)
+
+    def tick(self, now=None, shard=None):
+        """Store every occurrence due by now (a UTC datetime) on one shard, or on all of
+        them in turn, return {user_id: [(amount, category, ts)]} inserted
+        """
+        if shard is None:
+            inserted = {}
+            for shard in range(self.db.shards):
+                inserted.update(self.tick(now, shard))
+            return inserted
+
+        now_ts = to_epoch(now or datetime.utcnow())
+        with self._locks[shard]:
+            if not self._loaded[shard]:
+                self._load(shard)
+            heap = self._heaps[shard]
+            due = []
+            self._drop_stale(shard)
+            while heap and heap[0][0] <= now_ts:
+                _, user_id, recurring_id = heapq.heappop(heap)
+                due.append((user_id, recurring_id))
+                self._drop_stale(shard)
+            return self._materialize(shard, due, now_ts)
+
+    def catch_up(self, user_id, recurring_id, now=None):
+        """Store the occurrences of one recurring expense due by now, return them as tick() does
+
+        Leaves every other recurring expense to the next tick.
+        """
+        now_ts = to_epoch(now or datetime.utcnow())
+        shard = self.db.shard_for(user_id)
+        with self._locks[shard]:
+            if not self._loaded[shard]:
+                self._load(shard)
+            entry = self._entries[shard].get((user_id, recurring_id))
+            if entry is None or entry[2] > now_ts:
+                return {}
+            # The heap entry for the old due time goes stale and is dropped when it surfaces
+            return self._materialize(shard, [(user_id, recurring_id)], now_ts, popped=False)
+
+    def _materialize(self, shard, due, now_ts, popped=True):
+        """Store every occurrence by now_ts of the due (user_id, recurring_id) entries (lock held)
+
+        popped says whether their heap entries were taken off the heap,
+        and so must be put back if the store fails.
+        """
+        entries, occurrences, following_due = self._entries[shard], [], []
+        for user_id, recurring_id in due:
+            frequency, start_ts, due_ts = entries[(user_id, recurring_id)]
+            while due_ts <= now_ts:
+                following = next_occurrence(start_ts, frequency, due_ts)
+                occurrences.append((user_id, recurring_id, due_ts, following))
+                due_ts = following
+            following_due.append((user_id, recurring_id, due_ts))
+        if not occurrences:
+            return {}
+
+        try:
+            inserted = self.db.materialize_recurring(occurrences)
+        except Exception:
+            # Put the old due times back so the next tick retries them
+            for user_id, recurring_id in due if popped else ():
+                heapq.heappush(self._heaps[shard], (entries[(user_id, recurring_id)][2], user_id, recurring_id))
+            raise
+        for user_id, recurring_id, next_due in following_due:
+            entries[(user_id, recurring_id)][2] = next_due
+            heapq.heappush(self._heaps[shard], (next_due, user_id, recurring_id))
+        return inserted
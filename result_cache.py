@@ -0,0 +1,126 @@
+"""
+Per-user caches
+/summary, /stats, /limits and friends ask for the same totals over and
+over while a user's data hasn't changed. Results are cached per user,
+query and arguments, and every write for the user makes them stale.
+VersionedUserLRU is the per-user state cache the budget alert and forecast
+engines build on.
+"""
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+from config import RESULT_CACHE_SIZE
+
+
+class ResultCache:
+    """Bounded LRU of query results keyed by (user, version, epoch, UTC day, query, args)
+
+    invalidate(user_id) bumps the user's version, so results cached under
+    the old version never hit again and simply age out of the LRU. The
+    epoch is the store's persistent bulk-write counter, which catches
+    changes made by other processes. The UTC
+    day is part of the key because windows are calendar days: yesterday's
+    "last 7 days" is not today's. Cached values are shared between
+    callers, who must not mutate them.
+    """
+
+    def __init__(self, max_entries=RESULT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, user_id, key, compute, epoch=0):
+        """Cached result for (user_id, key) at epoch, or compute() and remember it"""
+        with self._lock:
+            full_key = (user_id, self._versions.get(user_id, 0), epoch, datetime.utcnow().date(), key)
+            if full_key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(full_key)
+                return self._entries[full_key]
+            self.misses += 1
+
+        # A write that commits meanwhile bumps the version, so a stale result
+        # stored under the old one is never served
+        value = compute()
+        with self._lock:
+            self._entries[full_key] = value
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self, user_id):
+        """Make every cached result for user_id stale; call after the write commits"""
+        with self._lock:
+            self._versions[user_id] = self._versions.get(user_id, 0) + 1
+
+    def clear(self):
+        """Drop every cached result (after bulk rebuilds)"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """{'hits', 'misses', 'entries', 'hit_rate'} since startup"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+class VersionedUserLRU:
+    """Bounded LRU of per-user state that is read from the store without the lock
+
+    Subclasses build state in a read outside self._lock and cache it with
+    _install. forget() (and any other change a read may have missed) bumps
+    the version, so state read meanwhile isn't cached. State carries the
+    store's data epoch it was read at (its `epoch` attribute) and is
+    dropped once the epoch moves.
+    """
+
+    def __init__(self, max_users):
+        self.max_users = max_users
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped by forget() and friends, so state read meanwhile isn't cached
+        self._version = 0
+
+    def _roll(self, state, today):
+        """Bring cached state forward to today (lock held)"""
+
+    def _cached(self, user_id, today, epoch):
+        """(cached state or None, current version) for user_id; state from an older epoch is dropped"""
+        with self._lock:
+            state = self._users.get(user_id)
+            if state is not None and state.epoch != epoch:
+                self._users.pop(user_id)
+                state = None
+            if state is not None:
+                self._users.move_to_end(user_id)
+                self._roll(state, today)
+            return state, self._version
+
+    def _install(self, user_id, state, version):
+        """Cache state read at version (lock held) unless it may be stale already"""
+        if version != self._version or user_id in self._users:
+            # A forget or a concurrent read raced this one: let the next use read again
+            self._users.pop(user_id, None)
+            return
+        self._users[user_id] = state
+        while len(self._users) > self.max_users:
+            self._users.popitem(last=False)
+
+    def forget(self, user_id):
+        """Drop a user's cached state; the next use reads it from the store again"""
+        with self._lock:
+            self._version += 1
+            self._users.pop(user_id, None)
+
+    def __len__(self):
+        return len(self._users)
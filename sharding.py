@@ -0,0 +1,122 @@
+"""
+User sharding for the expense database
+Each user lives in exactly one SQLite file, picked by a stable hash of their
+Telegram user ID, so writes for different users take different locks.
+"""
+import os
+import sqlite3
+import zlib
+
+from migrations import apply_migrations, backfill_epoch_timestamps
+
+# Per-user tables moved by reshard, with the columns copied (surrogate keys are renumbered)
+USER_TABLES = [
+    ("users", "user_id, username, first_name, created_at"),
+    ("budget_limits", "user_id, daily_limit, weekly_limit, monthly_limit, created_at, updated_at"),
+    ("category_budgets", "user_id, category, monthly_limit, updated_at"),
+    ("categories", "user_id, name, color, created_at"),
+    ("recurring_expenses", "user_id, amount, category, description, frequency, start_ts, next_due, created_at"),
+    ("expenses", "user_id, amount, category, description, date, ts, source, transaction_id, "
+                 "account_name, payment_method"),
+]
+
+
+def shard_for(user_id, shards):
+    """Shard index for a user; stable across processes and Python versions"""
+    if shards <= 1:
+        return 0
+    return zlib.crc32(str(user_id).encode()) % shards
+
+
+def shard_paths(db_path, shards):
+    """Database files for a shard count: the plain path when unsharded,
+    otherwise expenses.0-of-4.db, expenses.1-of-4.db, ...
+    """
+    if shards <= 1:
+        return [db_path]
+    root, ext = os.path.splitext(db_path)
+    return [f"{root}.{index}-of-{shards}{ext}" for index in range(shards)]
+
+
+def _renumber_recurring(transaction_id, renumbered):
+    """Point a 'recurring:<id>:<due_ts>' transaction ID at the recurring
+    expense's new ID; other transaction IDs pass through unchanged
+    """
+    if transaction_id and transaction_id.startswith('recurring:'):
+        _, recurring_id, due_ts = transaction_id.split(':', 2)
+        if int(recurring_id) in renumbered:
+            return f"recurring:{renumbered[int(recurring_id)]}:{due_ts}"
+    return transaction_id
+
+
+def reshard(source_paths, target_paths):
+    """Copy every user's rows from the source files into the target shards
+
+    Targets must not exist yet. Sources are only brought up to the latest
+    schema, so the switch can be made (or rolled back) by changing
+    DATABASE_SHARDS. Expense IDs are renumbered, but each user's rows keep
+    their (ts, id) order. Recurring expenses are renumbered too, and the
+    transaction IDs of their stored occurrences follow, so the ones already
+    recorded are still recognised and not added again.
+    Returns a list with the number of users moved into each target.
+    """
+    for path in target_paths:
+        if os.path.exists(path):
+            raise FileExistsError(f"Shard file {path} already exists")
+
+    for source in source_paths:
+        conn = sqlite3.connect(source)
+        try:
+            apply_migrations(conn)
+            backfill_epoch_timestamps(conn)
+        finally:
+            conn.close()
+
+    count = len(target_paths)
+    moved = [0] * count
+    for index, path in enumerate(target_paths):
+        conn = sqlite3.connect(path)
+        try:
+            apply_migrations(conn)
+            conn.create_function(
+                'shard_of', 1, lambda user_id: shard_for(user_id, count), deterministic=True
+            )
+            renumbered = {}
+            conn.create_function(
+                'renumber_recurring', 1, lambda transaction_id: _renumber_recurring(transaction_id, renumbered)
+            )
+            for source in source_paths:
+                renumbered.clear()
+                conn.execute('ATTACH DATABASE ? AS src', (source,))
+                try:
+                    with conn:
+                        for table, columns in USER_TABLES:
+                            if table == 'recurring_expenses':
+                                rows = conn.execute(f'''
+                                    SELECT id, {columns} FROM src.recurring_expenses
+                                    WHERE shard_of(user_id) = ? ORDER BY id
+                                ''', (index,)).fetchall()
+                                placeholders = ', '.join('?' * len(columns.split(',')))
+                                for old_id, *values in rows:
+                                    cursor = conn.execute(
+                                        f'INSERT INTO main.recurring_expenses ({columns}) VALUES ({placeholders})',
+                                        values,
+                                    )
+                                    renumbered[old_id] = cursor.lastrowid
+                                continue
+                            selected = columns
+                            order = ''
+                            if table == 'expenses':
+                                selected = columns.replace('transaction_id', 'renumber_recurring(transaction_id)')
+                                order = ' ORDER BY ts, id'
+                            conn.execute(f'''
+                                INSERT OR IGNORE INTO main.{table} ({columns})
+                                SELECT {selected} FROM src.{table}
+                                WHERE shard_of(user_id) = ?{order}
+                            ''', (index,))
+                finally:
+                    conn.execute('DETACH DATABASE src')
+            moved[index] = conn.execute('SELECT COUNT(*) FROM users').fetchone()[0]
+        finally:
+            conn.close()
+    return moved
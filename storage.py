@@ -0,0 +1,384 @@
+"""
+Storage engines for the Expense Tracker
+ExpenseStore is the interface the bot, exporters and importer program
+against. ExpenseDatabase (SQLite, database.py) is the production engine;
+InMemoryExpenseDatabase keeps everything in per-user Python structures for
+tests, load simulations and benchmarks that should run at memory speed.
+"""
+import re
+import threading
+import unicodedata
+from bisect import bisect_left, bisect_right, insort
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+from operator import itemgetter
+from typing import Protocol, runtime_checkable
+
+from config import DATABASE_ENGINE
+from database import ExpenseDatabase, from_epoch, to_epoch, window_start
+
+
+@runtime_checkable
+class ExpenseStore(Protocol):
+    """What a storage engine provides; rows and semantics follow ExpenseDatabase"""
+
+    shards: int
+
+    def shard_for(self, user_id): ...
+    def open_connections(self): ...
+    def close(self): ...
+    def flush(self): ...
+    def read_snapshot(self, user_id): ...
+    def get_shard_stats(self): ...
+    def get_cache_stats(self): ...
+    def get_data_epoch(self, user_id): ...
+
+    def is_known_user(self, user_id, username, first_name): ...
+    def add_user(self, user_id, username, first_name): ...
+
+    def add_expense(self, user_id, amount, category, description, source="text", transaction_id=None,
+                    account_name=None, payment_method=None): ...
+    def import_expenses(self, user_id, expenses): ...
+    def delete_expense(self, expense_id, user_id): ...
+
+    def get_expenses(self, user_id, days=None, limit=None, before_ts=None, before_id=None,
+                     after_ts=None, after_id=None): ...
+    def iter_expenses(self, user_id, start=None, end=None, batch_size=500, include_archive=False): ...
+    def search_expenses(self, user_id, text, start=None, end=None, limit=10, offset=0): ...
+
+    def get_summary(self, user_id, days=30): ...
+    def get_multi_window_summary(self, user_id, windows=(1, 7, 30)): ...
+    def get_total_today(self, user_id): ...
+    def get_total_week(self, user_id): ...
+    def get_total_month(self, user_id): ...
+    def set_budget_limit(self, user_id, limit_type, amount): ...
+    def get_budget_limits(self, user_id): ...
+    def get_daily_totals(self, user_id, days=30): ...
+    def set_category_budget(self, user_id, category, amount): ...
+    def get_category_budgets(self, user_id): ...
+    def get_budget_snapshot(self, user_id): ...
+
+    def add_recurring_expense(self, user_id, amount, category, description, frequency, start_ts): ...
+    def get_recurring_expenses(self, user_id): ...
+    def delete_recurring_expense(self, recurring_id, user_id): ...
+    def get_recurring_schedule(self, shard=None): ...
+    def materialize_recurring(self, occurrences): ...
+
+
+def _words(text):
+    """Lowercase words of text with accents stripped, as the FTS tokenizer sees them"""
+    decomposed = unicodedata.normalize('NFKD', text or '')
+    stripped = ''.join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return re.findall(r'\w+', stripped.lower())
+
+
+class InMemoryExpenseDatabase:
+    """ExpenseStore held entirely in memory
+
+    Each user's expenses are kept in a list sorted by (ts, id), so windows
+    and keyset pages are bisects, plus per-day category totals standing in
+    for daily_rollups. Nothing survives close(). One lock serializes all
+    access; read_snapshot holds it for the whole block.
+    """
+
+    LIMIT_TYPES = ('daily', 'weekly', 'monthly')
+
+    shards = 1
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._next_id = 1
+        self._users = {}
+        # user_id -> [(ts, id, amount, category, description, transaction_id)] sorted by (ts, id)
+        self._expenses = defaultdict(list)
+        self._owners = {}
+        self._transaction_ids = defaultdict(set)
+        # user_id -> {day: {category: [total, count]}}
+        self._rollups = defaultdict(lambda: defaultdict(dict))
+        self._budget_limits = {}
+        self._category_budgets = defaultdict(dict)
+        # (user_id, recurring_id) -> [amount, category, description, frequency, start_ts, next_due]
+        self._recurring = {}
+        self._next_recurring_id = 1
+
+    def shard_for(self, user_id):
+        return 0
+
+    def open_connections(self):
+        """Nothing to open; present so thread pools can use any engine"""
+
+    def close(self):
+        """Nothing to release; data lives as long as the instance"""
+
+    def flush(self):
+        """Writes apply immediately, so there is never anything queued"""
+
+    @contextmanager
+    def read_snapshot(self, user_id):
+        """Hold the engine lock so the reads in the block see one state"""
+        with self._lock:
+            yield
+
+    def get_shard_stats(self):
+        with self._lock:
+            return [(":memory:", len(self._users), len(self._owners))]
+
+    def get_cache_stats(self):
+        """None: reads are already in memory, so no result cache"""
+        return None
+
+    def get_data_epoch(self, user_id):
+        """Always 0: no other process can write to this store"""
+        return 0
+
+    def is_known_user(self, user_id, username, first_name):
+        with self._lock:
+            return self._users.get(user_id) == (username, first_name)
+
+    def add_user(self, user_id, username, first_name):
+        with self._lock:
+            self._users[user_id] = (username, first_name)
+
+    def add_expense(self, user_id, amount, category, description, source="text", transaction_id=None,
+                    account_name=None, payment_method=None):
+        """Add a new expense, return False if its transaction_id is already stored"""
+        now = datetime.utcnow().replace(microsecond=0)
+        with self._lock:
+            return self._insert(user_id, amount, category, description, to_epoch(now), transaction_id or None)
+
+    def import_expenses(self, user_id, expenses):
+        """Insert a batch of (amount, category, description, ts, source,
+        transaction_id, account_name, payment_method) tuples, return (inserted, duplicates)"""
+        inserted = 0
+        with self._lock:
+            for amount, category, description, ts, _, transaction_id, _, _ in expenses:
+                inserted += self._insert(user_id, amount, category, description, ts, transaction_id or None)
+        return inserted, len(expenses) - inserted
+
+    def _insert(self, user_id, amount, category, description, ts, transaction_id):
+        if transaction_id is not None:
+            if transaction_id in self._transaction_ids[user_id]:
+                return False
+            self._transaction_ids[user_id].add(transaction_id)
+
+        expense_id = self._next_id
+        self._next_id += 1
+        row = (ts, expense_id, amount, category, description, transaction_id)
+        insort(self._expenses[user_id], row)
+        self._owners[expense_id] = (user_id, ts)
+
+        totals = self._rollups[user_id][from_epoch(ts).date()].setdefault(category, [0, 0])
+        totals[0] += amount
+        totals[1] += 1
+        return True
+
+    def delete_expense(self, expense_id, user_id):
+        """Delete an expense"""
+        with self._lock:
+            owner = self._owners.get(expense_id)
+            if owner is None or owner[0] != user_id:
+                return
+            rows = self._expenses[user_id]
+            index = bisect_left(rows, owner[1:] + (expense_id,), key=itemgetter(0, 1))
+            ts, _, amount, category, _, transaction_id = rows.pop(index)
+            del self._owners[expense_id]
+            self._transaction_ids[user_id].discard(transaction_id)
+
+            day = self._rollups[user_id][from_epoch(ts).date()]
+            day[category][0] -= amount
+            day[category][1] -= 1
+            if not day[category][1]:
+                del day[category]
+
+    def get_expenses(self, user_id, days=None, limit=None, before_ts=None, before_id=None,
+                     after_ts=None, after_id=None):
+        """Get expenses for a user, newest first (see ExpenseDatabase.get_expenses)"""
+        if (before_ts is None) != (before_id is None) or (after_ts is None) != (after_id is None):
+            raise ValueError("Paging cursors need both a timestamp and an id")
+
+        key = itemgetter(0, 1)
+        with self._lock:
+            rows = self._expenses.get(user_id, [])
+            lo, hi = 0, len(rows)
+            if days:
+                lo = max(lo, bisect_left(rows, to_epoch(window_start(days)), key=itemgetter(0)))
+            if before_id is not None:
+                hi = min(hi, bisect_left(rows, (int(before_ts), before_id), key=key))
+            if after_id is not None:
+                lo = max(lo, bisect_right(rows, (int(after_ts), after_id), key=key))
+            if limit and after_id is not None:
+                hi = min(hi, lo + int(limit))
+            elif limit:
+                lo = max(lo, hi - int(limit))
+            return [self._public(row) for row in reversed(rows[lo:hi])]
+
+    def iter_expenses(self, user_id, start=None, end=None, batch_size=500, include_archive=False):
+        """Yield a user's expenses newest first within [start, end); there is no archive tier"""
+        key = itemgetter(0)
+        with self._lock:
+            rows = self._expenses.get(user_id, [])
+            lo = bisect_left(rows, to_epoch(start), key=key) if start is not None else 0
+            hi = bisect_left(rows, to_epoch(end), key=key) if end is not None else len(rows)
+            window = rows[lo:hi]
+        for row in reversed(window):
+            yield self._public(row)
+
+    def search_expenses(self, user_id, text, start=None, end=None, limit=10, offset=0):
+        """Search descriptions like the FTS engine (whole words, last one as a
+        prefix, accents ignored), newest first instead of bm25 order"""
+        words = _words(text)
+        if not words:
+            return []
+        *whole, prefix = words
+
+        matches = []
+        for row in self.iter_expenses(user_id, start, end):
+            tokens = set(_words(row[3]))
+            if all(word in tokens for word in whole) and any(token.startswith(prefix) for token in tokens):
+                matches.append(row)
+        return matches[int(offset):int(offset) + int(limit)]
+
+    @staticmethod
+    def _public(row):
+        """(id, amount, category, description, ts) as ExpenseDatabase returns it"""
+        ts, expense_id, amount, category, description, _ = row
+        return expense_id, amount, category, description, ts
+
+    def _day_totals(self, user_id, days):
+        """{category: [total, count]} over the last `days` calendar days"""
+        first_day = window_start(days).date()
+        totals = defaultdict(lambda: [0, 0])
+        for day, categories in self._rollups.get(user_id, {}).items():
+            if day >= first_day:
+                for category, (total, count) in categories.items():
+                    totals[category][0] += total
+                    totals[category][1] += count
+        return totals
+
+    def get_summary(self, user_id, days=30):
+        """Get expense summary by category for the last `days` calendar days"""
+        with self._lock:
+            totals = self._day_totals(user_id, days)
+        summary = [(category, total, count) for category, (total, count) in totals.items() if count]
+        return sorted(summary, key=itemgetter(1), reverse=True)
+
+    def get_multi_window_summary(self, user_id, windows=(1, 7, 30)):
+        """get_summary for several windows at once: {days: [(category, total, count)]}"""
+        with self._lock:
+            return {days: self.get_summary(user_id, days) for days in sorted(set(windows))}
+
+    def _total(self, user_id, days):
+        with self._lock:
+            return sum(total for total, _ in self._day_totals(user_id, days).values())
+
+    def get_total_today(self, user_id):
+        return self._total(user_id, 1)
+
+    def get_total_week(self, user_id):
+        return self._total(user_id, 7)
+
+    def get_total_month(self, user_id):
+        return self._total(user_id, 30)
+
+    def set_budget_limit(self, user_id, limit_type, amount):
+        """Set budget limit (daily/weekly/monthly)"""
+        index = self.LIMIT_TYPES.index(limit_type)
+        with self._lock:
+            limits = self._budget_limits.setdefault(user_id, [None, None, None])
+            limits[index] = amount
+
+    def get_budget_limits(self, user_id):
+        with self._lock:
+            return tuple(self._budget_limits.get(user_id, (None, None, None)))
+
+    def get_daily_totals(self, user_id, days=30):
+        """(day 'YYYY-MM-DD', category, total) for the last `days` calendar days, oldest first"""
+        first_day = window_start(days).date()
+        with self._lock:
+            rows = [
+                (day.isoformat(), category, total)
+                for day, categories in self._rollups.get(user_id, {}).items() if day >= first_day
+                for category, (total, count) in categories.items() if count
+            ]
+        return sorted(rows)
+
+    def set_category_budget(self, user_id, category, amount):
+        """Set a monthly budget for one category, or remove it when amount is None"""
+        with self._lock:
+            if amount is None:
+                self._category_budgets[user_id].pop(category, None)
+            else:
+                self._category_budgets[user_id][category] = amount
+
+    def get_category_budgets(self, user_id):
+        """(category, monthly_limit, spent in the last 30 days) for each category budget"""
+        with self._lock:
+            totals = self._day_totals(user_id, 30)
+            return [(category, limit, totals[category][0] if category in totals else 0)
+                    for category, limit in sorted(self._category_budgets.get(user_id, {}).items())]
+
+    def get_budget_snapshot(self, user_id):
+        """(daily_limit, weekly_limit, monthly_limit, today_total, week_total, month_total)"""
+        with self._lock:
+            return self.get_budget_limits(user_id) + (
+                self.get_total_today(user_id), self.get_total_week(user_id), self.get_total_month(user_id))
+
+    def add_recurring_expense(self, user_id, amount, category, description, frequency, start_ts):
+        """Store a recurring expense first due at start_ts, return its id"""
+        with self._lock:
+            recurring_id = self._next_recurring_id
+            self._next_recurring_id += 1
+            self._recurring[(user_id, recurring_id)] = [amount, category, description, frequency, start_ts, start_ts]
+            return recurring_id
+
+    def get_recurring_expenses(self, user_id):
+        """(id, amount, category, description, frequency, start_ts, next_due) for a user, soonest first"""
+        with self._lock:
+            rows = [(recurring_id, *entry) for (owner, recurring_id), entry in self._recurring.items()
+                    if owner == user_id]
+        return sorted(rows, key=itemgetter(6, 0))
+
+    def delete_recurring_expense(self, recurring_id, user_id):
+        """Stop a recurring expense, return False if the user has no such id"""
+        with self._lock:
+            return self._recurring.pop((user_id, recurring_id), None) is not None
+
+    def get_recurring_schedule(self, shard=None):
+        """(user_id, id, frequency, start_ts, next_due) for every recurring expense (there is one shard)"""
+        with self._lock:
+            return [(user_id, recurring_id, frequency, start_ts, next_due)
+                    for (user_id, recurring_id), (_, _, _, frequency, start_ts, next_due) in self._recurring.items()]
+
+    def materialize_recurring(self, occurrences):
+        """Insert due recurring expenses and move their schedules forward
+        (see ExpenseDatabase.materialize_recurring), return {user_id: [(amount, category, ts)]}"""
+        inserted = defaultdict(list)
+        with self._lock:
+            for user_id, recurring_id, due_ts, next_due in occurrences:
+                entry = self._recurring.get((user_id, recurring_id))
+                if entry is None:
+                    continue
+                amount, category, description = entry[:3]
+                if self._insert(user_id, amount, category, description, due_ts, f"recurring:{recurring_id}:{due_ts}"):
+                    inserted[user_id].append((amount, category, due_ts))
+                entry[5] = max(entry[5], next_due)
+        return dict(inserted)
+
+
+# Engines selectable through config.DATABASE_ENGINE
+ENGINES = {
+    "sqlite": ExpenseDatabase,
+    "memory": InMemoryExpenseDatabase,
+}
+
+
+def create_store(engine=None, **kwargs):
+    """Build a storage engine by name (default config.DATABASE_ENGINE)
+
+    kwargs go to the engine's constructor, e.g. db_path for SQLite.
+    """
+    engine = engine or DATABASE_ENGINE
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown database engine {engine!r}, use one of: {', '.join(ENGINES)}")
+    return ENGINES[engine](**kwargs)
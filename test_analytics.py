@@ -0,0 +1,104 @@
+"""
+Test suite for the columnar spending analytics
+"""
+import unittest
+from datetime import datetime, timedelta
+from analytics import ExpenseAnalytics, SpendingColumns, budget_warning
+from database import to_epoch
+from storage import InMemoryExpenseDatabase
+
+
+class TestSpendingColumns(unittest.TestCase):
+    """Test metrics computed over the NumPy columns"""
+
+    def setUp(self):
+        """Spending on today, 3 days ago and 20 days ago, plus an older row"""
+        self.columns = SpendingColumns([
+            ("2024-02-19", "Food", 30),
+            ("2024-03-07", "Transport", 50),
+            ("2024-03-10", "Food", 100),
+            ("2024-03-10", "Shopping", 20),
+        ], 30, today=datetime(2024, 3, 10))
+
+    def test_windows(self):
+        """Totals, category totals and days follow the calendar-day windows"""
+        self.assertEqual(self.columns.total(1), 120)
+        self.assertEqual(self.columns.total(7), 170)
+        self.assertEqual(self.columns.total(30), 200)
+        self.assertEqual(dict(zip(self.columns.categories, self.columns.category_totals(30))),
+                         {"Food": 130, "Shopping": 20, "Transport": 50})
+        self.assertEqual(list(self.columns.daily_totals(4)), [50, 0, 0, 120])
+        with self.assertRaises(ValueError):
+            self.columns.total(31)
+
+    def test_rolling_and_trending(self):
+        """Rolling sums slide one day at a time; the top category wins"""
+        self.assertEqual(list(self.columns.rolling_totals(2, 4)), [50, 0, 120])
+        self.assertEqual(self.columns.trending_category(30), "Food")
+        self.assertEqual(self.columns.trending_category(7), "Food")
+        self.assertIsNone(SpendingColumns([], 30).trending_category(30))
+
+    def test_future_days_count_as_today(self):
+        """A rollup dated after today (UTC) is folded into today instead of breaking the reductions"""
+        columns = SpendingColumns([("2024-03-10", "Food", 100), ("2024-03-11", "Food", 40)],
+                                  30, today=datetime(2024, 3, 10))
+        self.assertEqual(columns.total(1), 140)
+        self.assertEqual(list(columns.daily_totals(2)), [0, 140])
+        self.assertEqual(list(columns.rolling_totals(2, 3)), [0, 140])
+
+
+class TestExpenseAnalytics(unittest.TestCase):
+    """Test ExpenseAnalytics over a store"""
+
+    def setUp(self):
+        self.analytics = ExpenseAnalytics(InMemoryExpenseDatabase())
+        self.user_id = 123456
+        now = datetime.utcnow()
+        self.analytics.db.import_expenses(self.user_id, [
+            (amount, category, "test", to_epoch(now - timedelta(days=age)), "text", None, None, None)
+            for amount, category, age in ((700, "Food", 0), (1400, "Transport", 3), (3000, "Shopping", 20))
+        ])
+
+    def test_report_with_a_row_dated_tomorrow(self):
+        """Reports and rolling totals work with an import dated ahead of UTC"""
+        tomorrow = to_epoch(datetime.utcnow() + timedelta(days=1))
+        self.analytics.db.import_expenses(self.user_id, [(60, "Food", "IST", tomorrow, "import", None, None, None)])
+        self.assertEqual(self.analytics.get_rolling_totals(self.user_id, 7, 30)[-1], 2160)
+        self.assertIsNotNone(self.analytics.get_report(self.user_id))
+
+    def test_metrics_match_summaries(self):
+        """Each metric agrees with the per-window summaries it replaces"""
+        self.assertEqual(self.analytics.get_trending_category(self.user_id), "Shopping")
+        self.assertEqual(self.analytics.get_trending_category(self.user_id, 7), "Transport")
+        self.assertEqual(self.analytics.get_daily_average(self.user_id), 5100 / 30)
+        self.assertEqual(self.analytics.get_budget_warning(self.user_id, 6000),
+                         "💡 Caution: You've spent 85% of your monthly budget")
+        self.assertIsNone(self.analytics.get_budget_warning(self.user_id, 10000))
+        self.assertEqual(self.analytics.get_rolling_totals(self.user_id)[-1], 2100)
+
+    def test_prediction_uses_forecast_model(self):
+        """A steady spender is forecast to keep spending at the same rate"""
+        analytics = ExpenseAnalytics(InMemoryExpenseDatabase())
+        now = datetime.utcnow()
+        analytics.db.import_expenses(1, [
+            (100, "Food", "lunch", to_epoch(now - timedelta(days=age)), "text", None, None, None)
+            for age in range(1, 41)
+        ])
+        self.assertAlmostEqual(analytics.predict_monthly_spending(1), 3000)
+        self.assertAlmostEqual(analytics.get_report(1)["predicted_monthly"], 3000)
+
+    def test_report_uses_one_load(self):
+        """get_report reads the store once for every metric, once the forecast model is warm"""
+        self.analytics.predict_monthly_spending(self.user_id)
+        loads = []
+        original = self.analytics.db.get_daily_totals
+        self.analytics.db.get_daily_totals = lambda *args: loads.append(args) or original(*args)
+        report = self.analytics.get_report(self.user_id, budget=5000)
+        self.assertEqual(len(loads), 1)
+        self.assertEqual(report["trending_category"], "Shopping")
+        self.assertEqual(report["budget_warning"], budget_warning(5100, 5000))
+        self.assertEqual(len(report["rolling_7_days"]), 24)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,8 +4,13 @@ Test suite for budget management features
 import unittest
 import sqlite3
 import os
+import tempfile
+import threading
 from datetime import datetime, timedelta
-from database import ExpenseDatabase
+from analytics import BudgetManager
+from budget_alerts import BudgetAlertEngine, format_alert
+from database import ExpenseDatabase, to_epoch
+from storage import InMemoryExpenseDatabase
 from config import DATABASE_PATH, CURRENCY
 
 class TestBudgetFeatures(unittest.TestCase):
@@ -284,5 +289,153 @@ class TestBudgetCommands(unittest.TestCase):
             if isinstance(amount, (int, float)):
                 self.assertLessEqual(amount, 0, f"{amount} should be invalid")
 
+class TestBudgetAlertEngine(unittest.TestCase):
+    """Test incremental budget totals and threshold-crossing alerts"""
+
+    def setUp(self):
+        """In-memory store with a daily limit of 1000"""
+        self.db = InMemoryExpenseDatabase()
+        self.engine = BudgetAlertEngine(self.db)
+        self.user_id = 123456
+        self.db.set_budget_limit(self.user_id, 'daily', 1000)
+
+    def spend(self, amount, user_id=None, category='Food'):
+        """Store an expense, then feed it to the engine like the bot does"""
+        user_id = user_id or self.user_id
+        self.db.add_expense(user_id, amount, category, 'Test')
+        return self.engine.record_expense(user_id, amount, category)
+
+    def test_alerts_fire_once_per_threshold(self):
+        """Only the message that crosses 75/90/100% gets a warning"""
+        self.assertEqual(self.spend(500), [])
+        self.assertEqual(self.spend(300), [('daily', 75, 800, 1000)])
+        self.assertEqual(self.spend(50), [])
+        self.assertEqual(self.spend(100), [('daily', 90, 950, 1000)])
+        self.assertEqual(self.spend(100), [('daily', 100, 1050, 1000)])
+        self.assertEqual(self.spend(10), [])
+
+    def test_warms_from_store_on_first_use(self):
+        """Spending stored before the engine saw the user counts toward thresholds"""
+        self.db.add_expense(self.user_id, 700, 'Food', 'Earlier')
+        self.assertEqual(self.spend(100), [('daily', 75, 800, 1000)])
+
+        engine = BudgetAlertEngine(self.db)
+        self.db.add_expense(self.user_id, 10, 'Food', 'Snack')
+        self.assertEqual(engine.record_expense(self.user_id, 10), [])
+
+    def test_windows_follow_limits_command(self):
+        """Older expenses count toward the 30 day window but not today's"""
+        self.db.set_budget_limit(self.user_id, 'monthly', 1000)
+        ten_days_ago = datetime.utcnow() - timedelta(days=10)
+        self.db.import_expenses(self.user_id, [(700, 'Food', 'Old', to_epoch(ten_days_ago), 'text', None, None, None)])
+        self.assertEqual(self.spend(100), [('monthly', 75, 800, 1000)])
+
+    def test_delete_rearms_threshold(self):
+        """Dropping back under a threshold lets the next crossing warn again"""
+        self.spend(500)
+        self.assertTrue(self.spend(300))
+        self.engine.remove_expense(self.user_id, 300, to_epoch(datetime.utcnow()))
+        self.assertEqual(self.spend(300), [('daily', 75, 800, 1000)])
+
+    def test_day_rollover_resets_daily_total(self):
+        """A new day starts the daily window from zero"""
+        self.spend(800)
+        state = self.engine._users[self.user_id]
+        state.roll(state.today + timedelta(days=1))
+        self.assertEqual(state.totals[0], 0)
+        self.assertEqual(state.totals[2], 800)
+
+    def test_idle_users_are_evicted(self):
+        """The engine keeps at most max_users, dropping the least recently used"""
+        engine = BudgetAlertEngine(self.db, max_users=2)
+        for user_id in (1, 2, 1, 3):
+            engine.record_expense(user_id, 10)
+        self.assertEqual(len(engine), 2)
+        self.assertEqual(list(engine._users), [1, 3])
+
+    def test_reads_happen_outside_the_lock(self):
+        """A slow warm-up leaves the engine usable, and a forget() during it keeps its result uncached"""
+        reading, release = threading.Event(), threading.Event()
+        get_daily_totals = self.db.get_daily_totals
+        def slow_daily_totals(*args):
+            reading.set()
+            release.wait(5)
+            return get_daily_totals(*args)
+        self.db.get_daily_totals = slow_daily_totals
+
+        results = []
+        worker = threading.Thread(target=lambda: results.append(self.spend(800)))
+        worker.start()
+        self.assertTrue(reading.wait(5))
+        self.assertTrue(self.engine._lock.acquire(timeout=1))
+        self.engine._lock.release()
+        self.engine.forget(self.user_id)
+        release.set()
+        worker.join(5)
+
+        self.assertEqual(results, [[('daily', 75, 800, 1000)]])
+        self.assertEqual(len(self.engine), 0)
+
+    def test_reloads_after_bulk_writes_elsewhere(self):
+        """An import through another store instance is counted once the data epoch moves"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "alerts.db")
+            db, other = ExpenseDatabase(path), ExpenseDatabase(path)
+            try:
+                db.set_budget_limit(self.user_id, 'daily', 1000)
+                engine = BudgetAlertEngine(db)
+                db.add_expense(self.user_id, 100, 'Food', 'Lunch')
+                self.assertEqual(engine.record_expense(self.user_id, 100, 'Food'), [])
+
+                now = to_epoch(datetime.utcnow())
+                other.import_expenses(self.user_id, [(600, 'Food', 'Party', now, 'import', 'T1', None, None)])
+                db.add_expense(self.user_id, 100, 'Food', 'Snack')
+                self.assertEqual(engine.record_expense(self.user_id, 100, 'Food'), [('daily', 75, 800, 1000)])
+            finally:
+                other.close()
+                db.close()
+
+    def test_category_budget_alerts(self):
+        """A category budget alerts on its own spending only, warmed from the store"""
+        self.db.set_budget_limit(self.user_id, 'daily', None)
+        self.db.set_category_budget(self.user_id, 'Food', 400)
+        self.db.import_expenses(self.user_id, [
+            (200, 'Food', 'Old', to_epoch(datetime.utcnow() - timedelta(days=10)), 'text', None, None, None)])
+        self.assertEqual(self.spend(500, category='Travel'), [])
+        self.assertEqual(self.spend(100), [('Food', 75, 300, 400)])
+        self.assertEqual(self.spend(150), [('Food', 100, 450, 400)])
+        self.engine.remove_expense(self.user_id, 150, to_epoch(datetime.utcnow()), 'Food')
+        self.assertEqual(self.spend(60), [('Food', 90, 360, 400)])
+
+    def test_alert_text(self):
+        """Alert lines match the wording /limits users are used to"""
+        self.assertEqual(format_alert('daily', 100, 1050, 1000), f"🔴 Daily limit EXCEEDED: {CURRENCY}1050.00 / {CURRENCY}1000.00")
+        self.assertEqual(format_alert('weekly', 75, 800, 1000), f"⚡ Weekly limit at 75%: {CURRENCY}800.00 / {CURRENCY}1000.00")
+        self.assertEqual(format_alert('Food', 90, 360, 400), f"⚠️ Food limit at 90%: {CURRENCY}360.00 / {CURRENCY}400.00")
+
+
+class TestCategoryBudgets(unittest.TestCase):
+    """Test BudgetManager category budgets"""
+
+    def setUp(self):
+        self.manager = BudgetManager(InMemoryExpenseDatabase())
+        self.user_id = 123456
+
+    def test_set_and_check(self):
+        """Budgets are validated, reported with 30-day spending and removable"""
+        self.assertIsNone(self.manager.check_category_budget(self.user_id, 'Food'))
+        self.manager.set_category_budget(self.user_id, 'Food', 3000)
+        self.manager.db.add_expense(self.user_id, 250, 'Food', 'Lunch')
+        self.manager.db.add_expense(self.user_id, 99, 'Travel', 'Bus')
+        self.assertEqual(self.manager.check_category_budget(self.user_id, 'Food'), (250, 3000))
+
+        with self.assertRaises(ValueError):
+            self.manager.set_category_budget(self.user_id, 'Snacks', 100)
+        with self.assertRaises(ValueError):
+            self.manager.set_category_budget(self.user_id, 'Food', -5)
+
+        self.manager.set_category_budget(self.user_id, 'Food', None)
+        self.assertIsNone(self.manager.check_category_budget(self.user_id, 'Food'))
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,1155 @@
+"""
+Test suite for the ExpenseDatabase storage layer
+"""
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import tracemalloc
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+from archive import archive_path, archive_years, attach_archive
+from async_database import AsyncExpenseDatabase
+from config import WRITE_BEHIND_MAX_DELAY_MS, WRITE_BEHIND_MAX_ROWS
+from database import ExpenseDatabase, to_epoch
+from excel_exporter import ExcelExporter
+from openpyxl import load_workbook
+from migrations import (
+    LATEST_VERSION,
+    MIGRATIONS,
+    apply_migrations,
+    backfill_epoch_timestamps,
+    get_schema_version,
+)
+from sharding import reshard, shard_for, shard_paths
+
+
+class TestConnectionManagement(unittest.TestCase):
+    """Test pooled connections and their configuration"""
+
+    def setUp(self):
+        """Create a throwaway database file"""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db = ExpenseDatabase(os.path.join(self.tmp_dir.name, "test.db"))
+        self.user_id = 123456
+
+    def tearDown(self):
+        """Close connections and remove the database"""
+        self.db.close()
+        self.tmp_dir.cleanup()
+
+    def test_connection_is_reused(self):
+        """Repeated calls on one thread share a single connection"""
+        first = self.db._get_connection()
+        self.db.add_user(self.user_id, "testuser", "Test")
+        self.db.add_expense(self.user_id, 100, "Food", "Lunch")
+        self.assertIs(self.db._get_connection(), first)
+
+    def test_connection_pragmas(self):
+        """Connections use WAL journaling and relaxed syncing"""
+        conn = self.db._get_connection()
+        self.assertEqual(conn.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+        self.assertEqual(conn.execute('PRAGMA synchronous').fetchone()[0], 1)
+
+    def test_threads_get_separate_connections(self):
+        """Each thread gets its own connection"""
+        connections = []
+        thread = threading.Thread(target=lambda: connections.append(self.db._get_connection()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(connections[0], self.db._get_connection())
+
+    def test_writes_visible_across_threads(self):
+        """A write committed on one thread is visible to another"""
+        thread = threading.Thread(target=self.db.add_expense, args=(self.user_id, 250, "Transport", "Taxi"))
+        thread.start()
+        thread.join()
+        self.assertEqual(self.db.get_total_today(self.user_id), 250)
+
+
+class TestMigrations(unittest.TestCase):
+    """Test versioned schema migrations"""
+
+    def setUp(self):
+        """Create a throwaway database file"""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, "test.db")
+        self.db = ExpenseDatabase(self.db_path)
+
+    def tearDown(self):
+        """Close connections and remove the database"""
+        self.db.close()
+        self.tmp_dir.cleanup()
+
+    def test_new_database_is_at_latest_version(self):
+        """A fresh database has every migration applied"""
+        self.assertEqual(get_schema_version(self.db._get_connection()), LATEST_VERSION)
+
+    def test_reopening_is_idempotent(self):
+        """Opening an up-to-date database applies nothing twice"""
+        self.db.close()
+        self.db = ExpenseDatabase(self.db_path)
+        conn = self.db._get_connection()
+        rows = conn.execute('SELECT version FROM schema_migrations ORDER BY version').fetchall()
+        self.assertEqual([row[0] for row in rows], list(range(1, LATEST_VERSION + 1)))
+
+    def test_windows_use_user_ts_index(self):
+        """Per-user windows are answered from the (user_id, ts) index; the old date index is gone"""
+        conn = self.db._get_connection()
+        plan = conn.execute('''
+            EXPLAIN QUERY PLAN
+            SELECT id, amount, category, description, ts
+            FROM expenses
+            WHERE user_id = ? AND ts >= ?
+            ORDER BY ts DESC, id DESC
+        ''', (1, 0)).fetchall()
+        detail = " ".join(row[-1] for row in plan)
+        self.assertIn("INDEX idx_expenses_user_ts", detail)
+        self.assertNotIn("USE TEMP B-TREE", detail)
+        indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        self.assertNotIn("idx_expenses_user_date", indexes)
+
+
+class TestDailyRollups(unittest.TestCase):
+    """Test the trigger-maintained daily_rollups table"""
+
+    def setUp(self):
+        """Create a throwaway database file"""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db = ExpenseDatabase(os.path.join(self.tmp_dir.name, "test.db"))
+        self.user_id = 123456
+
+    def tearDown(self):
+        """Close connections and remove the database"""
+        self.db.close()
+        self.tmp_dir.cleanup()
+
+    def _add_dated(self, amount, category, days_ago):
+        """Insert an expense dated days_ago days before now"""
+        conn = self.db._get_connection()
+        with conn:
+            conn.execute('''
+                INSERT INTO expenses (user_id, amount, category, description, date)
+                VALUES (?, ?, ?, 'Test', datetime('now', ?))
+            ''', (self.user_id, amount, category, f'-{days_ago} days'))
+
+    def _rollups(self):
+        conn = self.db._get_connection()
+        return conn.execute('SELECT * FROM daily_rollups ORDER BY day, category').fetchall()
+
+    def test_totals_follow_inserts(self):
+        """Windowed totals include only the matching days"""
+        self._add_dated(100, "Food", 0)
+        self._add_dated(50, "Food", 3)
+        self._add_dated(200, "Travel", 20)
+        self._add_dated(999, "Travel", 60)
+
+        self.assertEqual(self.db.get_total_today(self.user_id), 100)
+        self.assertEqual(self.db.get_total_week(self.user_id), 150)
+        self.assertEqual(self.db.get_total_month(self.user_id), 350)
+        self.assertEqual(self.db.get_summary(self.user_id, 30), [("Travel", 200.0, 1), ("Food", 150.0, 2)])
+
+    def test_delete_updates_rollups(self):
+        """Deleting expenses decrements and finally removes rollup rows"""
+        self.db.add_expense(self.user_id, 100, "Food", "Lunch")
+        self.db.add_expense(self.user_id, 40, "Food", "Tea")
+        ids = [row[0] for row in self.db.get_expenses(self.user_id)]
+
+        self.db.delete_expense(ids[0], self.user_id)
+        self.assertEqual(self.db.get_summary(self.user_id, 1)[0][2], 1)
+
+        self.db.delete_expense(ids[1], self.user_id)
+        self.assertEqual(self._rollups(), [])
+
+    def test_rebuild_matches_incremental(self):
+        """A rebuild reproduces the incrementally maintained rollups"""
+        for days_ago in range(10):
+            self._add_dated(10 * days_ago + 5, "Food", days_ago)
+            self._add_dated(7, "Transport", days_ago)
+        incremental = self._rollups()
+
+        conn = self.db._get_connection()
+        with conn:
+            conn.execute('DELETE FROM daily_rollups')
+        self.assertEqual(self.db.rebuild_rollups(), 20)
+        self.assertEqual(self._rollups(), incremental)
+
+    def test_budget_snapshot(self):
+        """Limits and all three windowed totals come back together"""
+        self.assertEqual(self.db.get_budget_snapshot(self.user_id), (None, None, None, 0, 0, 0))
+
+        self._add_dated(100, "Food", 0)
+        self._add_dated(50, "Food", 3)
+        self._add_dated(200, "Travel", 20)
+        self.db.set_budget_limit(self.user_id, 'daily', 500)
+        self.db.set_budget_limit(self.user_id, 'monthly', 15000)
+
+        self.assertEqual(self.db.get_budget_snapshot(self.user_id), (500, None, 15000, 100, 150, 350))
+
+
+class TestUserCache(unittest.TestCase):
+    """Test that add_user only writes new or changed profiles"""
+
+    def setUp(self):
+        """Create a throwaway database file"""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db = ExpenseDatabase(os.path.join(self.tmp_dir.name, "test.db"))
+        self.user_id = 123456
+
+    def tearDown(self):
+        """Close connections and remove the database"""
+        self.db.close()
+        self.tmp_dir.cleanup()
+
+    def test_repeat_add_user_skips_write(self):
+        """A known, unchanged user costs no database change"""
+        conn = self.db._get_connection()
+        self.db.add_user(self.user_id, "testuser", "Test")
+        changes = conn.total_changes
+        for _ in range(5):
+            self.db.add_user(self.user_id, "testuser", "Test")
+        self.assertEqual(conn.total_changes, changes)
+
+    def test_profile_change_keeps_created_at(self):
+        """A changed profile is upserted without resetting created_at"""
+        conn = self.db._get_connection()
+        self.db.add_user(self.user_id, "testuser", "Test")
+        with conn:
+            conn.execute("UPDATE users SET created_at = '2020-01-01 00:00:00'")
+
+        self.db.add_user(self.user_id, "renamed", "Test")
+        row = conn.execute('SELECT username, created_at FROM users WHERE user_id = ?', (self.user_id,)).fetchone()
+        self.assertEqual(row, ("renamed", "2020-01-01 00:00:00"))
+
+    def test_cache_is_bounded(self):
+        """The least recently seen users are evicted first"""
+        with patch("database.USER_CACHE_SIZE", 3):
+            for user_id in range(5):
+                self.db.add_user(user_id, f"user{user_id}", "Test")
+        self.assertEqual(list(self.db._known_users), [2, 3, 4])
+        self.assertFalse(self.db.is_known_user(0, "user0", "Test"))
+
+
+class TestTransactionIds(unittest.TestCase):
+    """Test duplicate rejection through the (user_id, transaction_id) index"""
+
+    def setUp(self):
+        """Create a throwaway database file"""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, "test.db")
+        self.user_id = 123456
+
+    def tearDown(self):
+        """Remove the database"""
+        self.tmp_dir.cleanup()
+
+    def test_duplicate_transaction_is_rejected(self):
+        """A repeated transaction ID is skipped; other users and missing IDs are unaffected"""
+        db = ExpenseDatabase(self.db_path)
+        try:
+            self.assertTrue(db.add_expense(self.user_id, 500, "Shopping", "UPI", transaction_id="TX1"))
+            self.assertFalse(db.add_expense(self.user_id, 500, "Shopping", "UPI again", transaction_id="TX1"))
+            self.assertTrue(db.add_expense(654321, 500, "Shopping", "Other user", transaction_id="TX1"))
+            self.assertTrue(db.add_expense(self.user_id, 20, "Food", "Tea"))
+            self.assertTrue(db.add_expense(self.user_id, 20, "Food", "Tea", transaction_id=""))
+            self.assertEqual(len(db.get_expenses(self.user_id)), 3)
+            self.assertEqual(db.get_total_today(self.user_id), 540)
+        finally:
+            db.close()
+
+    def test_write_behind_checks_transaction_ids_at_once(self):
+        """Rows carrying a transaction ID skip the queue so duplicates are reported"""
+        db = ExpenseDatabase(self.db_path, write_behind=True)
+        try:
+            db.add_expense(self.user_id, 10, "Food", "Queued")
+            self.assertTrue(db.add_expense(self.user_id, 99, "Food", "UPI", transaction_id="TX9"))
+            self.assertFalse(db.add_expense(self.user_id, 99, "Food", "UPI", transaction_id="TX9"))
+            self.assertEqual(db._pending, [])
+        finally:
+            db.close()
+
+    def test_lookup_uses_unique_index(self):
+        """Duplicate checks are an index probe, not a scan"""
+        db = ExpenseDatabase(self.db_path)
+        try:
+            plan = db._get_connection().execute('''
+                EXPLAIN QUERY PLAN
+                SELECT 1 FROM expenses WHERE user_id = ? AND transaction_id = ?
+            ''', (1, "TX")).fetchall()
+            self.assertIn("idx_expenses_user_transaction_unique", " ".join(row[-1] for row in plan))
+        finally:
+            db.close()
+
+    def test_migration_clears_existing_duplicates(self):
+        """Upgrading keeps every row; only the first copy keeps a repeated transaction ID"""
+        conn = sqlite3.connect(self.db_path)
+        get_schema_version(conn)
+        for version, description, migrate in MIGRATIONS[:6]:
+            migrate(conn.cursor())
+            conn.execute('INSERT INTO schema_migrations (version, description) VALUES (?, ?)',
+                         (version, description))
+        conn.executemany('''
+            INSERT INTO expenses (user_id, amount, category, description, date, transaction_id)
+            VALUES (?, ?, 'Shopping', 'UPI', datetime('now'), ?)
+        ''', [(self.user_id, 100, "TX1"), (self.user_id, 100, "TX1"), (self.user_id, 100, "TX1"),
+              (self.user_id, 50, "TX2"), (self.user_id, 5, None), (self.user_id, 5, None)])
+        conn.commit()
+        conn.close()
+
+        db = ExpenseDatabase(self.db_path)
+        try:
+            rows = db._get_connection().execute(
+                'SELECT id, transaction_id FROM expenses WHERE user_id = ? ORDER BY id', (self.user_id,)
+            ).fetchall()
+            self.assertEqual(rows, [(1, "TX1"), (2, None), (3, None), (4, "TX2"), (5, None), (6, None)])
+            self.assertEqual(db.get_total_today(self.user_id), 360)
+        finally:
+            db.close()
+
+
+class TestKeysetPaging(unittest.TestCase):
+    """Test cursor-based expense listing"""
+
+    def setUp(self):
+        """Create a database with 25 expenses, several sharing a timestamp"""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db = ExpenseDatabase(os.path.join(self.tmp_dir.name, "test.db"))
+        self.user_id = 123456
+        conn = self.db._get_connection()
+        with conn:
+            for i in range(25):
+                conn.execute('''
+                    INSERT INTO expenses (user_id, amount, category, description, date)
+                    VALUES (?, ?, 'Food', 'Test', datetime('now', ?))
+                ''', (self.user_id, i, f'-{i // 3} hours'))
+        self.all_ids = [row[0] for row in self.db.get_expenses(self.user_id)]
+
+    def tearDown(self):
+        """Close connections and remove the database"""
+        self.db.close()
+        self.tmp_dir.cleanup()
+
+    def test_limit_returns_newest(self):
+        """limit keeps the newest rows"""
+        expenses = self.db.get_expenses(self.user_id, limit=1)
+        self.assertEqual([row[0] for row in expenses], self.all_ids[:1])
+
+    def test_paging_older_then_newer(self):
+        """Walking older pages and back newer visits every row exactly once"""
+        pages = []
+        page = self.db.get_expenses(self.user_id, limit=10)
+        while page:
+            pages.append(page)
+            last = page[-1]
+            page = self.db.get_expenses(self.user_id, limit=10, before_ts=last[4], before_id=last[0])
+        self.assertEqual([row[0] for page in pages for row in page], self.all_ids)
+
+        first = pages[-1][0]
+        newer = self.db.get_expenses(self.user_id, limit=10, after_ts=first[4], after_id=first[0])
+        self.assertEqual(newer, pages[-2])
+
+    def test_cursor_needs_ts_and_id(self):
+        """Half a cursor is rejected"""
+        with self.assertRaises(ValueError):
+            self.db.get_expenses(self.user_id, before_id=5)
+
+
+class TestEpochTimestamps(unittest.TestCase):
+    """Test the integer ts column and its backfill"""
+
+    def setUp(self):
+        """Create a throwaway database file"""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, "test.db")
+        self.user_id = 123456
+
+    def tearDown(self):
+        """Remove the database"""
+        self.tmp_dir.cleanup()
+
+    def _legacy_database(self, rows):
+        """Database at schema version 4 (before ts) holding rows expenses"""
+        conn = sqlite3.connect(self.db_path)
+        get_schema_version(conn)
+        for version, description, migrate in MIGRATIONS[:4]:
+            migrate(conn.cursor())
+            conn.execute('INSERT INTO schema_migrations (version, description) VALUES (?, ?)',
+                         (version, description))
+        conn.executemany('''
+            INSERT INTO expenses (user_id, amount, category, description, date)
+            VALUES (?, ?, 'Food', 'Old', datetime('now', ?))
+        ''', ((self.user_id, i, f'-{i} minutes') for i in range(rows)))
+        conn.commit()
+        conn.close()
+
+    def test_upgrade_backfills_existing_rows(self):
+        """Opening an old database fills ts for every row"""
+        self._legacy_database(120)
+        db = ExpenseDatabase(self.db_path)
+        try:
+            conn = db._get_connection()
+            missing = conn.execute('SELECT COUNT(*) FROM expenses WHERE ts IS NULL').fetchone()[0]
+            mismatched = conn.execute(
+                "SELECT COUNT(*) FROM expenses WHERE ts != CAST(strftime('%s', date) AS INTEGER)"
+            ).fetchone()[0]
+            self.assertEqual((missing, mismatched), (0, 0))
+            self.assertEqual(len(db.get_expenses(self.user_id, days=1)), 120)
+        finally:
+            db.close()
+
+    def test_backfill_runs_in_batches(self):
+        """The backfill touches every pending row and then finds nothing to do"""
+        self._legacy_database(50)
+        conn = sqlite3.connect(self.db_path)
+        apply_migrations(conn)
+        self.assertEqual(backfill_epoch_timestamps(conn, batch_size=7), 50)
+        self.assertEqual(backfill_epoch_timestamps(conn, batch_size=7), 0)
+        conn.close()
+
+    def test_new_rows_get_ts(self):
+        """add_expense, raw inserts and date edits all keep ts in step with date"""
+        db = ExpenseDatabase(self.db_path)
+        try:
+            db.add_expense(self.user_id, 10.0, "Food", "Tea")
+            conn = db._get_connection()
+            with conn:
+                conn.execute('''
+                    INSERT INTO expenses (user_id, amount, category, description, date)
+                    VALUES (?, 5, 'Food', 'Raw', '2024-01-02 03:04:05')
+                ''', (self.user_id,))
+                conn.execute("UPDATE expenses SET date = '2024-02-01 00:00:00' WHERE description = 'Tea'")
+            rows = dict(conn.execute('SELECT description, ts FROM expenses').fetchall())
+            self.assertEqual(rows, {"Tea": to_epoch("2024-02-01 00:00:00"), "Raw": to_epoch("2024-01-02 03:04:05")})
+        finally:
+            db.close()
+
+    def test_rows_store_only_ts(self):
+        """The bot leaves the text date empty; rollups follow ts, or date for raw inserts without one"""
+        db = ExpenseDatabase(self.db_path)
+        try:
+            db.add_expense(self.user_id, 10.0, "Food", "Tea")
+            db.import_expenses(self.user_id, [(20.0, "Food", "Lunch", to_epoch("2024-03-05 12:00:00"),
+                                               "import", None, None, None)])
+            conn = db._get_connection()
+            with conn:
+                conn.execute('''
+                    INSERT INTO expenses (user_id, amount, category, description, date)
+                    VALUES (?, 5, 'Food', 'Raw', '2024-01-02 03:04:05')
+                ''', (self.user_id,))
+                conn.execute("UPDATE expenses SET ts = ? WHERE description = 'Lunch'", (to_epoch("2024-03-06 12:00:00"),))
+            self.assertEqual(conn.execute('SELECT COUNT(*) FROM expenses WHERE date IS NULL').fetchone()[0], 2)
+
+            rollups = conn.execute('SELECT day, total FROM daily_rollups ORDER BY day').fetchall()
+            self.assertEqual(rollups, [("2024-01-02", 5), ("2024-03-06", 20),
+                                       (datetime.utcnow().strftime("%Y-%m-%d"), 10)])
+            db.rebuild_rollups()
+            self.assertEqual(conn.execute('SELECT day, total FROM daily_rollups ORDER BY day').fetchall(), rollups)
+        finally:
+            db.close()
+
+    def test_range_query_uses_ts_index(self):
+        """Windowed reads search the (user_id, ts) index"""
+        db = ExpenseDatabase(self.db_path)
+        try:
+            plan = db._get_connection().execute('''
+                EXPLAIN QUERY PLAN
+                SELECT id, amount, category, description, ts
+                FROM expenses WHERE user_id = ? AND ts >= ?
+                ORDER BY ts DESC, id DESC
+            ''', (1, 0)).fetchall()
+            detail = " ".join(row[-1] for row in plan)
+            self.assertIn("idx_expenses_user_ts", detail)
+            self.assertNotIn("TEMP B-TREE", detail)
+        finally:
+            db.close()
+
+
+class TestStreamingReads(unittest.TestCase):
+    """Test that iter_expenses keeps peak memory flat"""
+
+    def setUp(self):
+        """Create a throwaway database file"""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db = ExpenseDatabase(os.path.join(self.tmp_dir.name, "test.db"))
+        self.user_id = 123456
+
+    def tearDown(self):
+        """Close connections and remove the database"""
+        self.db.close()
+        self.tmp_dir.cleanup()
+
+    def _fill(self, rows):
+        """Insert rows expenses for the test user"""
+        conn = self.db._get_connection()
+        with conn:
+            conn.executemany('''
+                INSERT INTO expenses (user_id, amount, category, description, date)
+                VALUES (?, ?, 'Food', ?, datetime('now', ?))
+            ''', ((self.user_id, i, f"expense number {i}", f'-{i % 500} minutes') for i in range(rows)))
+
+    def _peak_memory(self, func):
+        """Peak bytes allocated while running func"""
+        tracemalloc.start()
+        try:
+            func()
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    def _drain(self):
+        count = 0
+        for _ in self.db.iter_expenses(self.user_id, batch_size=200):
+            count += 1
+        return count
+
+    def test_iter_matches_get_expenses(self):
+        """Streaming yields the same rows in the same order"""
+        self._fill(1000)
+        self.assertEqual(list(self.db.iter_expenses(self.user_id, batch_size=64)),
+                         self.db.get_expenses(self.user_id))
+
+    def test_date_bounds(self):
+        """start is inclusive and end is exclusive"""
+        self._fill(10)
+        rows = self.db.get_expenses(self.user_id)
+        newest, oldest = rows[0][4], rows[-1][4]
+        self.assertEqual(len(list(self.db.iter_expenses(self.user_id, start=newest))), 1)
+        self.assertEqual(len(list(self.db.iter_expenses(self.user_id, end=newest))), 9)
+        self.assertEqual(len(list(self.db.iter_expenses(self.user_id, start=oldest, end=newest))), 9)
+
+    def test_peak_memory_is_flat(self):
+        """Peak memory does not grow with the number of rows streamed"""
+        self._fill(5000)
+        small_peak = self._peak_memory(self._drain)
+        self._fill(45000)
+        large_peak = self._peak_memory(self._drain)
+        list_peak = self._peak_memory(lambda: self.db.get_expenses(self.user_id))
+
+        self.assertLess(large_peak, small_peak * 2)
+        self.assertLess(large_peak * 10, list_peak)
+
+    def test_csv_export_memory_is_flat(self):
+        """The CSV exporter streams rows to disk"""
+        exporter = ExcelExporter(self.db)
+        filename = os.path.join(self.tmp_dir.name, "export.csv")
+        self._fill(5000)
+        small_peak = self._peak_memory(lambda: exporter.export_csv(self.user_id, filename))
+        self._fill(45000)
+        large_peak = self._peak_memory(lambda: exporter.export_csv(self.user_id, filename))
+
+        self.assertLess(large_peak, small_peak * 2)
+        with open(filename, encoding='utf-8') as f:
+            self.assertEqual(sum(1 for _ in f), 50001)
+
+
+class TestWriteBehind(unittest.TestCase):
+    """Test queued inserts with group commit"""
+
+    def setUp(self):
+        """Create a throwaway database in write-behind mode"""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db = ExpenseDatabase(os.path.join(self.tmp_dir.name, "test.db"), write_behind=True)
+        self.user_id = 123456
+
+    def tearDown(self):
+        """Close connections and remove the database"""
+        self.db.close()
+        self.tmp_dir.cleanup()
+
+    def _stored_rows(self):
+        """Count committed rows through a separate connection"""
+        conn = sqlite3.connect(self.db.db_path)
+        try:
+            return conn.execute('SELECT COUNT(*) FROM expenses').fetchone()[0]
+        finally:
+            conn.close()
+
+    def test_inserts_are_queued(self):
+        """add_expense does not commit immediately"""
+        self.db.add_expense(self.user_id, 100, "Food", "Lunch")
+        self.assertEqual(self._stored_rows(), 0)
+        self.db.flush()
+        self.assertEqual(self._stored_rows(), 1)
+
+    def test_read_your_writes(self):
+        """Reading a user's data flushes their queued inserts first"""
+        self.db.add_expense(self.user_id, 100, "Food", "Lunch")
+        self.db.add_expense(self.user_id, 50, "Transport", "Bus")
+        self.assertEqual(self.db.get_total_today(self.user_id), 150)
+        self.assertEqual(len(self.db.get_expenses(self.user_id)), 2)
+
+    def test_flush_after_delay(self):
+        """Queued rows are committed once the delay elapses"""
+        self.db.add_expense(self.user_id, 100, "Food", "Lunch")
+        time.sleep(WRITE_BEHIND_MAX_DELAY_MS / 1000 * 5)
+        self.assertEqual(self._stored_rows(), 1)
+
+    def test_timed_flushes_share_one_thread(self):
+        """Every delayed flush runs on the same flusher thread and connection"""
+        for _ in range(5):
+            self.db.add_expense(self.user_id, 100, "Food", "Lunch")
+            time.sleep(WRITE_BEHIND_MAX_DELAY_MS / 1000 * 3)
+        self.assertEqual(self._stored_rows(), 5)
+        self.assertEqual(len(self.db._connections), 2)
+
+    def test_flush_when_batch_is_full(self):
+        """A full batch is committed without waiting for the timer"""
+        for _ in range(WRITE_BEHIND_MAX_ROWS):
+            self.db.add_expense(self.user_id, 10, "Food", "Snack")
+        self.assertEqual(self._stored_rows(), WRITE_BEHIND_MAX_ROWS)
+
+
+class TestArchive(unittest.TestCase):
+    """Test moving old expenses into yearly archive files"""
+
+    def setUp(self):
+        """Create a database with two years of daily expenses"""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, "test.db")
+        self.db = ExpenseDatabase(self.db_path)
+        self.user_id = 123456
+        conn = self.db._get_connection()
+        with conn:
+            conn.executemany('''
+                INSERT INTO expenses (user_id, amount, category, description, date)
+                VALUES (?, 10, 'Food', 'Daily', datetime('now', ?))
+            ''', ((self.user_id, f'-{day} days') for day in range(730)))
+
+    def tearDown(self):
+        """Close connections and remove the database and archives"""
+        self.db.close()
+        self.tmp_dir.cleanup()
+
+    def test_archive_keeps_windows_and_full_history(self):
+        """Old rows leave the hot table; windows and full-history reads are unchanged"""
+        month = self.db.get_total_month(self.user_id)
+        history = list(self.db.iter_expenses(self.user_id))
+
+        moved = self.db.archive_expenses(older_than_days=90)
+        self.assertGreater(moved, 600)
+        self.assertEqual(len(self.db.get_expenses(self.user_id)), 730 - moved)
+        self.assertEqual(self.db.get_total_month(self.user_id), month)
+        self.assertEqual(list(self.db.iter_expenses(self.user_id, include_archive=True)), history)
+        self.assertTrue(archive_years(self.db_path))
+
+    def test_archive_is_idempotent(self):
+        """A second run finds nothing left to move"""
+        self.db.archive_expenses(older_than_days=90)
+        self.assertEqual(self.db.archive_expenses(older_than_days=90), 0)
+
+    def test_exports_include_archive(self):
+        """Full-history exports read the archives too"""
+        self.db.archive_expenses(older_than_days=90)
+        filename = ExcelExporter(self.db).export_csv(self.user_id, os.path.join(self.tmp_dir.name, "out.csv"))
+        with open(filename, encoding='utf-8') as f:
+            self.assertEqual(len(f.readlines()), 731)
+
+    def test_reimport_skips_archived_transactions(self):
+        """Transaction IDs that moved to an archive still count as already imported"""
+        old = to_epoch(datetime.utcnow() - timedelta(days=400))
+        statement = [(99, 'Food', 'Coffee', old + i, 'import', f'UTR{i}', None, None) for i in range(3)]
+        self.assertEqual(self.db.import_expenses(self.user_id, statement), (3, 0))
+        self.db.archive_expenses(older_than_days=90)
+
+        self.assertEqual(self.db.import_expenses(self.user_id, statement), (0, 3))
+        self.assertFalse(self.db.add_expense(self.user_id, 99, 'Food', 'Coffee', transaction_id='UTR0'))
+        self.assertTrue(self.db.add_expense(654321, 99, 'Food', 'Coffee', transaction_id='UTR0'))
+
+    def test_lookups_with_many_archive_years(self):
+        """More archive years than SQLite can attach at once don't break inserts"""
+        for year in range(2010, 2022):
+            conn = sqlite3.connect(self.db_path)
+            schema = attach_archive(conn, self.db_path, year)
+            conn.execute(f"INSERT INTO {schema}.expenses (user_id, amount, category, transaction_id, ts) "
+                         f"VALUES (?, 5, 'Food', ?, ?)", (self.user_id, f'OLD{year}', to_epoch(datetime(year, 6, 1))))
+            conn.commit()
+            conn.close()
+
+        self.assertTrue(self.db.add_expense(self.user_id, 99, 'Food', 'Coffee', transaction_id='NEW'))
+        statement = [(5, 'Food', 'Old', to_epoch(datetime(year, 6, 1)), 'import', f'OLD{year}', None, None)
+                     for year in range(2010, 2022)]
+        self.assertEqual(self.db.import_expenses(self.user_id, statement), (0, 12))
+        self.assertEqual([row[1] for row in self.db._get_connection().execute('PRAGMA database_list')], ['main'])
+
+    def test_archive_refreshes_cached_results(self):
+        """Cached summaries stop counting the rows that moved out"""
+        year = sum(total for _, total, _ in self.db.get_summary(self.user_id, 365))
+        self.assertEqual(year, 3650)
+        self.db.archive_expenses(older_than_days=90)
+        self.assertLess(sum(total for _, total, _ in self.db.get_summary(self.user_id, 365)), 1000)
+
+    def test_old_archives_gain_transaction_index(self):
+        """Archives from before the unique index keep the earliest copy of each transaction"""
+        path = archive_path(self.db_path, 2020)
+        conn = sqlite3.connect(path)
+        conn.execute('''
+            CREATE TABLE expenses (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, amount REAL NOT NULL,
+                category TEXT NOT NULL, description TEXT, date TIMESTAMP, source TEXT, transaction_id TEXT,
+                account_name TEXT, payment_method TEXT, ts INTEGER)
+        ''')
+        conn.executemany('INSERT INTO expenses (id, user_id, amount, category, transaction_id) VALUES (?, 1, 5, "Food", ?)',
+                         [(1, 'A'), (2, 'A'), (3, None), (4, None)])
+        conn.commit()
+        conn.close()
+
+        conn = sqlite3.connect(self.db_path)
+        schema = attach_archive(conn, self.db_path, 2020)
+        self.assertEqual([row[0] for row in conn.execute(f'SELECT id FROM {schema}.expenses ORDER BY id')], [1, 3, 4])
+        with self.assertRaises(sqlite3.IntegrityError):
+            conn.execute(f"INSERT INTO {schema}.expenses (user_id, amount, category, transaction_id) VALUES (1, 5, 'Food', 'A')")
+        conn.close()
+
+    def test_archive_age_must_clear_rollup_windows(self):
+        """Archiving inside the 30 day windows is refused"""
+        with self.assertRaises(ValueError):
+            self.db.archive_expenses(older_than_days=7)
+
+
+class TestSearch(unittest.TestCase):
+    """Test full-text search over expense descriptions"""
+
+    def setUp(self):
+        """Create a database with a handful of described expenses"""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db = ExpenseDatabase(os.path.join(self.tmp_dir.name, "test.db"))
+        self.user_id = 123456
+        self.db.import_expenses(self.user_id, [
+            (100, "Food", description, to_epoch(date), "text", None, None, None)
+            for description, date in [("Chicken biryani at Paradise", "2024-01-05 13:00:00"),
+                                      ("Uber ride to airport", "2024-02-10 07:30:00"),
+                                      ("Café latte", "2024-03-01 09:00:00"),
+                                      ("Veg biryani", "2024-03-15 20:00:00")]
+        ])
+        self.db.add_expense(654321, 100, "Food", "Mutton biryani")
+
+    def tearDown(self):
+        """Close connections and remove the database"""
+        self.db.close()
+        self.tmp_dir.cleanup()
+
+    def descriptions(self, *args, **kwargs):
+        return [row[3] for row in self.db.search_expenses(self.user_id, *args, **kwargs)]
+
+    def test_words_prefixes_and_accents(self):
+        """Whole words, prefixes and unaccented spellings all match"""
+        self.assertCountEqual(self.descriptions("biryani"), ["Chicken biryani at Paradise", "Veg biryani"])
+        self.assertEqual(self.descriptions("airp"), ["Uber ride to airport"])
+        self.assertEqual(self.descriptions("cafe"), ["Café latte"])
+        self.assertEqual(self.descriptions("chicken biryani"), ["Chicken biryani at Paradise"])
+        self.assertEqual(self.descriptions("\"*)("), [])
+
+    def test_results_are_per_user(self):
+        """Another user's matching expenses are never returned"""
+        self.assertNotIn("Mutton biryani", self.descriptions("biryani"))
+
+    def test_date_range_and_paging(self):
+        """Date bounds filter and limit/offset page through results"""
+        self.assertEqual(self.descriptions("biryani", start=datetime(2024, 3, 1)), ["Veg biryani"])
+        self.assertEqual(self.descriptions("biryani", end=datetime(2024, 3, 1)), ["Chicken biryani at Paradise"])
+        first = self.descriptions("biryani", limit=1)
+        second = self.descriptions("biryani", limit=1, offset=1)
+        self.assertEqual(len(first + second), 2)
+        self.assertNotEqual(first, second)
+
+    def test_index_follows_updates_and_deletes(self):
+        """Edited and deleted descriptions stay in sync with the index"""
+        expense_id = self.db.search_expenses(self.user_id, "latte")[0][0]
+        conn = self.db._get_connection()
+        with conn:
+            conn.execute("UPDATE expenses SET description = 'Masala chai' WHERE id = ?", (expense_id,))
+        self.assertEqual(self.descriptions("latte"), [])
+        self.assertEqual(self.descriptions("chai"), ["Masala chai"])
+
+        self.db.delete_expense(expense_id, self.user_id)
+        self.assertEqual(self.descriptions("chai"), [])
+
+    def test_search_uses_fts_index(self):
+        """Matching goes through the FTS index instead of scanning descriptions"""
+        plan = ' '.join(row[3] for row in self.db._get_connection().execute(
+            "EXPLAIN QUERY PLAN SELECT rowid FROM expenses_fts WHERE expenses_fts MATCH ?", ('"biryani"*',)))
+        self.assertIn("VIRTUAL TABLE", plan)
+
+
+class TestReadSnapshot(unittest.TestCase):
+    """Test consistent multi-query reads under concurrent writes"""
+
+    def setUp(self):
+        """Create a throwaway database file"""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db = ExpenseDatabase(os.path.join(self.tmp_dir.name, "test.db"), write_behind=False)
+        self.user_id = 123456
+        self.db.add_expense(self.user_id, 100, "Food", "Lunch")
+
+    def tearDown(self):
+        """Close connections and remove the database"""
+        self.db.close()
+        self.tmp_dir.cleanup()
+
+    def _insert_from_other_thread(self):
+        """Insert an expense on another thread, return how long it took"""
+        elapsed = []
+
+        def insert():
+            start = time.perf_counter()
+            self.db.add_expense(self.user_id, 50, "Transport", "Bus")
+            elapsed.append(time.perf_counter() - start)
+
+        thread = threading.Thread(target=insert)
+        thread.start()
+        thread.join()
+        return elapsed[0]
+
+    def test_reads_inside_snapshot_agree(self):
+        """Writes committed mid-snapshot are invisible until it ends, and don't block"""
+        with self.db.read_snapshot(self.user_id):
+            before = self.db.get_total_month(self.user_id)
+            self.assertLess(self._insert_from_other_thread(), 1)
+            self.assertEqual(self.db.get_total_month(self.user_id), before)
+            self.assertEqual(len(list(self.db.iter_expenses(self.user_id, include_archive=True))), 1)
+        self.assertEqual(self.db.get_total_month(self.user_id), before + 50)
+
+    def test_snapshots_nest_and_include_queued_writes(self):
+        """Queued write-behind rows are flushed on entry; inner blocks share the snapshot"""
+        self.db.write_behind = True
+        self.db.add_expense(self.user_id, 25, "Food", "Snack")
+        with self.db.read_snapshot(self.user_id):
+            with self.db.read_snapshot(self.user_id):
+                self.assertEqual(len(self.db.get_expenses(self.user_id)), 2)
+            self._insert_from_other_thread()
+            self.assertEqual(len(self.db.get_expenses(self.user_id)), 2)
+        self.assertFalse(self.db._get_connection().in_transaction)
+
+    def test_export_sheets_agree_under_concurrent_inserts(self):
+        """An insert landing between the summary queries doesn't skew the workbook"""
+        get_summary = self.db.get_summary
+
+        def summary_then_insert(user_id, days=30):
+            result = get_summary(user_id, days)
+            self._insert_from_other_thread()
+            return result
+
+        with patch.object(self.db, "get_summary", side_effect=summary_then_insert):
+            filename = ExcelExporter(self.db).export_all_expenses(
+                self.user_id, os.path.join(self.tmp_dir.name, "out.xlsx"))
+
+        summary = load_workbook(filename)["Summary"]
+        totals = {row[0]: row[1] for row in summary.iter_rows(values_only=True) if row and row[0]}
+        self.assertEqual(totals["Last 7 Days:"], 100)
+        self.assertEqual(totals["Last 30 Days:"], 100)
+
+
+class TestResultCache(unittest.TestCase):
+    """Test the per-user summary/total result cache"""
+
+    def setUp(self):
+        """Create a database with one expense"""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db = ExpenseDatabase(os.path.join(self.tmp_dir.name, "test.db"))
+        self.user_id = 123456
+        self.db.add_expense(self.user_id, 100, "Food", "Lunch")
+
+    def tearDown(self):
+        """Close connections and remove the database"""
+        self.db.close()
+        self.tmp_dir.cleanup()
+
+    def test_repeat_reads_hit(self):
+        """The same query and window is computed once per version"""
+        self.assertEqual(self.db.get_total_today(self.user_id), 100)
+        self.assertEqual(self.db.get_total_today(self.user_id), 100)
+        self.db.get_summary(self.user_id, 7)
+        self.db.get_multi_window_summary(self.user_id, [7, 30])
+        self.db.get_multi_window_summary(self.user_id, [7, 30])
+        stats = self.db.get_cache_stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["entries"]), (2, 3, 3))
+
+    def test_list_keyword_arguments(self):
+        """List arguments passed by keyword are part of the key too"""
+        self.assertEqual(self.db.get_multi_window_summary(self.user_id, windows=[7, 30]),
+                         self.db.get_multi_window_summary(self.user_id, windows=[7, 30]))
+        self.assertEqual(self.db.get_cache_stats()["hits"], 1)
+
+    def test_writes_invalidate_only_their_user(self):
+        """add_expense, delete_expense and set_budget_limit make the user's results stale"""
+        self.db.get_total_today(654321)
+        self.assertEqual(self.db.get_total_today(self.user_id), 100)
+        self.db.add_expense(self.user_id, 50, "Food", "Snack")
+        self.assertEqual(self.db.get_total_today(self.user_id), 150)
+        self.db.delete_expense(self.db.get_expenses(self.user_id, limit=1)[0][0], self.user_id)
+        self.assertEqual(self.db.get_total_week(self.user_id), 100)
+
+        self.db.set_budget_limit(self.user_id, 'daily', 500)
+        self.assertEqual(self.db.get_budget_snapshot(self.user_id)[0], 500)
+        self.db.get_total_today(654321)
+        self.assertEqual(self.db.get_cache_stats()["hits"], 1)
+
+    def test_bulk_writes_from_another_process_are_seen(self):
+        """Imports and rollup rebuilds through another instance (e.g. manage.py) make cached results miss"""
+        self.assertEqual(self.db.get_total_today(self.user_id), 100)
+        other = ExpenseDatabase(self.db.db_path)
+        try:
+            now = to_epoch(datetime.utcnow())
+            other.import_expenses(self.user_id, [(40, "Food", "Tea", now, "import", "T1", None, None)])
+            self.assertEqual(self.db.get_total_today(self.user_id), 140)
+
+            conn = other._get_connection()
+            with conn:
+                conn.execute('UPDATE daily_rollups SET total = 0')
+            self.assertEqual(self.db.get_total_today(self.user_id), 140)
+            other.rebuild_rollups()
+            self.assertEqual(self.db.get_total_today(self.user_id), 140)
+        finally:
+            other.close()
+
+    def test_import_keeps_other_users_cached(self):
+        """A bulk import only moves the data epoch of the user it wrote for"""
+        self.db.add_expense(654321, 30, "Food", "Tea")
+        epochs = {user_id: self.db.get_data_epoch(user_id) for user_id in (self.user_id, 654321)}
+        self.assertEqual(self.db.get_total_today(654321), 30)
+        now = to_epoch(datetime.utcnow())
+        self.db.import_expenses(self.user_id, [(40, "Food", "Tea", now, "import", "T1", None, None)])
+        self.assertNotEqual(self.db.get_data_epoch(self.user_id), epochs[self.user_id])
+        self.assertEqual(self.db.get_data_epoch(654321), epochs[654321])
+        self.assertEqual(self.db.get_total_today(654321), 30)
+        self.assertEqual(self.db.get_cache_stats()["hits"], 1)
+
+    def test_write_behind_rows_are_seen(self):
+        """A queued insert invalidates at once and the recomputing read flushes it"""
+        db = ExpenseDatabase(os.path.join(self.tmp_dir.name, "queued.db"), write_behind=True)
+        try:
+            self.assertEqual(db.get_total_today(self.user_id), 0)
+            db.add_expense(self.user_id, 40, "Food", "Tea")
+            self.assertEqual(db.get_total_today(self.user_id), 40)
+        finally:
+            db.close()
+
+    def test_results_expire_with_the_day(self):
+        """A cached result from yesterday is not served today"""
+        self.db.get_total_today(self.user_id)
+        tomorrow = datetime.utcnow() + timedelta(days=1)
+        with patch("result_cache.datetime") as clock:
+            clock.utcnow.return_value = tomorrow
+            self.db.get_total_today(self.user_id)
+        self.assertEqual(self.db.get_cache_stats()["misses"], 2)
+
+    def test_snapshot_reads_bypass_cache(self):
+        """Reads inside read_snapshot neither use nor fill the cache"""
+        with self.db.read_snapshot(self.user_id):
+            self.db.get_total_today(self.user_id)
+        self.assertEqual(self.db.get_cache_stats()["entries"], 0)
+
+    def test_disabled(self):
+        """result_cache=False reads straight through"""
+        db = ExpenseDatabase(os.path.join(self.tmp_dir.name, "plain.db"), result_cache=False)
+        try:
+            db.get_total_today(self.user_id)
+            self.assertIsNone(db.get_cache_stats())
+        finally:
+            db.close()
+
+
+class TestMaintenance(unittest.TestCase):
+    """Test analyze / vacuum / checkpoint maintenance runs"""
+
+    def setUp(self):
+        """Create a database, fill it and delete most rows to leave free pages"""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, "test.db")
+        self.db = ExpenseDatabase(self.db_path)
+        conn = self.db._get_connection()
+        with conn:
+            conn.executemany('''
+                INSERT INTO expenses (user_id, amount, category, description)
+                VALUES (?, 10, 'Food', ?)
+            ''', ((user_id % 50, "padding " * 20) for user_id in range(5000)))
+        with conn:
+            conn.execute('DELETE FROM expenses WHERE user_id > 5')
+
+    def tearDown(self):
+        """Close connections and remove the database"""
+        self.db.close()
+        self.tmp_dir.cleanup()
+
+    def test_maintenance_reclaims_space(self):
+        """Free pages go back to the filesystem, stats exist and the WAL is truncated"""
+        conn = self.db._get_connection()
+        self.assertEqual(conn.execute('PRAGMA auto_vacuum').fetchone()[0], 2)
+        self.assertGreater(conn.execute('PRAGMA freelist_count').fetchone()[0], 0)
+
+        report, = self.db.maintain()
+        self.assertEqual(report["steps"], ["analyze", "vacuum", "checkpoint"])
+        self.assertEqual(report["skipped"], [])
+        self.assertGreater(report["reclaimed_bytes"], 0)
+        self.assertEqual(conn.execute('PRAGMA freelist_count').fetchone()[0], 0)
+        self.assertIsNotNone(conn.execute("SELECT 1 FROM sqlite_stat1 LIMIT 1").fetchone())
+        self.assertEqual(os.path.getsize(self.db_path + '-wal'), 0)
+
+    def test_time_budget_skips_remaining_steps(self):
+        """A spent budget runs nothing"""
+        report, = self.db.maintain(time_budget=0)
+        self.assertEqual(report["steps"], [])
+        self.assertEqual(report["skipped"], ["analyze", "vacuum", "checkpoint"])
+
+    def test_legacy_files_need_a_full_vacuum(self):
+        """Files created before incremental auto_vacuum convert only on request"""
+        legacy_path = os.path.join(self.tmp_dir.name, "legacy.db")
+        conn = sqlite3.connect(legacy_path)
+        apply_migrations(conn)
+        conn.close()
+        legacy = ExpenseDatabase(legacy_path)
+        try:
+            report, = legacy.maintain()
+            self.assertIn("incremental vacuum (needs a full vacuum first)", report["skipped"])
+            legacy.maintain(full_vacuum=True)
+            self.assertEqual(legacy._get_connection().execute('PRAGMA auto_vacuum').fetchone()[0], 2)
+        finally:
+            legacy.close()
+
+
+class TestSharding(unittest.TestCase):
+    """Test spreading users over several database files"""
+
+    def setUp(self):
+        """Create a throwaway directory for the shard files"""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, "test.db")
+        self.users = list(range(1000, 1040))
+
+    def tearDown(self):
+        """Remove the shard files"""
+        self.tmp_dir.cleanup()
+
+    def _fill(self, db):
+        """Give every test user a few expenses"""
+        for user_id in self.users:
+            db.add_user(user_id, f"user{user_id}", "Test")
+            for amount in (10, 20, user_id):
+                db.add_expense(user_id, amount, "Food", f"Expense {amount}")
+
+    def _contents(self, db):
+        """Per-user expenses (without IDs) and monthly totals"""
+        return {
+            user_id: ([row[1:] for row in db.get_expenses(user_id)], db.get_total_month(user_id))
+            for user_id in self.users
+        }
+
+    def test_routing_is_stable(self):
+        """Users map to the same shard every time and all shards get used"""
+        self.assertEqual(shard_for(12345, 4), shard_for(12345, 4))
+        self.assertEqual(shard_for(12345, 1), 0)
+        self.assertEqual({shard_for(user_id, 4) for user_id in self.users}, {0, 1, 2, 3})
+        self.assertEqual(shard_paths("data/expenses.db", 1), ["data/expenses.db"])
+        self.assertEqual(shard_paths("data/expenses.db", 2),
+                         ["data/expenses.0-of-2.db", "data/expenses.1-of-2.db"])
+
+    def test_users_live_in_one_shard(self):
+        """Each user's rows are stored only in their own shard"""
+        db = ExpenseDatabase(self.db_path, shards=4)
+        try:
+            self._fill(db)
+            for user_id in self.users:
+                counts = [
+                    db._get_connection(shard).execute(
+                        'SELECT COUNT(*) FROM expenses WHERE user_id = ?', (user_id,)
+                    ).fetchone()[0]
+                    for shard in range(4)
+                ]
+                self.assertEqual(counts[db.shard_for(user_id)], 3)
+                self.assertEqual(sum(counts), 3)
+            stats = db.get_shard_stats()
+            self.assertEqual(sum(users for _, users, _ in stats), len(self.users))
+            self.assertEqual(sum(expenses for _, _, expenses in stats), 3 * len(self.users))
+        finally:
+            db.close()
+
+    def test_write_behind_flush_spans_shards(self):
+        """Queued inserts for users on different shards all land"""
+        db = ExpenseDatabase(self.db_path, shards=3, write_behind=True)
+        try:
+            for user_id in self.users:
+                db.add_expense(user_id, 5, "Food", "Queued")
+            db.flush()
+            self.assertEqual(sum(expenses for _, _, expenses in db.get_shard_stats()), len(self.users))
+        finally:
+            db.close()
+
+    def test_reshard_preserves_user_data(self):
+        """Splitting one file into shards keeps every user's expenses and totals"""
+        single = ExpenseDatabase(self.db_path)
+        self._fill(single)
+        expected = self._contents(single)
+        single.close()
+
+        moved = reshard(shard_paths(self.db_path, 1), shard_paths(self.db_path, 3))
+        self.assertEqual(sum(moved), len(self.users))
+
+        sharded = ExpenseDatabase(self.db_path, shards=3)
+        try:
+            self.assertEqual(self._contents(sharded), expected)
+        finally:
+            sharded.close()
+
+        with self.assertRaises(FileExistsError):
+            reshard(shard_paths(self.db_path, 1), shard_paths(self.db_path, 3))
+
+    def test_reshard_keeps_recurring_occurrences_recognised(self):
+        """Stored occurrences follow their renumbered recurring expense, so replaying one adds nothing"""
+        due = to_epoch(datetime(2024, 1, 1))
+        single = ExpenseDatabase(self.db_path)
+        old_ids = {}
+        for user_id in self.users:
+            old_ids[user_id] = single.add_recurring_expense(user_id, 10, "Bills", "Rent", "monthly", due)
+            single.materialize_recurring([(user_id, old_ids[user_id], due, due + 86400)])
+        single.close()
+
+        reshard(shard_paths(self.db_path, 1), shard_paths(self.db_path, 3))
+
+        sharded = ExpenseDatabase(self.db_path, shards=3)
+        try:
+            new_ids = {user_id: sharded.get_recurring_expenses(user_id)[0][0] for user_id in self.users}
+            self.assertNotEqual(new_ids, old_ids)
+            self.assertEqual(sharded.materialize_recurring(
+                [(user_id, new_ids[user_id], due, due + 86400) for user_id in self.users]
+            ), {})
+            self.assertEqual({len(sharded.get_expenses(user_id)) for user_id in self.users}, {1})
+        finally:
+            sharded.close()
+
+
+class TestAsyncDatabase(unittest.IsolatedAsyncioTestCase):
+    """Test the awaitable database facade"""
+
+    def setUp(self):
+        """Create a throwaway database file"""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db = AsyncExpenseDatabase(ExpenseDatabase(os.path.join(self.tmp_dir.name, "test.db")))
+        self.user_id = 123456
+
+    def tearDown(self):
+        """Close workers and remove the database"""
+        self.db.close()
+        self.tmp_dir.cleanup()
+
+    async def test_methods_are_awaitable(self):
+        """Facade methods mirror ExpenseDatabase as coroutines"""
+        await self.db.add_user(self.user_id, "testuser", "Test")
+        await self.db.add_expense(self.user_id, 120, "Food", "Lunch")
+        summary = await self.db.get_summary(self.user_id, 30)
+        self.assertEqual(summary, [("Food", 120.0, 1)])
+
+    async def test_queries_run_off_the_event_loop(self):
+        """Database work happens on worker threads"""
+        loop_thread = threading.get_ident()
+        worker_thread = await self.db.run(threading.get_ident)
+        self.assertNotEqual(worker_thread, loop_thread)
+
+    async def test_unknown_method_raises(self):
+        """Only known database methods are exposed"""
+        with self.assertRaises(AttributeError):
+            self.db.drop_everything
+
+
+if __name__ == '__main__':
+    unittest.main()
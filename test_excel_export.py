@@ -21,10 +21,10 @@ except ImportError as e:
     sys.exit(1)
 
 try:
-    from database import ExpenseDatabase
-    print("✅ ExpenseDatabase imported successfully")
+    from storage import InMemoryExpenseDatabase
+    print("✅ InMemoryExpenseDatabase imported successfully")
 except ImportError as e:
-    print(f"❌ Failed to import ExpenseDatabase: {e}")
+    print(f"❌ Failed to import InMemoryExpenseDatabase: {e}")
     sys.exit(1)
 
 try:
@@ -39,7 +39,7 @@ print("Testing Excel Exporter initialization...")
 print("="*50)
 
 try:
-    exporter = ExcelExporter()
+    exporter = ExcelExporter(InMemoryExpenseDatabase())
     print("✅ ExcelExporter initialized successfully")
 except Exception as e:
     print(f"❌ Failed to initialize ExcelExporter: {e}")
@@ -50,7 +50,7 @@ print("Testing database access...")
 print("="*50)
 
 try:
-    db = ExpenseDatabase()
+    db = exporter.db
     print("✅ Database connected successfully")
     
     # Test adding a sample user and expense for demonstration
@@ -0,0 +1,183 @@
+"""
+Test suite for spending forecasts
+"""
+import threading
+import unittest
+from datetime import date, datetime, timedelta
+from config import CURRENCY, FORECAST_HISTORY_DAYS
+from database import to_epoch
+from forecasting import ForecastEngine, SpendingModel, format_forecast_warning
+from storage import InMemoryExpenseDatabase
+
+
+class TestSpendingModel(unittest.TestCase):
+    """Test the incremental daily-spend model"""
+
+    def setUp(self):
+        """A model opened on a Monday"""
+        self.start = date(2024, 1, 1)
+        self.model = SpendingModel(self.start)
+
+    def spend_daily(self, days, amount_for):
+        """Add amount_for(n) on each of the first `days` days, then open the next one"""
+        for n in range(days):
+            amount = amount_for(n)
+            if amount:
+                self.model.add(self.start + timedelta(days=n), "Food", amount)
+        self.model.advance(self.start + timedelta(days=days))
+
+    def test_steady_spending(self):
+        """Spending the same every day forecasts the same rate"""
+        self.spend_daily(40, lambda n: 100)
+        self.assertAlmostEqual(self.model.forecast_total(), 3000)
+        self.assertAlmostEqual(self.model.forecast_category("Food"), 3000)
+
+    def test_weekday_pattern(self):
+        """A weekly shop is forecast once a week, not smeared over every day"""
+        self.spend_daily(56, lambda n: 700 if n % 7 == 5 else 0)
+        self.assertAlmostEqual(self.model.forecast_total(28), 2800, delta=50)
+        self.assertGreater(self.model.expected(date(2024, 3, 2)), 500)
+        self.assertLess(self.model.expected(date(2024, 3, 4)), 100)
+
+    def test_category_trend(self):
+        """Rising spending in a category projects the rise forward"""
+        self.spend_daily(40, lambda n: 50 + 5 * n)
+        level, trend = self.model.categories["Food"]
+        self.assertGreater(trend, 0)
+        self.assertGreater(self.model.forecast_category("Food"), 30 * level)
+
+    def test_updates_only_touch_the_open_day(self):
+        """Adding spending sums into today; days are folded once, a long gap at most the history window"""
+        self.spend_daily(10, lambda n: 100)
+        self.model.add(self.model.day, "Food", 50)
+        self.model.add(self.model.day, "Travel", 20)
+        self.assertEqual(self.model.days_seen, 10)
+        self.assertEqual(self.model.spent_by_category, {"Food": 50, "Travel": 20})
+
+        self.model.advance(self.model.day + timedelta(days=365))
+        self.assertEqual(self.model.days_seen, 10 + FORECAST_HISTORY_DAYS)
+        self.assertEqual(self.model.day, date(2025, 1, 10))
+        self.assertLess(self.model.forecast_total(), 100)
+
+
+class TestForecastEngine(unittest.TestCase):
+    """Test per-user forecasts and early overrun warnings"""
+
+    def setUp(self):
+        """In-memory store with 10 days of 100/day on Food"""
+        self.db = InMemoryExpenseDatabase()
+        self.engine = ForecastEngine(self.db)
+        self.user_id = 123456
+        self.add_history(self.user_id, 10)
+
+    def add_history(self, user_id, days):
+        """Store 100 on Food for each of the last `days` days"""
+        now = datetime.utcnow()
+        self.db.import_expenses(user_id, [
+            (100, "Food", "Lunch", to_epoch(now - timedelta(days=age)), "text", None, None, None)
+            for age in range(1, days + 1)
+        ])
+
+    def spend(self, amount, category="Food", user_id=None):
+        """Store an expense, then feed it to the engine like the bot does"""
+        user_id = user_id or self.user_id
+        self.db.add_expense(user_id, amount, category, "Test")
+        return self.engine.record_expense(user_id, amount, category)
+
+    def test_forecast(self):
+        """The forecast is warmed from stored daily totals"""
+        self.db.set_budget_limit(self.user_id, "monthly", 5000)
+        self.db.set_category_budget(self.user_id, "Food", 4000)
+        result = self.engine.forecast(self.user_id)
+        self.assertAlmostEqual(result["total"], 3000)
+        self.assertAlmostEqual(result["daily_average"], 100)
+        self.assertEqual(result["monthly_limit"], 5000)
+        (category, expected, trend, budget), = result["categories"]
+        self.assertEqual((category, budget), ("Food", 4000))
+        self.assertAlmostEqual(expected, 3000)
+        self.assertAlmostEqual(trend, 0)
+
+    def test_needs_minimum_history(self):
+        """New users get no forecast and no warnings"""
+        self.add_history(2, 3)
+        self.db.set_budget_limit(2, "monthly", 100)
+        self.assertIsNone(self.engine.forecast(2))
+        self.assertEqual(self.spend(5000, user_id=2), [])
+
+    def test_overrun_warns_once(self):
+        """The expense that pushes the forecast over a limit warns, then again only after it falls back"""
+        self.db.set_budget_limit(self.user_id, "monthly", 3500)
+        self.assertEqual(self.spend(100), [])
+        (name, total, limit), = self.spend(1000)
+        self.assertEqual((name, limit), (None, 3500))
+        self.assertAlmostEqual(total, 4000)
+        self.assertEqual(self.spend(100), [])
+
+        expense_id = self.db.get_expenses(self.user_id, limit=2)[1][0]
+        self.db.delete_expense(expense_id, self.user_id)
+        self.engine.forget(self.user_id)
+        self.assertEqual(self.spend(10), [])
+        self.assertEqual(len(self.spend(1000)), 1)
+
+    def test_category_budget_overrun(self):
+        """Category budgets are checked against that category's forecast only"""
+        self.db.set_category_budget(self.user_id, "Food", 3200)
+        self.assertEqual(self.spend(500, category="Travel"), [])
+        self.assertEqual([name for name, _, _ in self.spend(500)], ["Food"])
+
+    def test_warm_up_does_not_hold_the_lock(self):
+        """A slow warm-up leaves the engine usable, and a forget() during it keeps its model uncached"""
+        reading, release = threading.Event(), threading.Event()
+        get_daily_totals = self.db.get_daily_totals
+        def slow_daily_totals(*args):
+            reading.set()
+            release.wait(5)
+            return get_daily_totals(*args)
+        self.db.get_daily_totals = slow_daily_totals
+
+        results = []
+        worker = threading.Thread(target=lambda: results.append(self.engine.forecast_total(self.user_id)))
+        worker.start()
+        self.assertTrue(reading.wait(5))
+        self.assertTrue(self.engine._lock.acquire(timeout=1))
+        self.engine._lock.release()
+        self.engine.forget(self.user_id)
+        release.set()
+        worker.join(5)
+
+        self.assertAlmostEqual(results[0], 3000)
+        self.assertEqual(len(self.engine), 0)
+
+    def test_expense_dated_tomorrow_counts_as_today(self):
+        """A row dated after today (UTC) neither stalls the model nor silences warnings"""
+        tomorrow = to_epoch(datetime.utcnow() + timedelta(days=1))
+        self.db.import_expenses(self.user_id, [(100, "Food", "IST", tomorrow, "import", None, None, None)])
+        self.db.set_budget_limit(self.user_id, "monthly", 3500)
+        self.assertEqual(self.spend(100), [])
+        self.assertEqual(self.engine._users[self.user_id].model.day, datetime.utcnow().date())
+        self.assertEqual(len(self.spend(1000)), 1)
+        self.assertEqual(len(self.engine), 1)
+        self.db.import_expenses(self.user_id, [(10, "Food", "IST", tomorrow, "import", None, None, None)])
+        self.assertEqual(self.engine.record_expense(self.user_id, 10, "Food", ts=tomorrow), [])
+        self.assertEqual(len(self.engine), 1)
+
+    def test_backdated_expense_drops_model(self):
+        """An expense for an earlier day is picked up by the next warm start instead"""
+        self.spend(100)
+        self.assertEqual(len(self.engine), 1)
+        yesterday = to_epoch(datetime.utcnow() - timedelta(days=1))
+        self.assertEqual(self.engine.record_expense(self.user_id, 100, "Food", ts=yesterday), [])
+        self.assertEqual(len(self.engine), 0)
+
+    def test_warning_text(self):
+        """Warning lines name the limit the forecast runs over"""
+        self.assertEqual(format_forecast_warning(None, 4000, 3500),
+                         f"🔮 At this pace you'll spend {CURRENCY}4000.00 in the next 30 days, "
+                         f"over your {CURRENCY}3500.00 monthly limit")
+        self.assertEqual(format_forecast_warning("Food", 3500, 3200),
+                         f"🔮 Food is on pace for {CURRENCY}3500.00 in the next 30 days, "
+                         f"over its {CURRENCY}3200.00 budget")
+
+
+if __name__ == '__main__':
+    unittest.main()
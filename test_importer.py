@@ -0,0 +1,173 @@
+"""
+Test suite for bulk CSV/XLSX expense imports
+"""
+import csv
+import os
+import tempfile
+import time
+import tracemalloc
+import unittest
+from datetime import datetime
+from openpyxl import Workbook
+from database import ExpenseDatabase, from_epoch
+from excel_exporter import ExcelExporter
+from importer import ExpenseImporter
+
+
+class TestExpenseImporter(unittest.TestCase):
+    """Test streaming statement imports"""
+
+    def setUp(self):
+        """Create a throwaway database file"""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db = ExpenseDatabase(os.path.join(self.tmp_dir.name, "test.db"))
+        self.importer = ExpenseImporter(self.db, batch_size=100)
+        self.user_id = 123456
+
+    def tearDown(self):
+        """Close connections and remove the database"""
+        self.db.close()
+        self.tmp_dir.cleanup()
+
+    def _write_statement(self, rows, name="statement.csv"):
+        """Bank-style CSV with a preamble, a header row and the given rows"""
+        path = os.path.join(self.tmp_dir.name, name)
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(["Statement of account"])
+            writer.writerow(["Account No", "XXXX1234"])
+            writer.writerow([])
+            writer.writerow(["Txn Date", "Narration", "Ref No./Cheque No.", "Withdrawal Amt.", "Deposit Amt."])
+            writer.writerows(rows)
+        return path
+
+    def test_bank_statement_import(self):
+        """Debits are imported and categorized, deposits and junk rows are skipped"""
+        path = self._write_statement([
+            ["01/03/2024", "UPI-SWIGGY-biriyani", "UTR001", "250.00", ""],
+            ["02/03/2024", "UBER TAXI", "UTR002", "1,180.50", ""],
+            ["03/03/2024", "SALARY", "UTR003", "", "50000.00"],
+            ["not a date", "???", "", "10", ""],
+        ])
+        result = self.importer.import_file(self.user_id, path)
+        self.assertEqual(result, {"imported": 2, "duplicates": 0, "credits": 1, "invalid": 1})
+
+        rows = self.db.get_expenses(self.user_id)
+        self.assertEqual([(amount, category) for _, amount, category, _, _ in rows],
+                         [(1180.5, "Transport"), (250.0, "Food")])
+        self.assertEqual(from_epoch(rows[-1][4]), datetime(2024, 3, 1))
+
+    def test_negative_and_cr_amounts_are_credits(self):
+        """Negative amounts and Cr-suffixed amounts are counted as credits, Dr amounts as spending"""
+        path = os.path.join(self.tmp_dir.name, "amounts.csv")
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            csv.writer(f).writerows([
+                ["Date", "Description", "Amount"],
+                ["01/03/2024", "coffee", "99.00 Dr"],
+                ["02/03/2024", "refund from store", "-450.00"],
+                ["03/03/2024", "cashback", "25.00 Cr"],
+                ["04/03/2024", "interest", "12.50CR"],
+            ])
+        result = self.importer.import_file(self.user_id, path)
+        self.assertEqual(result, {"imported": 1, "duplicates": 0, "credits": 3, "invalid": 0})
+        self.assertEqual(self.db.get_expenses(self.user_id)[0][1], 99.0)
+
+    def test_currency_prefixed_amounts(self):
+        """Currency prefixes such as Rs., INR and ₹ are not read as part of the number"""
+        path = os.path.join(self.tmp_dir.name, "currency.csv")
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            csv.writer(f).writerows([
+                ["Date", "Description", "Amount"],
+                ["01/03/2024", "coffee", "Rs.500"],
+                ["02/03/2024", "shoes", "Rs. 1,234.50"],
+                ["03/03/2024", "books", "INR 2,000"],
+                ["04/03/2024", "tea", "₹ 99"],
+            ])
+        result = self.importer.import_file(self.user_id, path)
+        self.assertEqual(result, {"imported": 4, "duplicates": 0, "credits": 0, "invalid": 0})
+        self.assertEqual(sorted(row[1] for row in self.db.get_expenses(self.user_id)), [99, 500, 1234.5, 2000])
+
+    def test_credit_type_column(self):
+        """Rows marked Cr in a Dr/Cr column are refunds, not spending"""
+        path = os.path.join(self.tmp_dir.name, "typed.xlsx")
+        wb = Workbook()
+        wb.active.append(["Date", "Description", "Amount", "Dr/Cr"])
+        wb.active.append([datetime(2024, 5, 4), "Groceries", 640, "DR"])
+        wb.active.append([datetime(2024, 5, 5), "Refund groceries", 640, "CR"])
+        wb.active.append([datetime(2024, 5, 6), "Returned item", -80, ""])
+        wb.save(path)
+
+        result = self.importer.import_file(self.user_id, path)
+        self.assertEqual(result, {"imported": 1, "duplicates": 0, "credits": 2, "invalid": 0})
+
+    def test_reimport_skips_known_transaction_ids(self):
+        """Importing the same statement twice adds nothing the second time"""
+        rows = [[f"{day:02d}/03/2024", "coffee", f"UTR{day}", "99", ""] for day in range(1, 29)]
+        rows.append(["28/03/2024", "coffee", "UTR28", "99", ""])
+        path = self._write_statement(rows)
+
+        first = self.importer.import_file(self.user_id, path)
+        second = self.importer.import_file(self.user_id, path)
+        self.assertEqual((first["imported"], first["duplicates"]), (28, 1))
+        self.assertEqual((second["imported"], second["duplicates"]), (0, 29))
+
+    def test_xlsx_import(self):
+        """Spreadsheet cells (real dates and numbers) are read directly"""
+        path = os.path.join(self.tmp_dir.name, "statement.xlsx")
+        wb = Workbook()
+        wb.active.append(["Date", "Description", "Category", "Amount"])
+        wb.active.append([datetime(2024, 5, 4, 12, 30), "Groceries", "shopping", 640])
+        wb.save(path)
+
+        result = self.importer.import_file(self.user_id, path)
+        self.assertEqual(result["imported"], 1)
+        self.assertEqual(self.db.get_expenses(self.user_id)[0][1:4], (640.0, "Shopping", "Groceries"))
+
+    def test_csv_export_round_trip(self):
+        """A /export_csv file imports back to the same expenses"""
+        for amount, description in [(120, "lunch"), (60, "bus ticket"), (15, "misc")]:
+            self.db.add_expense(self.user_id, amount, "Food", description)
+        filename = ExcelExporter(self.db).export_csv(self.user_id, os.path.join(self.tmp_dir.name, "out.csv"))
+
+        self.importer.import_file(654321, filename)
+        strip_ids = lambda rows: sorted(row[1:] for row in rows)
+        self.assertEqual(strip_ids(self.db.get_expenses(654321)), strip_ids(self.db.get_expenses(self.user_id)))
+
+    def test_unsupported_files_are_rejected(self):
+        """Unknown extensions and files without a header raise ValueError"""
+        with self.assertRaises(ValueError):
+            self.importer.import_file(self.user_id, os.path.join(self.tmp_dir.name, "notes.txt"))
+        path = os.path.join(self.tmp_dir.name, "empty.csv")
+        with open(path, 'w') as f:
+            f.write("a,b\n1,2\n")
+        with self.assertRaises(ValueError):
+            self.importer.import_file(self.user_id, path)
+
+    def test_large_import_is_fast_and_flat(self):
+        """Tens of thousands of rows import in seconds with flat peak memory"""
+        def statement(rows, name):
+            return self._write_statement(
+                ([f"{1 + i % 28:02d}/{1 + i % 12:02d}/2024", f"purchase {i % 50}", f"REF{name}{i}", "42.00", ""]
+                 for i in range(rows)),
+                name=f"{name}.csv",
+            )
+
+        def peak(path):
+            tracemalloc.start()
+            try:
+                ExpenseImporter(self.db, batch_size=2000).import_file(self.user_id, path)
+                return tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+        small_peak = peak(statement(2000, "small"))
+        large = statement(20000, "large")
+        start = time.perf_counter()
+        large_peak = peak(large)
+        self.assertLess(time.perf_counter() - start, 30)
+        self.assertLess(large_peak, small_peak * 2)
+        self.assertEqual(self.db.get_shard_stats()[0][2], 22000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,7 +4,7 @@ This demonstrates how the NLP parser works without needing Telegram
 """
 
 from nlp_processor import ExpenseParser
-from database import ExpenseDatabase
+from storage import InMemoryExpenseDatabase
 from config import CURRENCY
 
 def test_expense_parser():
@@ -56,7 +56,7 @@ def test_database_operations():
     print("=" * 60)
     print()
     
-    db = ExpenseDatabase()
+    db = InMemoryExpenseDatabase()
     test_user_id = 123456789
     
     # Add sample user
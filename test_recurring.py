@@ -0,0 +1,181 @@
+"""
+Test suite for recurring expenses and their scheduler
+"""
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from analytics import ExpenseRecurring
+from budget_alerts import BudgetAlertEngine
+from database import ExpenseDatabase, to_epoch
+from recurring import RecurringScheduler, next_occurrence
+from sharding import shard_for
+from storage import InMemoryExpenseDatabase
+
+
+class TestNextOccurrence(unittest.TestCase):
+    """Test schedule arithmetic"""
+
+    def test_fixed_periods(self):
+        """Daily and weekly occurrences step from the start, never drifting"""
+        start = to_epoch(datetime(2024, 1, 1, 9, 0))
+        self.assertEqual(next_occurrence(start, "daily", start), to_epoch(datetime(2024, 1, 2, 9, 0)))
+        self.assertEqual(next_occurrence(start, "weekly", to_epoch(datetime(2024, 1, 20))),
+                         to_epoch(datetime(2024, 1, 22, 9, 0)))
+        self.assertEqual(next_occurrence(start, "daily", start - 1), start)
+
+    def test_months_clamp_to_month_end(self):
+        """A monthly expense on the 31st falls on the last day of short months and returns to the 31st"""
+        start = to_epoch(datetime(2024, 1, 31))
+        feb = next_occurrence(start, "monthly", start)
+        self.assertEqual(feb, to_epoch(datetime(2024, 2, 29)))
+        self.assertEqual(next_occurrence(start, "monthly", feb), to_epoch(datetime(2024, 3, 31)))
+        self.assertEqual(next_occurrence(start, "yearly", start), to_epoch(datetime(2025, 1, 31)))
+
+
+def counts(added):
+    """{user_id: number of rows} from what auto_add_recurring returns"""
+    return {user_id: len(rows) for user_id, rows in added.items()}
+
+
+class TestRecurringScheduler(unittest.TestCase):
+    """Test materializing due recurring expenses"""
+
+    def setUp(self):
+        """SQLite store with a daily and a monthly recurring expense"""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, "test.db")
+        self.db = ExpenseDatabase(self.db_path)
+        self.recurring = ExpenseRecurring(self.db)
+        self.now = datetime(2024, 3, 10, 12, 0)
+        self.rent = self.recurring.add_recurring_expense(1, 10000, "Utilities", "Rent", "monthly",
+                                                         start=datetime(2024, 1, 1))
+        self.milk = self.recurring.add_recurring_expense(2, 30, "Food", "Milk", "daily",
+                                                         start=self.now - timedelta(days=2))
+
+    def tearDown(self):
+        """Close connections and remove the database"""
+        self.db.close()
+        self.tmp_dir.cleanup()
+
+    def test_catches_up_once(self):
+        """Every missed occurrence is stored on the first tick, and only once"""
+        self.assertEqual(counts(self.recurring.auto_add_recurring(self.now)), {1: 3, 2: 3})
+        self.assertEqual([row[1] for row in self.db.get_expenses(1)], [10000] * 3)
+        self.assertEqual(counts(self.recurring.auto_add_recurring(self.now)), {})
+
+        # A restart reloads next_due from the store instead of replaying
+        self.assertEqual(counts(ExpenseRecurring(self.db).auto_add_recurring(self.now)), {})
+        self.assertEqual(counts(self.recurring.auto_add_recurring(self.now + timedelta(days=1))), {2: 1})
+
+        schedule = {row[0]: row[6] for row in self.db.get_recurring_expenses(1)}
+        self.assertEqual(schedule[self.rent], to_epoch(datetime(2024, 4, 1)))
+
+    def test_replay_is_idempotent(self):
+        """Occurrences that were already stored are skipped, and next_due never moves back"""
+        due = to_epoch(datetime(2024, 1, 1))
+        occurrences = [(1, self.rent, due, to_epoch(datetime(2024, 2, 1)))]
+        self.assertEqual(self.db.materialize_recurring(occurrences), {1: [(10000, 'Utilities', due)]})
+        self.assertEqual(self.db.materialize_recurring(occurrences), {})
+
+        RecurringScheduler(self.db).tick(self.now)
+        self.assertEqual(len(self.db.get_expenses(1)), 3)
+        self.db.materialize_recurring(occurrences)
+        self.assertEqual(self.db.get_recurring_expenses(1)[0][6], to_epoch(datetime(2024, 4, 1)))
+
+    def test_cancel_and_new_entries(self):
+        """Cancelled expenses stop; ones added after the first tick join the heap"""
+        self.recurring.auto_add_recurring(self.now)
+        self.assertTrue(self.recurring.cancel_recurring_expense(2, self.milk))
+        self.assertFalse(self.recurring.cancel_recurring_expense(1, self.milk))
+        self.recurring.add_recurring_expense(1, 200, "Entertainment", "Gym", "weekly", start=self.now)
+        self.assertEqual(counts(self.recurring.auto_add_recurring(self.now + timedelta(days=7))), {1: 2})
+
+    def test_add_due_stores_only_that_expense(self):
+        """A new expense's due occurrence is stored at once, leaving other due rows to the next tick"""
+        gym = self.recurring.add_recurring_expense(3, 200, "Entertainment", "Gym", "weekly",
+                                                   start=self.now - timedelta(days=1))
+        self.assertEqual(self.recurring.add_due(3, gym, self.now),
+                         {3: [(200, "Entertainment", to_epoch(self.now - timedelta(days=1)))]})
+        self.assertEqual(self.recurring.add_due(3, gym, self.now), {})
+        self.assertEqual(self.db.get_expenses(1), [])
+        self.assertEqual(counts(self.recurring.auto_add_recurring(self.now)), {1: 3, 2: 3})
+        self.assertEqual(counts(self.recurring.auto_add_recurring(self.now + timedelta(days=6))), {2: 6, 3: 1})
+
+    def test_ticks_per_shard(self):
+        """Each shard's tick stores only its own users' occurrences"""
+        db = ExpenseDatabase(os.path.join(self.tmp_dir.name, "sharded.db"), shards=2)
+        try:
+            recurring = ExpenseRecurring(db)
+            users = range(1, 20)
+            for user_id in users:
+                recurring.add_recurring_expense(user_id, 30, "Food", "Milk", "daily", start=self.now)
+            for shard in range(2):
+                added = recurring.auto_add_recurring(self.now, shard)
+                self.assertEqual(set(added), {user_id for user_id in users if shard_for(user_id, 2) == shard})
+            self.assertEqual(recurring.auto_add_recurring(self.now), {})
+        finally:
+            db.close()
+
+    def test_inserted_rows_feed_budget_alerts(self):
+        """Materialized rows come back with amount, category and time, ready for the alert engine"""
+        engine = BudgetAlertEngine(self.db)
+        self.db.set_budget_limit(3, 'daily', 1000)
+        engine.record_expense(3, 0)
+        now = datetime.utcnow()
+        self.recurring.add_recurring_expense(3, 800, "Utilities", "Power", "monthly", start=now - timedelta(minutes=1))
+        rows = self.recurring.auto_add_recurring(now)[3]
+        self.assertEqual([row[:2] for row in rows], [(800, "Utilities")])
+        self.assertEqual(engine.record_expense(3, *rows[0]), [('daily', 75, 800, 1000)])
+
+    def test_validation(self):
+        """Unknown frequencies and categories and non-positive amounts are refused"""
+        with self.assertRaises(ValueError):
+            self.recurring.add_recurring_expense(1, 10, "Food", "Tea", "hourly")
+        with self.assertRaises(ValueError):
+            self.recurring.add_recurring_expense(1, 10, "Snacks", "Tea")
+        with self.assertRaises(ValueError):
+            self.recurring.add_recurring_expense(1, 0, "Food", "Tea")
+
+    def test_in_memory_engine(self):
+        """The in-memory engine materializes and dedupes the same way"""
+        recurring = ExpenseRecurring(InMemoryExpenseDatabase())
+        recurring.add_recurring_expense(1, 30, "Food", "Milk", "daily", start=self.now - timedelta(days=2))
+        self.assertEqual(counts(recurring.auto_add_recurring(self.now)), {1: 3})
+        self.assertEqual(counts(ExpenseRecurring(recurring.db).auto_add_recurring(self.now)), {})
+
+
+class TestRecurringJob(unittest.IsolatedAsyncioTestCase):
+    """Test the bot's recurring job over a sharded store"""
+
+    async def test_job_ticks_every_shard(self):
+        """The job stores every shard's due rows and alerts their users"""
+        import bot_commands
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        db = bot_commands.open_store(ExpenseDatabase(os.path.join(tmp_dir.name, "test.db"), shards=2))
+        self.addCleanup(setattr, bot_commands, "db", None)
+        try:
+            now = datetime.utcnow()
+            for user_id in (1, 2, 3, 4):
+                db.sync.set_budget_limit(user_id, 'daily', 100)
+                bot_commands.recurring.add_recurring_expense(user_id, 90, "Food", "Milk", "daily",
+                                                             start=now - timedelta(minutes=1))
+            sent = []
+
+            class Bot:
+                async def send_message(self, user_id, text, **kwargs):
+                    sent.append(user_id)
+
+            class Context:
+                bot = Bot()
+
+            await bot_commands.recurring_job(Context())
+            self.assertEqual(sorted(sent), [1, 2, 3, 4])
+            self.assertEqual({shard_for(user_id, 2) for user_id in sent}, {0, 1})
+        finally:
+            db.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
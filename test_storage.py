@@ -0,0 +1,202 @@
+"""
+Test suite for the pluggable storage engines
+The same contract runs against SQLite and the in-memory engine.
+"""
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from async_database import AsyncExpenseDatabase
+from database import ExpenseDatabase, to_epoch
+from excel_exporter import ExcelExporter
+from storage import ExpenseStore, InMemoryExpenseDatabase, create_store
+
+
+class StoreContract:
+    """Behaviour every ExpenseStore must share; mixed into one TestCase per engine"""
+
+    def make_store(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        """Create an empty store"""
+        self.store = self.make_store()
+        self.user_id = 123456
+
+    def tearDown(self):
+        """Close the store"""
+        self.store.close()
+
+    def _import(self, user_id, *expenses):
+        """Insert (amount, category, description, datetime[, transaction_id]) rows"""
+        return self.store.import_expenses(user_id, [
+            (amount, category, description, to_epoch(date), "text", txid[0] if txid else None, None, None)
+            for amount, category, description, date, *txid in expenses
+        ])
+
+    def test_implements_protocol(self):
+        """The engine satisfies the ExpenseStore protocol"""
+        self.assertIsInstance(self.store, ExpenseStore)
+
+    def test_rows_are_newest_first_and_page_by_cursor(self):
+        """get_expenses orders by time and keyset cursors walk both ways"""
+        now = datetime.utcnow().replace(microsecond=0)
+        self._import(self.user_id, *[(i, "Food", f"meal {i}", now - timedelta(hours=i)) for i in range(1, 8)])
+        rows = self.store.get_expenses(self.user_id)
+        self.assertEqual([row[1] for row in rows], [1, 2, 3, 4, 5, 6, 7])
+        self.assertEqual(rows[0][4], to_epoch(now - timedelta(hours=1)))
+
+        page = self.store.get_expenses(self.user_id, limit=3, before_ts=rows[2][4], before_id=rows[2][0])
+        self.assertEqual([row[1] for row in page], [4, 5, 6])
+        back = self.store.get_expenses(self.user_id, limit=2, after_ts=page[0][4], after_id=page[0][0])
+        self.assertEqual([row[1] for row in back], [2, 3])
+        with self.assertRaises(ValueError):
+            self.store.get_expenses(self.user_id, before_ts=rows[0][4])
+
+    def test_windows_and_totals(self):
+        """Summaries and budget totals cover the same calendar-day windows"""
+        now = datetime.utcnow()
+        self._import(self.user_id,
+                     (100, "Food", "today", now),
+                     (50, "Transport", "bus", now - timedelta(days=3)),
+                     (30, "Food", "old", now - timedelta(days=20)),
+                     (999, "Food", "ancient", now - timedelta(days=90)))
+        self._import(654321, (5, "Food", "someone else", now))
+
+        self.assertEqual(self.store.get_summary(self.user_id, 30), [("Food", 130, 2), ("Transport", 50, 1)])
+        self.assertEqual(self.store.get_multi_window_summary(self.user_id, [30, 1, 7]), {
+            1: [("Food", 100, 1)],
+            7: [("Food", 100, 1), ("Transport", 50, 1)],
+            30: [("Food", 130, 2), ("Transport", 50, 1)],
+        })
+        self.assertEqual(self.store.get_total_today(self.user_id), 100)
+        self.assertEqual(self.store.get_total_week(self.user_id), 150)
+        self.assertEqual(self.store.get_total_month(self.user_id), 180)
+        self.assertEqual(len(self.store.get_expenses(self.user_id, days=7)), 2)
+        self.assertEqual([row[1:] for row in self.store.get_daily_totals(self.user_id, 7)],
+                         [("Transport", 50), ("Food", 100)])
+
+        self.store.set_budget_limit(self.user_id, 'daily', 500)
+        self.store.set_budget_limit(self.user_id, 'monthly', 5000)
+        self.assertEqual(self.store.get_budget_limits(self.user_id), (500, None, 5000))
+        self.assertEqual(tuple(self.store.get_budget_snapshot(self.user_id)), (500, None, 5000, 100, 150, 180))
+
+    def test_category_budgets(self):
+        """Category budgets upsert, report 30-day spending and can be removed"""
+        now = datetime.utcnow()
+        self._import(self.user_id, (100, "Food", "lunch", now), (40, "Food", "old", now - timedelta(days=45)))
+        self.store.set_category_budget(self.user_id, "Travel", 500)
+        self.store.set_category_budget(self.user_id, "Food", 2000)
+        self.store.set_category_budget(self.user_id, "Food", 3000)
+        self.store.set_category_budget(654321, "Food", 1)
+        self.assertEqual(self.store.get_category_budgets(self.user_id), [("Food", 3000, 100), ("Travel", 500, 0)])
+
+        self.store.set_category_budget(self.user_id, "Travel", None)
+        self.assertEqual(self.store.get_category_budgets(self.user_id), [("Food", 3000, 100)])
+
+    def test_delete_updates_totals(self):
+        """Deleting an expense removes it from rows and totals, only for its owner"""
+        self.store.add_expense(self.user_id, 40, "Food", "Lunch")
+        self.store.add_expense(self.user_id, 60, "Food", "Dinner")
+        self.store.flush()
+        expense_id = self.store.get_expenses(self.user_id, limit=1)[0][0]
+
+        self.store.delete_expense(expense_id, 654321)
+        self.assertEqual(self.store.get_total_today(self.user_id), 100)
+        self.store.delete_expense(expense_id, self.user_id)
+        self.assertEqual(len(self.store.get_expenses(self.user_id)), 1)
+        self.assertEqual(self.store.get_total_today(self.user_id), 40)
+        self.assertEqual(self.store.get_summary(self.user_id, 1), [("Food", 40, 1)])
+
+    def test_transaction_ids_are_unique_per_user(self):
+        """A repeated transaction_id is refused for the same user only"""
+        self.assertTrue(self.store.add_expense(self.user_id, 10, "Food", "Tea", transaction_id="UTR1"))
+        self.assertFalse(self.store.add_expense(self.user_id, 10, "Food", "Tea", transaction_id="UTR1"))
+        self.assertTrue(self.store.add_expense(654321, 10, "Food", "Tea", transaction_id="UTR1"))
+        now = datetime.utcnow()
+        self.assertEqual(self._import(self.user_id, (1, "Food", "a", now, "UTR1"), (2, "Food", "b", now, "UTR2"),
+                                      (3, "Food", "c", now, "UTR2")), (1, 2))
+
+    def test_iter_and_search(self):
+        """Streaming respects time bounds; search matches words, prefixes and accents per user"""
+        self._import(self.user_id,
+                     (1, "Food", "Chicken biryani", datetime(2024, 1, 5)),
+                     (2, "Food", "Café latte", datetime(2024, 2, 5)),
+                     (3, "Food", "Veg biryani", datetime(2024, 3, 5)))
+        self._import(654321, (4, "Food", "Mutton biryani", datetime(2024, 3, 5)))
+
+        rows = list(self.store.iter_expenses(self.user_id, start=datetime(2024, 2, 1), end=datetime(2024, 3, 5)))
+        self.assertEqual([row[1] for row in rows], [2])
+        self.assertEqual(sorted(row[1] for row in self.store.search_expenses(self.user_id, "biry")), [1, 3])
+        self.assertEqual([row[1] for row in self.store.search_expenses(self.user_id, "chicken biryani")], [1])
+        self.assertEqual([row[1] for row in self.store.search_expenses(self.user_id, "cafe")], [2])
+        self.assertEqual(self.store.search_expenses(self.user_id, "biryani", start=datetime(2024, 4, 1)), [])
+        self.assertEqual(len(self.store.search_expenses(self.user_id, "biryani", limit=1, offset=1)), 1)
+
+    def test_users_and_snapshot(self):
+        """Users are remembered and read_snapshot wraps a group of reads"""
+        self.assertFalse(self.store.is_known_user(self.user_id, "alice", "Alice"))
+        self.store.add_user(self.user_id, "alice", "Alice")
+        self.assertTrue(self.store.is_known_user(self.user_id, "alice", "Alice"))
+        with self.store.read_snapshot(self.user_id):
+            self.assertEqual(self.store.get_total_month(self.user_id), 0)
+        self.assertEqual(self.store.get_shard_stats()[0][1], 1)
+
+
+class TestSQLiteStore(StoreContract, unittest.TestCase):
+    """Contract tests against the SQLite engine"""
+
+    def make_store(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        return ExpenseDatabase(os.path.join(self.tmp_dir.name, "test.db"))
+
+
+class TestInMemoryStore(StoreContract, unittest.TestCase):
+    """Contract tests against the in-memory engine"""
+
+    def make_store(self):
+        return InMemoryExpenseDatabase()
+
+    def test_factory_and_consumers(self):
+        """create_store picks engines by name and the exporter and async facade accept them"""
+        self.assertIsInstance(create_store("memory"), InMemoryExpenseDatabase)
+        with self.assertRaises(ValueError):
+            create_store("postgres")
+
+        self.store.add_expense(self.user_id, 75, "Food", "Lunch")
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = ExcelExporter(self.store).export_csv(self.user_id, os.path.join(tmp_dir, "out.csv"))
+            with open(filename, encoding='utf-8') as f:
+                self.assertEqual(len(f.readlines()), 2)
+
+
+class TestAsyncInMemoryStore(unittest.IsolatedAsyncioTestCase):
+    """The async facade runs unchanged over the in-memory engine"""
+
+    async def test_async_facade(self):
+        db = AsyncExpenseDatabase(InMemoryExpenseDatabase())
+        try:
+            await db.add_user(1, "bob", "Bob")
+            self.assertTrue(await db.add_expense(1, 20, "Food", "Snack"))
+            self.assertEqual(await db.get_total_today(1), 20)
+        finally:
+            db.close()
+
+    async def test_bot_commands_open_their_store(self):
+        """Importing the bot commands opens no database; open_store() builds them on the given engine"""
+        import bot_commands
+        self.assertIsNone(bot_commands.db)
+        store = InMemoryExpenseDatabase()
+        db = bot_commands.open_store(store)
+        self.addCleanup(setattr, bot_commands, "db", None)
+        try:
+            self.assertIs(bot_commands.recurring.db, store)
+            await db.add_expense(1, 20, "Food", "Snack")
+            self.assertEqual(await bot_commands.budget_alert_lines(1, 20, "Food"), [])
+        finally:
+            db.close()
+
+
+if __name__ == '__main__':
+    unittest.main()